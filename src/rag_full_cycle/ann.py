@@ -0,0 +1,220 @@
+import numpy as np
+
+
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def inverse_row_norms(matrix, block_size=65536):
+    """1/|row| for every row, read in blocks so memory-mapped matrices are never loaded whole"""
+    norms = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        norms[start:start + block_size] = np.linalg.norm(block, axis=1)
+    norms[norms == 0] = 1.0
+    return 1.0 / norms
+
+
+def select_top_k(scores, k):
+    """Sorted (indices, scores) of the k highest scores in every row of a 2-D array"""
+    k = min(k, scores.shape[1])
+    # argpartition finds the top k unordered, then only those are sorted
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def exact_top_k(queries, matrix, inverse_norms, k, block_size=65536):
+    """Sorted (indices, scores) of the exact cosine top k of each normalized query, reading
+    the matrix in row blocks so a memory-mapped matrix is never loaded whole"""
+    k = min(k, len(matrix))
+    top = np.zeros((len(queries), 0), dtype=np.int64)
+    top_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        scores = (queries @ block.T) * inverse_norms[start:start + block_size]
+        # the best k so far compete with the block, so only k + block_size scores are held
+        candidates = np.concatenate((top, np.arange(start, start + len(block))[None, :].repeat(len(queries), 0)), axis=1)
+        scores = np.concatenate((top_scores, scores), axis=1)
+        best, top_scores = select_top_k(scores, k)
+        top = np.take_along_axis(candidates, best, axis=1)
+    return top, top_scores
+
+
+def nearest_centroids(data, centroids, block_size=8192, spherical=True):
+    """Index of the closest centroid for every row, computed in blocks to bound memory"""
+    assignments = np.empty(len(data), dtype=np.int32)
+    centroid_norms = None if spherical else (centroids ** 2).sum(axis=1)
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        similarity = block @ centroids.T
+        if not spherical:
+            # argmin |x - c|^2 == argmax (2 x.c - |c|^2)
+            similarity = 2 * similarity - centroid_norms
+        assignments[start:start + block_size] = np.argmax(similarity, axis=1)
+    return assignments
+
+
+def kmeans(data, k, iterations=20, seed=0, max_train_points=256, spherical=True):
+    """k-means trained on at most max_train_points per centroid, spherical (cosine) by default"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    train = data
+    if len(data) > k * max_train_points:
+        train = data[rng.choice(len(data), k * max_train_points, replace=False)]
+    centroids = np.array(train[rng.choice(len(train), k, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assignments = nearest_centroids(train, centroids, spherical=spherical)
+        counts = np.bincount(assignments, minlength=k)
+        # sort by cluster so each centroid is one contiguous reduceat segment
+        order = np.argsort(assignments, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        present = counts > 0
+        sums[present] = np.add.reduceat(train[order], starts[present], axis=0)
+        empty = counts == 0
+        # re-seed empty clusters with random points so every list stays usable
+        sums[empty] = train[rng.choice(len(train), int(empty.sum()))]
+        counts[empty] = 1
+        centroids = normalize(sums) if spherical else sums / counts[:, None]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted file index: vectors are bucketed by their nearest k-means centroid and a
+    query only scans the nprobe buckets closest to it"""
+
+    def __init__(self, nlist=0, nprobe=8, iterations=20):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.ids = []
+        self.id_rows = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self.lists = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def train(self):
+        # sqrt(N) lists keeps both the coarse and the fine scan around sqrt(N) per query
+        nlist = self.nlist or max(1, int(np.sqrt(len(self.ids))))
+        self.centroids = kmeans(self.matrix, nlist, self.iterations)
+        self.assignments = nearest_centroids(self.matrix, self.centroids)
+        self.trained_size = len(self.ids)
+        self.lists = None
+
+    def build(self, ids, matrix):
+        self.ids = list(ids)
+        self.id_rows = {id: row for row, id in enumerate(self.ids)}
+        self.matrix = normalize(matrix)
+        self.train()
+
+    def add(self, ids, matrix):
+        """Insert or replace vectors without retraining, unless the index has grown 4x since training"""
+        if self.centroids is None:
+            self.build(ids, matrix)
+            return
+        matrix = normalize(matrix)
+        new_ids = []
+        new_rows = []
+        for id, vector in zip(ids, matrix):
+            row = self.id_rows.get(id)
+            if row is None:
+                self.id_rows[id] = len(self.ids) + len(new_ids)
+                new_ids.append(id)
+                new_rows.append(vector)
+            elif row < len(self.ids):
+                self.matrix[row] = vector
+                self.assignments[row] = nearest_centroids(vector[None, :], self.centroids)[0]
+            else:
+                new_rows[row - len(self.ids)] = vector
+        if new_rows:
+            new_rows = np.stack(new_rows)
+            self.ids.extend(new_ids)
+            self.matrix = np.concatenate([self.matrix, new_rows])
+            self.assignments = np.concatenate([self.assignments, nearest_centroids(new_rows, self.centroids)])
+        if len(self.ids) > 4 * self.trained_size:
+            self.train()
+        self.lists = None
+
+    def remove(self, ids):
+        """Drop vectors by id, the centroids are kept"""
+        drop = {self.id_rows[id] for id in ids if id in self.id_rows}
+        if not drop:
+            return
+        keep = np.array([row not in drop for row in range(len(self.ids))], dtype=bool)
+        self.ids = [id for id, kept in zip(self.ids, keep) if kept]
+        self.id_rows = {id: row for row, id in enumerate(self.ids)}
+        self.matrix = self.matrix[keep]
+        self.assignments = self.assignments[keep]
+        self.lists = None
+
+    def inverted_lists(self):
+        if self.lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        return self.lists
+
+    def search(self, queries, top_k, nprobe=None):
+        """Return (rows, scores) arrays of shape (len(queries), top_k), rows padded with -1"""
+        queries = normalize(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        lists = self.inverted_lists()
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for q, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([lists[p] for p in probe])
+            if len(candidates) == 0:
+                continue
+            candidate_scores = self.matrix[candidates] @ query
+            k = min(top_k, len(candidates))
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+            top = top[np.argsort(-candidate_scores[top])]
+            rows[q, :k] = candidates[top]
+            scores[q, :k] = candidate_scores[top]
+        return rows, scores
+
+    def exact_search(self, queries, top_k):
+        return select_top_k(normalize(queries) @ self.matrix.T, top_k)[0]
+
+    def measure_recall(self, queries, top_k, nprobe=None):
+        """Fraction of the exact top_k neighbours that the approximate search also returns"""
+        approximate, _ = self.search(queries, top_k, nprobe)
+        exact = self.exact_search(queries, top_k)
+        found = sum(len(np.intersect1d(a[a >= 0], e)) for a, e in zip(approximate, exact))
+        return found / exact.size if exact.size else 1.0
+
+    def save(self, path):
+        np.savez(
+            path,
+            ids=np.array(self.ids),
+            matrix=self.matrix,
+            centroids=self.centroids,
+            assignments=self.assignments,
+            params=np.array([self.nlist, self.nprobe, self.iterations, self.trained_size])
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        nlist, nprobe, iterations, trained_size = (int(v) for v in data["params"])
+        index = cls(nlist, nprobe, iterations)
+        index.ids = data["ids"].tolist()
+        index.id_rows = {id: row for row, id in enumerate(index.ids)}
+        index.matrix = data["matrix"]
+        index.centroids = data["centroids"]
+        index.assignments = data["assignments"]
+        index.trained_size = trained_size
+        return index
@@ -0,0 +1,159 @@
+import io
+import json
+import os
+import logfire
+
+ZSTD_SUFFIX = ".zst"
+
+
+def artifact_path(directory, name, compression="none"):
+    """Path of a record artifact: {name}.ndjson, or {name}.ndjson.zst with zstd compression"""
+    if compression not in ("none", "zstd"):
+        raise ValueError(f"Unknown artifact compression: {compression}")
+    return f"{directory}/{name}.ndjson" + (ZSTD_SUFFIX if compression == "zstd" else "")
+
+
+def legacy_json_path(path):
+    """The single-document .json file an artifact was written as before NDJSON"""
+    if path.endswith(ZSTD_SUFFIX):
+        path = path[:-len(ZSTD_SUFFIX)]
+    if path.endswith(".ndjson"):
+        path = path[:-len(".ndjson")]
+    return path + ".json"
+
+
+def partial_path(path):
+    """Uncompressed progress file next to an artifact, appended to while the step runs"""
+    return legacy_json_path(path)[:-len(".json")] + ".partial.ndjson"
+
+
+def artifact_exists(path):
+    return os.path.exists(path) or os.path.exists(legacy_json_path(path))
+
+
+def open_text(path, mode):
+    """Open an artifact for reading ("r"), writing ("w") or appending ("a") as text.
+
+    .zst files are compressed with zstandard, an optional dependency (pip install
+    rag-full-cycle[zstd]). Appending adds a new zstd frame, which readers handle.
+    """
+    if not path.endswith(ZSTD_SUFFIX):
+        return open(path, mode, encoding="utf-8")
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd artifacts need the zstandard package: pip install rag-full-cycle[zstd]") from e
+    raw = open(path, mode + "b")
+    if mode == "r":
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    else:
+        stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def iter_records(path):
+    """Yield the records of an artifact one at a time.
+
+    Falls back to the legacy .json file when the NDJSON artifact does not exist; a
+    legacy file is one JSON array, so it is parsed whole before the first record.
+    """
+    if not os.path.exists(path) and os.path.exists(legacy_json_path(path)):
+        path = legacy_json_path(path)
+    if path.endswith(".json"):
+        with open(path, 'r') as f:
+            yield from json.load(f)
+        return
+    with open_text(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_records(path):
+    return list(iter_records(path))
+
+
+class RecordWriter:
+    """Writes records to an artifact one line at a time.
+
+    With append=True records are added to an existing file, which is how a step resumes
+    from a partial file. flush() makes everything written so far readable.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self.count = 0
+        self.file = None
+
+    def open(self):
+        self.file = open_text(self.path, "a" if self.append else "w")
+        return self
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+
+class ArtifactWriter(RecordWriter):
+    """Writes records to a temporary file that replaces path only when closed without an
+    error, so readers and the DAG never see a half-written artifact"""
+
+    def __init__(self, path):
+        directory, name = os.path.split(path)
+        super().__init__(os.path.join(directory, f".{name}.tmp") + (ZSTD_SUFFIX if path.endswith(ZSTD_SUFFIX) else ""))
+        self.final_path = path
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.discard()
+            return
+        try:
+            self.close()
+        except BaseException:
+            self.discard()
+            raise
+        os.replace(self.path, self.final_path)
+
+
+def write_records(path, records):
+    """Stream records to path and return how many were written"""
+    with ArtifactWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+def migrate_legacy_json(path):
+    """Write a legacy .json artifact as path next to it, returns True if it did.
+
+    The legacy file is left in place, like the vector converter leaves vectors-*.json:
+    the outputs of older runs may be tracked in git. Its manifest describes the .json
+    file, not the new artifact, so it is dropped and the DAG adopts the converted artifact.
+    """
+    legacy = legacy_json_path(path)
+    if os.path.exists(path) or not os.path.exists(legacy):
+        return False
+    count = write_records(path, iter_records(legacy))
+    if os.path.exists(f"{legacy}.manifest.json"):
+        os.remove(f"{legacy}.manifest.json")
+    logfire.info("Converted {legacy} to {path} ({count} records)", legacy=legacy, path=path, count=count)
+    return True
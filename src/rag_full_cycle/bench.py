@@ -0,0 +1,436 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+import numpy as np
+import logfire
+from .config import available_datasets, load_settings
+from .artifacts import artifact_exists, artifact_path, read_records
+from .ann import normalize, select_top_k
+from .bm25 import BM25Index, tokenize_terms
+from .chunks import Chunks, tokenize_extract
+from .embeddings import Embeddings
+from .evals import Evals
+from .extracts import Extracts
+from .metrics import configure_logging
+from .questions import Questions
+from .retrievers import Retrievers
+from .vector_stores import VectorStore
+from .vectors import Vectors
+
+STAGES = ("extract", "tokenize", "chunk", "embed", "upsert", "questions", "dense", "bm25_build", "bm25", "evaluate")
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic stand-in for the Ollama embedder: hashed bag-of-words vectors, so texts
+    sharing terms score close, returned after latency seconds per request. Never cached."""
+
+    def __init__(self, settings, dimension=384, latency=0.0):
+        self.settings = settings
+        self.dimension = dimension
+        self.latency = latency
+        self.cache = None
+
+    def request_embeddings(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in tokenize_terms(text):
+                digest = zlib.crc32(term.encode("utf-8"))
+                matrix[row, digest % self.dimension] += 1.0 if digest & 0x80000000 else -1.0
+        return matrix.tolist()
+
+
+class FakeChatClient:
+    """Stand-in for ollama.AsyncClient: questions made from the words of the chunk in the
+    prompt, answered after latency seconds"""
+
+    def __init__(self, prompt_template, latency=0.0, questions=3):
+        prefix, _, suffix = prompt_template.partition("{chunk}")
+        self.prefix = prefix.replace("{{", "{").replace("}}", "}")
+        self.suffix = suffix.replace("{{", "{").replace("}}", "}")
+        self.latency = latency
+        self.questions = questions
+
+    async def chat(self, model, messages, options=None):
+        await asyncio.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        words = prompt[len(self.prefix):len(prompt) - len(self.suffix)].split()
+        step = max(1, len(words) // self.questions)
+        lines = [f"What does the text say about {' '.join(words[i:i + 6])}?"
+                 for i in range(0, len(words), step)][:self.questions]
+        return {"message": {"content": "\n".join(lines)}}
+
+
+class MemoryStore(VectorStore):
+    """In-memory stand-in for Pinecone: exact cosine search over the upserted vectors"""
+
+    def __init__(self):
+        self.ids = []
+        self.matrix = None
+
+    def upsert(self, vectors, dimension):
+        self.ids = [vector["id"] for vector in vectors]
+        self.matrix = normalize([vector["values"] for vector in vectors])
+
+    def query_batch(self, query_embeddings, top_k):
+        top, top_scores = select_top_k(normalize(query_embeddings) @ self.matrix.T, top_k)
+        return [
+            [{'id': self.ids[i], 'score': float(score)} for i, score in zip(row, row_scores)]
+            for row, row_scores in zip(top, top_scores)
+        ]
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # no /proc: fall back to the peak so far, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Stage:
+    """Measures one stage: wall time, one latency per sample (a page, a batch, a query)
+    and the peak RSS, sampled by a background thread while the stage runs"""
+
+    def __init__(self, name, interval=0.005):
+        self.name = name
+        self.interval = interval
+        self.items = 0
+        self.latencies = []
+        self.seconds = 0.0
+        self.peak_rss = 0
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.started = None
+
+    def __enter__(self):
+        self.peak_rss = current_rss()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self.stopped.set()
+        self.sampler.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def record(self, seconds, items=1):
+        self.latencies.append(seconds)
+        self.items += items
+
+    def timed(self, iterable):
+        """Yield from iterable, recording the time taken to produce each item"""
+        started = time.perf_counter()
+        for item in iterable:
+            self.record(time.perf_counter() - started)
+            yield item
+            started = time.perf_counter()
+
+    def summary(self):
+        latencies = np.asarray(self.latencies) * 1000
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "samples": len(latencies),
+            "seconds": round(self.seconds, 4),
+            "throughput": round(self.items / self.seconds, 2) if self.seconds else None,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+            "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1),
+        }
+
+
+class Bench:
+    """Runs the pipeline stages for one chunk config against offline stand-ins.
+
+    Every stage reads the output of the stage before it. When that stage is not selected
+    its output comes from the cached artifact in the output dir, or is produced untimed.
+    Retrieval queries are the cached questions when they match the chunks, so the dense
+    and BM25 stages run real query text; otherwise the fake chat model's questions.
+    """
+
+    def __init__(self, settings, size, overlap, max_pages=None, embed_latency=0.0, chat_latency=0.0,
+                 question_chunks=200, queries=1000, dimension=384):
+        self.settings = settings
+        self.size = size
+        self.overlap = overlap
+        self.max_pages = max_pages
+        self.embed_latency = embed_latency
+        self.chat_latency = chat_latency
+        self.question_chunks = question_chunks
+        self.queries = queries
+        self.dimension = dimension
+        self.state = {}
+
+    def options(self):
+        return {
+            "size": self.size, "overlap": self.overlap, "max_pages": self.max_pages,
+            "embed_latency": self.embed_latency, "chat_latency": self.chat_latency,
+            "question_chunks": self.question_chunks, "queries": self.queries, "dimension": self.dimension,
+        }
+
+    def run(self, stages=STAGES):
+        results = []
+        for name in STAGES:
+            if name not in stages:
+                continue
+            self.prepare(name)
+            with Stage(name) as stage:
+                getattr(self, f"bench_{name}")(stage)
+            results.append(stage.summary())
+            logfire.info("Bench {stage}: {summary}", stage=name, summary=results[-1])
+        return results
+
+    def prepare(self, name):
+        """Compute the inputs of a stage before its timer starts"""
+        requires = {
+            "tokenize": ["pages"], "chunk": ["tokenized"], "embed": ["chunks"], "upsert": ["vectors"],
+            "questions": ["chunks"], "dense": ["chunks", "store", "queries"], "bm25_build": ["chunks"],
+            "bm25": ["index", "queries"], "evaluate": ["results"],
+        }
+        for key in requires.get(name, []):
+            self.require(key)
+
+    def require(self, key):
+        if key in self.state:
+            return self.state[key]
+        cached = {"pages": "extract", "chunks": f"chunks-{self.size}-{self.overlap}"}.get(key)
+        records = self.cached_records(cached) if cached else None
+        if records is not None:
+            self.state[key] = records
+            return records
+        if key == "queries":
+            self.state[key] = self.load_queries()
+            return self.state[key]
+
+        producers = {
+            "pages": "extract", "tokenized": "tokenize", "chunks": "chunk", "vectors": "embed",
+            "store": "upsert", "questions": "questions", "index": "bm25_build", "results": "dense",
+        }
+        self.prepare(producers[key])
+        getattr(self, f"bench_{producers[key]}")(Stage(producers[key]))
+        return self.state[key]
+
+    def cached_records(self, name):
+        path = artifact_path(self.settings.output_dir, name, self.settings.artifact_compression)
+        return read_records(path) if artifact_exists(path) else None
+
+    def load_queries(self):
+        """Flattened questions, repeated or cut to self.queries"""
+        chunk_ids = {chunk["id"] for chunk in self.require("chunks")}
+        questions_data = self.cached_records(f"questions-{self.size}-{self.overlap}")
+        if not questions_data or any(entry["chunk_id"] not in chunk_ids for entry in questions_data):
+            questions_data = self.require("questions")
+        all_questions = [
+            {"chunk_id": entry["chunk_id"], "text": entry["text"], "question": question}
+            for entry in questions_data for question in entry["questions"]
+        ]
+        return [all_questions[i % len(all_questions)] for i in range(self.queries)] if all_questions else []
+
+    def bench_extract(self, stage):
+        if self.settings.pdf_file_path is None:
+            raise SystemExit("The extraction bench needs a single-PDF dataset")
+        pages = list(stage.timed(Extracts(self.settings).stream_pages_parallel(self.settings.pdf_file_path, self.max_pages)))
+        self.state["pages"] = pages
+
+    def bench_tokenize(self, stage):
+        tokenized = []
+        for page in self.state["pages"]:
+            started = time.perf_counter()
+            tokenized.extend(tokenize_extract([page], self.settings.chunk_strategy, self.settings.chunk_tokenizer))
+            stage.record(time.perf_counter() - started)
+        self.state["tokenized"] = tokenized
+
+    def bench_chunk(self, stage):
+        chunker = Chunks(self.size, self.overlap, self.settings.chunk_strategy, self.settings.chunk_tokenizer)
+        chunks = []
+        for page in self.state["tokenized"]:
+            started = time.perf_counter()
+            page_chunks = list(chunker.iter_chunks([page]))
+            stage.record(time.perf_counter() - started, len(page_chunks))
+            chunks.extend(page_chunks)
+        self.state["chunks"] = chunks
+
+    def bench_embed(self, stage):
+        embedder = FakeEmbeddings(self.settings, self.dimension, self.embed_latency)
+        chunks = self.state["chunks"]
+        vectors = []
+        # the batching of Vectors.generate_embeddings_for_chunks without its rate-limit delay
+        for batch_start in range(0, len(chunks), self.settings.batch_size):
+            batch = chunks[batch_start:batch_start + self.settings.batch_size]
+            started = time.perf_counter()
+            embeddings = embedder.embed_many([chunk["text"] for chunk in batch])
+            stage.record(time.perf_counter() - started, len(batch))
+            vectors.extend({"id": chunk["id"], "values": embedding} for chunk, embedding in zip(batch, embeddings))
+        self.state["vectors"] = vectors
+
+    def bench_upsert(self, stage):
+        store = MemoryStore()
+        vectors = Vectors(self.settings, self.size, self.overlap, store=store)
+        started = time.perf_counter()
+        vectors.upsert_vectors(self.state["vectors"], self.dimension)
+        stage.record(time.perf_counter() - started, len(self.state["vectors"]))
+        self.state["store"] = store
+
+    def bench_questions(self, stage):
+        chunks = self.state["chunks"][:self.question_chunks]
+        question_generator = Questions(self.settings, self.size, self.overlap)
+        question_generator.cache = None
+        client = FakeChatClient(self.settings.question_generation_prompt, self.chat_latency)
+        chat = client.chat
+
+        async def timed_chat(*args, **kwargs):
+            started = time.perf_counter()
+            response = await chat(*args, **kwargs)
+            stage.record(time.perf_counter() - started)
+            return response
+
+        client.chat = timed_chat
+        self.state["questions"] = asyncio.run(question_generator.process_chunks_async(chunks, client=client))
+
+    def bench_dense(self, stage):
+        retriever = Retrievers(self.settings, self.size, self.overlap, self.state["chunks"], mode="dense", rerank=False)
+        retriever.embedding_generator = FakeEmbeddings(self.settings, self.dimension, self.embed_latency)
+        retriever.vector_generator = Vectors(self.settings, self.size, self.overlap, store=self.state["store"])
+        queries = self.state["queries"]
+        results = []
+        for batch_start in range(0, len(queries), self.settings.batch_size):
+            batch = queries[batch_start:batch_start + self.settings.batch_size]
+            started = time.perf_counter()
+            matches = retriever.retrieve(batch)
+            stage.record(time.perf_counter() - started, len(batch))
+            results.extend({"question_data": question, "similar_chunks": chunks} for question, chunks in zip(batch, matches))
+        self.state["results"] = results
+
+    def bench_bm25_build(self, stage):
+        started = time.perf_counter()
+        self.state["index"] = BM25Index().build(self.state["chunks"])
+        stage.record(time.perf_counter() - started, len(self.state["chunks"]))
+
+    def bench_bm25(self, stage):
+        index = self.state["index"]
+        for question in self.state["queries"]:
+            started = time.perf_counter()
+            index.search(question["question"], self.settings.top_k_results)
+            stage.record(time.perf_counter() - started)
+
+    def bench_evaluate(self, stage):
+        evaluator = Evals(self.state["results"], self.settings.eval_bootstrap_samples,
+                          self.settings.eval_confidence, self.settings.eval_seed)
+        started = time.perf_counter()
+        metrics = evaluator.metrics("similar_chunks", self.settings.eval_k)
+        stage.record(time.perf_counter() - started, len(self.state["results"]))
+        self.state["evals"] = metrics
+
+
+def compare(previous, current, threshold, min_seconds=0.05):
+    """Stages whose throughput fell or whose p99 rose by more than threshold since previous.
+    Stages shorter than min_seconds in either run are within timer noise and skipped."""
+    before = {stage["stage"]: stage for stage in previous["stages"]}
+    regressions = []
+    for stage in current["stages"]:
+        old = before.get(stage["stage"])
+        if old is None or min(old["seconds"], stage["seconds"]) < min_seconds:
+            continue
+        if old["throughput"] and stage["throughput"] is not None and stage["throughput"] < old["throughput"] * (1 - threshold):
+            regressions.append(f"{stage['stage']} throughput {old['throughput']} -> {stage['throughput']} items/s")
+        if old["p99_ms"] and stage["p99_ms"] is not None and stage["p99_ms"] > old["p99_ms"] * (1 + threshold):
+            regressions.append(f"{stage['stage']} p99 {old['p99_ms']} -> {stage['p99_ms']} ms")
+    return regressions
+
+
+def latest_result(bench_dir):
+    paths = sorted(glob.glob(f"{bench_dir}/bench-*.json"))
+    if not paths:
+        return None
+    with open(paths[-1], 'r') as f:
+        return json.load(f)
+
+
+def print_table(stages):
+    print(f"{'stage':<12}{'items':>8}{'seconds':>10}{'items/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>9}")
+    for stage in stages:
+        print(f"{stage['stage']:<12}{stage['items']:>8}{stage['seconds']:>10.3f}{stage['throughput'] or 0:>12.1f}"
+              f"{stage['p50_ms'] or 0:>10.3f}{stage['p99_ms'] or 0:>10.3f}{stage['peak_rss_mb']:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pipeline bench',
+                                     description='Benchmark the pipeline stages with offline stand-ins for Ollama and Pinecone')
+    parser.add_argument('dataset', nargs='?', default='fy10', choices=available_datasets(),
+                        help='Dataset whose PDF and cached artifacts are used')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help='Stages to measure (default: all)')
+    parser.add_argument('--size', type=int, default=None,
+                        help='Chunk size of the config to bench (default: the first of the dataset)')
+    parser.add_argument('--overlap', type=int, default=None,
+                        help='Chunk overlap of the config to bench (default: the first of the dataset)')
+    parser.add_argument('--max-pages', type=int, default=None, help='Stop extraction before this page')
+    parser.add_argument('--embed-latency', type=float, default=0.0, help='Seconds per fake embedding request')
+    parser.add_argument('--chat-latency', type=float, default=0.0, help='Seconds per fake chat request')
+    parser.add_argument('--question-chunks', type=int, default=200, help='Chunks to generate questions for')
+    parser.add_argument('--queries', type=int, default=1000, help='Retrieval queries to run')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative throughput drop or p99 rise reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on a regression')
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.dataset)
+    size = settings.chunk_sizes[0] if args.size is None else args.size
+    overlap = settings.chunk_overlaps[0] if args.overlap is None else args.overlap
+    # per-item logs would be timed as part of every stage
+    configure_logging(settings, console=False)
+    bench = Bench(settings, size, overlap, args.max_pages, args.embed_latency, args.chat_latency,
+                  args.question_chunks, args.queries)
+    result = {
+        "dataset": settings.dataset,
+        "timestamp": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": bench.options(),
+        "stages": bench.run(args.stages),
+    }
+    print_table(result["stages"])
+
+    bench_dir = f"{settings.output_dir}/bench"
+    os.makedirs(bench_dir, exist_ok=True)
+    previous = latest_result(bench_dir)
+    path = f"{bench_dir}/bench-{result['timestamp']}.json"
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved results to {path}")
+
+    if previous is None:
+        return 0
+    if previous["settings"] != result["settings"]:
+        print(f"Not comparing with the {previous['timestamp']} run, it used different settings")
+        return 0
+    regressions = compare(previous, result, args.threshold)
+    for regression in regressions:
+        print(f"Regression since {previous['timestamp']}: {regression}")
+    if not regressions:
+        print(f"No regressions since {previous['timestamp']}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
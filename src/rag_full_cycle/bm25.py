@@ -0,0 +1,188 @@
+import re
+import numpy as np
+
+TERM_PATTERN = re.compile(r"\d+(?:[.,]\d+)+|\w+")
+
+
+def tokenize_terms(text):
+    """Lowercased word terms; dotted or comma-grouped numbers such as section numbers and
+    statistics ("3.2.1", "1,250") are kept whole so they can be matched exactly"""
+    return TERM_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over chunks with postings stored CSR-style in flat NumPy arrays.
+
+    Term t owns postings offsets[t]:offsets[t + 1] of doc_ids (ascending) and impacts, the
+    precomputed BM25 contribution of t to each document. Postings are split into blocks of
+    block_size with the maximum impact of each block, which lets search skip documents
+    that cannot reach the current top-k (block-max MaxScore).
+    """
+
+    def __init__(self, k1=1.2, b=0.75, block_size=64):
+        self.k1 = k1
+        self.b = b
+        self.block_size = block_size
+        self.ids = None
+        self.vocabulary = {}
+        self.offsets = None
+        self.doc_ids = None
+        self.impacts = None
+        self.max_impacts = None
+        self.block_offsets = None
+        self.block_max = None
+        self.block_last_doc = None
+
+    def build(self, chunks):
+        self.ids = [chunk["id"] for chunk in chunks]
+        term_ids = []
+        doc_ids = []
+        doc_lengths = np.zeros(len(chunks), dtype=np.float32)
+        for doc, chunk in enumerate(chunks):
+            terms = tokenize_terms(chunk["text"])
+            doc_lengths[doc] = len(terms)
+            for term in terms:
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(doc)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        # one posting per (term, doc) pair with its term frequency, sorted by term then doc
+        pairs, frequencies = np.unique(term_ids * len(chunks) + doc_ids, return_counts=True)
+        posting_terms = pairs // max(len(chunks), 1)
+        self.doc_ids = (pairs % max(len(chunks), 1)).astype(np.int32)
+        document_frequency = np.bincount(posting_terms, minlength=len(self.vocabulary))
+        self.offsets = np.concatenate(([0], np.cumsum(document_frequency))).astype(np.int64)
+
+        idf = np.log1p((len(chunks) - document_frequency + 0.5) / (document_frequency + 0.5))
+        average_length = doc_lengths.mean() if len(chunks) else 1.0
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths[self.doc_ids] / max(average_length, 1e-9))
+        self.impacts = (idf[posting_terms] * frequencies * (self.k1 + 1) / (frequencies + norms)).astype(np.float32)
+        self.build_blocks()
+        return self
+
+    def build_blocks(self):
+        """Block boundaries restart at every term so a block never mixes two posting lists"""
+        block_counts = -(-np.diff(self.offsets) // self.block_size)
+        self.block_offsets = np.concatenate(([0], np.cumsum(block_counts))).astype(np.int64)
+        starts = np.concatenate([
+            np.arange(self.offsets[t], self.offsets[t + 1], self.block_size)
+            for t in range(len(self.offsets) - 1)
+        ]) if len(self.impacts) else np.zeros(0, dtype=np.int64)
+        self.block_max = np.maximum.reduceat(self.impacts, starts) if len(starts) else np.zeros(0, dtype=np.float32)
+        ends = np.minimum(starts + self.block_size, np.repeat(self.offsets[1:], block_counts)) - 1
+        self.block_last_doc = self.doc_ids[ends] if len(ends) else np.zeros(0, dtype=np.int32)
+        term_starts = self.offsets[:-1]
+        has_postings = np.diff(self.offsets) > 0
+        self.max_impacts = np.zeros(len(term_starts), dtype=np.float32)
+        self.max_impacts[has_postings] = np.maximum.reduceat(self.impacts, term_starts[has_postings])
+
+    def query_terms(self, text):
+        """(term id, query frequency) for the query terms that occur in the index"""
+        counts = {}
+        for term in tokenize_terms(text):
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                counts[term_id] = counts.get(term_id, 0) + 1
+        return list(counts.items())
+
+    def postings(self, term_id):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.impacts[start:end]
+
+    def search(self, text, top_k):
+        """Top-k [{"id", "score"}] by BM25.
+
+        Terms are scored in decreasing order of their maximum impact. Once the remaining
+        terms together cannot lift an unseen document past the k-th best score they are
+        non-essential: they are only looked up for the surviving candidates, and a
+        candidate is dropped as soon as its score plus the block maxima of the blocks
+        that could hold it falls below the threshold.
+        """
+        terms = self.query_terms(text)
+        if not terms or top_k <= 0:
+            return []
+        terms.sort(key=lambda term: -self.max_impacts[term[0]] * term[1])
+        upper_bounds = np.array([self.max_impacts[t] * weight for t, weight in terms], dtype=np.float32)
+        # remaining[i] = best possible contribution of terms i and later
+        remaining = np.concatenate((np.cumsum(upper_bounds[::-1])[::-1], [0.0]))
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        # lower bound of the final k-th best score: the k-th best among the documents of
+        # one posting list is never above the k-th best overall
+        threshold = 0.0
+        matched = np.zeros(len(self.ids), dtype=bool)
+        position = 0
+        while position < len(terms):
+            term_id, weight = terms[position]
+            docs, impacts = self.postings(term_id)
+            scores[docs] += impacts * weight
+            matched[docs] = True
+            position += 1
+            threshold = max(threshold, self.threshold(scores[docs], top_k))
+            if threshold >= remaining[position]:
+                break
+
+        # documents outside the essential postings score at most remaining[position] <= threshold
+        candidates = np.flatnonzero(matched)
+        if position < len(terms):
+            non_essential = terms[position:]
+            # first the cheap global bound, then the tighter per-block bounds read from the
+            # block skip lists only, so hopeless candidates never touch the postings
+            candidates = candidates[scores[candidates] + remaining[position] >= threshold]
+            threshold = max(threshold, self.threshold(scores[candidates], top_k))
+            candidates = candidates[scores[candidates] + self.block_bounds(non_essential, candidates).sum(axis=0) >= threshold]
+            for term_id, weight in non_essential:
+                docs, impacts = self.postings(term_id)
+                if len(candidates) * np.log2(len(docs) + 1) >= len(docs):
+                    # binary searches would cost more than scanning the whole posting list,
+                    # scores outside the candidates are never read again
+                    scores[docs] += impacts * weight
+                    continue
+                found = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                hit = docs[found] == candidates
+                scores[candidates[hit]] += impacts[found[hit]] * weight
+
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [{"id": self.ids[doc], "score": float(scores[doc])} for doc in candidates]
+
+    def threshold(self, candidate_scores, top_k):
+        if len(candidate_scores) < top_k:
+            return 0.0
+        return float(np.partition(candidate_scores, len(candidate_scores) - top_k)[len(candidate_scores) - top_k])
+
+    def block_bounds(self, terms, candidates):
+        """(len(terms), len(candidates)) upper bounds of each term's contribution to each
+        candidate: the max impact of the block whose doc range covers the candidate"""
+        bounds = np.zeros((len(terms), len(candidates)), dtype=np.float32)
+        for row, (term_id, weight) in enumerate(terms):
+            first, last = self.block_offsets[term_id], self.block_offsets[term_id + 1]
+            blocks = np.searchsorted(self.block_last_doc[first:last], candidates)
+            inside = blocks < last - first
+            bounds[row, inside] = self.block_max[first + blocks[inside]] * weight
+        return bounds
+
+    def search_batch(self, texts, top_k):
+        return [self.search(text, top_k) for text in texts]
+
+    def exact_search(self, text, top_k):
+        """Exhaustive scoring of every posting, the reference tests/test_bm25.py checks search against"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term_id, weight in self.query_terms(text):
+            docs, impacts = self.postings(term_id)
+            scores[docs] += impacts * weight
+        ranked = np.flatnonzero(scores)
+        ranked = ranked[np.lexsort((ranked, -scores[ranked]))][:top_k]
+        return [{"id": self.ids[doc], "score": float(scores[doc])} for doc in ranked]
+
+
+def reciprocal_rank_fusion(rankings, top_k, k=60):
+    """Fuse ranked [{"id", ...}] lists by summing 1 / (k + rank) per id"""
+    fused = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            fused[match["id"]] = fused.get(match["id"], 0.0) + 1.0 / (k + rank)
+    ranked = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+    return [{"id": chunk_id, "score": score} for chunk_id, score in ranked]
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import logfire
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SqliteLRUCache:
+    """Disk-backed key/value store with a size cap and least-recently-used eviction"""
+
+    def __init__(self, path, max_entries, name):
+        self.path = path
+        self.max_entries = max_entries
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # sweep configs run in threads with their own connections to the same file
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache(last_used)")
+        self.conn.commit()
+        self.hit_counter = logfire.metric_counter(f"{name}_cache_hits")
+        self.miss_counter = logfire.metric_counter(f"{name}_cache_misses")
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are cached and mark them as recently used"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self.lock:
+            # stay well below sqlite's host parameter limit
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE cache SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self.conn.commit()
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        self.hit_counter.add(hits)
+        self.miss_counter.add(len(keys) - hits)
+        return found
+
+    def put_many(self, items):
+        """Store (key, value) pairs and evict the least recently used entries above the cap"""
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, last_used) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items]
+            )
+            count = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def log_stats(self):
+        stats = self.stats()
+        logfire.info("{name} cache: {hits} hits, {misses} misses, {entries} entries",
+                     name=self.name, **stats)
+        return stats
+
+
+class EmbeddingCache(SqliteLRUCache):
+    """Embedding vectors stored as float32 blobs keyed by (model, text hash)"""
+
+    def __init__(self, path, max_entries):
+        super().__init__(path, max_entries, "embedding")
+
+    def key(self, model, text):
+        return f"{model}:{text_hash(text)}"
+
+    def get_embeddings(self, model, texts):
+        """Return a list aligned with texts holding cached vectors or None"""
+        keys = [self.key(model, text) for text in texts]
+        found = self.get_many(keys)
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_embeddings(self, model, texts, embeddings):
+        self.put_many([
+            (self.key(model, text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ])
+
+
+class ScoreCache(SqliteLRUCache):
+    """Reranker relevance scores keyed by (model, prompt template hash, question hash, chunk text hash)"""
+
+    def __init__(self, path, max_entries):
+        super().__init__(path, max_entries, "rerank_score")
+
+    def key(self, model, prompt_template, question, text):
+        return f"{model}:{text_hash(prompt_template)}:{text_hash(question)}:{text_hash(text)}"
+
+    def get_scores(self, model, prompt_template, question, texts):
+        """Return a list aligned with texts holding cached scores or None"""
+        keys = [self.key(model, prompt_template, question, text) for text in texts]
+        found = self.get_many(keys)
+        return [float(found[key].decode("ascii")) if key in found else None for key in keys]
+
+    def put_scores(self, model, prompt_template, question, texts, scores):
+        self.put_many([
+            (self.key(model, prompt_template, question, text), repr(float(score)).encode("ascii"))
+            for text, score in zip(texts, scores)
+        ])
+
+
+class ResponseCache(SqliteLRUCache):
+    """LLM responses keyed by (model, prompt template hash, input text hash), so editing the
+    prompt or switching models invalidates them while chunk size/overlap changes do not"""
+
+    def __init__(self, path, max_entries):
+        super().__init__(path, max_entries, "response")
+
+    def key(self, model, prompt_template, text):
+        return f"{model}:{text_hash(prompt_template)}:{text_hash(text)}"
+
+    def get_response(self, model, prompt_template, text):
+        key = self.key(model, prompt_template, text)
+        found = self.get_many([key])
+        return found[key].decode("utf-8") if key in found else None
+
+    def put_response(self, model, prompt_template, text, response):
+        self.put_many([(self.key(model, prompt_template, text), response.encode("utf-8"))])
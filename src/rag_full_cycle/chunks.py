@@ -1,44 +1,190 @@
-import json
+import re
+from contextlib import ExitStack
 import logfire
-import nltk
-from nltk.tokenize import word_tokenize
+import numpy as np
+from .tokenization import load_tokenizer, load_word_tokenizer
+from .artifacts import ArtifactWriter, write_records
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+RECURSIVE_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+
+def chunk_sort_key(chunk_id):
+    """Order chunk ids "{page}-{n}" or "{doc}:{page}-{n}" by document, page and position"""
+    doc, _, local_id = chunk_id.rpartition(':')
+    return [doc] + [int(part) for part in local_id.split('-')]
+
+
+def page_tokenizer(strategy="words", tokenizer_name=None):
+    """Function from a page text to an (n, 2) array of token character offsets.
+
+    The "words" strategy counts NLTK words as word_tokenize does, the other strategies
+    count embedding-model tokens. Tokenizers are loaded once per process.
+    """
+    if strategy == "words":
+        return load_word_tokenizer().spans
+    return load_tokenizer(tokenizer_name).spans
+
+
+def tokenize_extract(extract_data, strategy="words", tokenizer_name=None):
+    """Tokenize every page once into (page, text, offsets), shared by every size/overlap config"""
+    tokenize = page_tokenizer(strategy, tokenizer_name)
+    return [(data["page"], data["text"], tokenize(data["text"])) for data in extract_data]
+
+
+class ChunkStream:
+    """Chunks pages as they arrive for several size/overlap configs at once.
+
+    outputs maps chunk file paths to the Chunks that fill them. Each page is tokenized
+    once and its chunks are appended to every file, so chunking keeps pace with a
+    streaming extract and holds one page at a time. The files replace the old ones only
+    when the stream closes without an error.
+    """
+
+    def __init__(self, outputs, strategy="words", tokenizer_name=None):
+        self.outputs = outputs
+        self.tokenize = page_tokenizer(strategy, tokenizer_name) if outputs else None
+        self.writers = {}
+        self.stack = None
+
+    def __enter__(self):
+        # every writer is exited even when another one fails to open or close, a failure
+        # is passed on to the writers exited after it so they discard their files
+        with ExitStack() as stack:
+            self.writers = {path: stack.enter_context(ArtifactWriter(path)) for path in self.outputs}
+            self.stack = stack.pop_all()
+        return self
+
+    def __exit__(self, *exc):
+        self.stack.__exit__(*exc)
+        if exc[0] is None:
+            for path, writer in self.writers.items():
+                logfire.info("Saved {count} chunks to {path}", count=writer.count, path=path)
+
+    def add(self, page):
+        if not self.outputs:
+            return
+        tokenized = [(page["page"], page["text"], self.tokenize(page["text"]))]
+        for path, chunker in self.outputs.items():
+            for chunk in chunker.iter_chunks(tokenized):
+                self.writers[path].write(chunk)
 
 
 class Chunks:
-    def __init__(self, size, overlap):
+    """Chunking strategies, all measured in tokens of the tokenized extract:
+
+    - words: fixed windows of NLTK words (the original behaviour)
+    - tokens: fixed windows of embedding-model tokens, filling the embedding window exactly
+    - sentences: whole sentences packed up to size tokens, overlap carried as whole sentences
+    - recursive: split on paragraph, line, sentence and word separators until pieces fit, then pack
+    """
+
+    def __init__(self, size, overlap, strategy="words", tokenizer_name=None):
+        if strategy not in ("words", "tokens", "sentences", "recursive"):
+            raise ValueError(f"Unknown chunking strategy: {strategy}")
         self.size = size
         self.overlap = overlap
-        nltk.download('punkt_tab')
-
-    def create_chunks(self, extract_data):
-        """Create chunks from extracted text data, respecting word boundaries"""
-        chunks = []
-
-        for data in extract_data:
-            text = data["text"]
-            words = word_tokenize(text)
-            step_size = self.size - self.overlap
-            for i in range(0, len(words), step_size):
-                chunk_words = words[i:i + self.size]
-                chunk_text = " ".join(chunk_words)
-
-                if chunk_text.strip():
-                    chunks.append({
+        self.strategy = strategy
+        self.tokenizer_name = tokenizer_name
+
+    def iter_chunks(self, tokenized):
+        """Lazily yield chunks as slices of the original page text between token offsets"""
+        for page, text, spans in tokenized:
+            for n, (start, end) in enumerate(self.segments(text, spans)):
+                chunk_text = text[start:end].strip()
+
+                if chunk_text:
+                    yield {
                         "text": chunk_text,
-                        "id": f"{data['page']}-{i // step_size}"
-                    })
+                        "id": f"{page}-{n}"
+                    }
+
+    def segments(self, text, spans):
+        """(start, end) character ranges of the chunks of one page"""
+        if self.strategy in ("words", "tokens"):
+            return self.windows(spans, 0, len(spans), self.overlap)
+        starts = spans[:, 0]
+        if self.strategy == "sentences":
+            pieces = []
+            for start, end in self.sentence_ranges(text):
+                pieces.extend(self.split_to_fit(spans, starts, start, end))
+        else:
+            pieces = self.recursive_split(text, spans, starts, 0, len(text), RECURSIVE_SEPARATORS)
+        return self.pack(pieces, starts)
+
+    def windows(self, spans, first, last, overlap):
+        step_size = self.size - overlap
+        for i in range(first, last, step_size):
+            window = spans[i:min(i + self.size, last)]
+            yield window[0, 0], window[-1, 1]
 
-        return chunks
+    def token_count(self, starts, start, end):
+        return int(np.searchsorted(starts, end) - np.searchsorted(starts, start))
+
+    def split_to_fit(self, spans, starts, start, end):
+        """The range itself if it fits, otherwise fixed token windows over it"""
+        if self.token_count(starts, start, end) <= self.size:
+            return [(start, end)]
+        return list(self.windows(spans, int(np.searchsorted(starts, start)), int(np.searchsorted(starts, end)), 0))
+
+    def sentence_ranges(self, text):
+        start = 0
+        for boundary in SENTENCE_BOUNDARY.finditer(text):
+            yield start, boundary.start()
+            start = boundary.end()
+        if start < len(text):
+            yield start, len(text)
+
+    def recursive_split(self, text, spans, starts, start, end, separators):
+        """Split on the coarsest separator first and recurse into pieces that are still too long"""
+        if self.token_count(starts, start, end) <= self.size or not separators:
+            return self.split_to_fit(spans, starts, start, end)
+        separator = separators[0]
+        pieces = []
+        position = start
+        while position < end:
+            index = text.find(separator, position, end)
+            piece_end = end if index == -1 else index + len(separator)
+            pieces.extend(self.recursive_split(text, spans, starts, position, piece_end, separators[1:]))
+            position = piece_end
+        return pieces
+
+    def pack(self, pieces, starts):
+        """Greedily merge consecutive pieces up to size tokens, starting the next chunk with
+        the trailing pieces that fit in the overlap budget"""
+        counts = [self.token_count(starts, start, end) for start, end in pieces]
+        i = 0
+        while i < len(pieces):
+            total = 0
+            j = i
+            while j < len(pieces) and total + counts[j] <= self.size:
+                total += counts[j]
+                j += 1
+            j = max(j, i + 1)
+            yield pieces[i][0], pieces[j - 1][1]
+            if j >= len(pieces):
+                break
+            carried = 0
+            k = j
+            while k - 1 > i and carried + counts[k - 1] <= self.overlap:
+                carried += counts[k - 1]
+                k -= 1
+            i = k
+
+    def create_chunks(self, extract_data, tokenized=None):
+        """Create chunks from extracted text data, respecting token boundaries"""
+        if tokenized is None:
+            tokenized = tokenize_extract(extract_data, self.strategy, self.tokenizer_name)
+        return list(self.iter_chunks(tokenized))
 
     def save_chunks(self, chunks, output_path):
-        """Save chunks to file"""
-        print(f"Saving {len(chunks)} chunks to {output_path}")
-        with open(output_path, "w") as f:
-            json.dump(chunks, f, indent=2)
-        print(f"Saved chunks to {output_path}")
-
-    def create_and_save_chunks(self, extract_data, output_path):
-        """Create chunks and save to file"""
-        chunks = self.create_chunks(extract_data)
-        self.save_chunks(chunks, output_path)
-        return chunks
+        """Save chunks to an NDJSON file, one chunk per line"""
+        count = write_records(output_path, chunks)
+        logfire.info("Saved {count} chunks to {output_path}", count=count, output_path=output_path)
+        return count
+
+    def create_and_save_chunks(self, extract_data, output_path, tokenized=None):
+        """Stream chunks straight to file without holding them in memory, returns the chunk count"""
+        if tokenized is None:
+            tokenized = tokenize_extract(extract_data, self.strategy, self.tokenizer_name)
+        return self.save_chunks(self.iter_chunks(tokenized), output_path)
@@ -0,0 +1,44 @@
+import asyncio
+import time
+import logfire
+
+
+class AdaptiveLimiter:
+    """Asyncio concurrency limit tuned AIMD-style from observed latency and errors.
+
+    The limit grows by one after a full window of fast successes and is halved on an
+    error or a call slower than target_latency, at most once per target_latency so a
+    burst of failures from the same overload only backs off once.
+    """
+
+    def __init__(self, initial, minimum, maximum, target_latency):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency, ok):
+        async with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.target_latency:
+                if now - self.last_decrease > self.target_latency:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.last_decrease = now
+                    self.successes = 0
+                    logfire.info("Concurrency limit decreased to {limit}", limit=self.limit)
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
@@ -1,7 +1,8 @@
 import os
-import sys
 import json
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 def load_json_config(dataset="fy10"):
     """Load configuration from JSON files"""
@@ -29,41 +30,213 @@ def load_json_config(dataset="fy10"):
     
     return config
 
-def get_dataset_from_args():
-    """Extract dataset from command line arguments"""
-    if len(sys.argv) > 1:
-        dataset = sys.argv[1].lower()
-        if dataset in ["fy10", "baby"]:
-            return dataset
-    return "fy10"  # default
+def available_datasets():
+    """Dataset names are the configs/*.json files other than base.json"""
+    config_dir = Path(__file__).parent.parent.parent / "configs"
+    return sorted(path.stem for path in config_dir.glob("*.json") if path.stem != "base")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Immutable settings of one dataset, loaded from configs/base.json and configs/<dataset>.json.
+
+    Every step class takes a Settings as its first argument instead of reading module
+    globals, so importing the package has no side effects and one process can run
+    several datasets. Fields are plain values; section() returns a fresh copy of a raw
+    config section, e.g. to hash it into a DAG step.
+    """
 
-# Load the appropriate configuration and export variables
-DATASET = get_dataset_from_args()
-config = load_json_config(DATASET)
+    dataset: str
+    config_json: str
+    corpus_glob: Optional[str]
+    pdf_file_path: Optional[str]
+    file_name: str
+    output_dir: str
+    artifact_compression: str
+    extraction_workers: int
+    extraction_pages_per_shard: int
+    chunk_sizes: tuple
+    chunk_overlaps: tuple
+    chunk_strategy: str
+    chunk_tokenizer: Optional[str]
+    question_generation_prompt: str
+    openai_api_key: str
+    pinecone_api_key: str
+    logfire_api_key: str
+    top_k_results: int
+    pinecone_query_concurrency: int
+    pinecone_namespace: str
+    pinecone_host: Optional[str]
+    pinecone_index_ready_timeout: float
+    pinecone_upsert_batch_size: int
+    pinecone_upsert_max_bytes: int
+    pinecone_upsert_concurrency: int
+    upsert_queue_batches: int
+    vector_backend: str
+    vector_storage_dtype: str
+    ivf_nlist: int
+    ivf_nprobe: int
+    ivf_kmeans_iterations: int
+    ivf_recall_sample: int
+    quantization_method: str
+    pq_subspaces: int
+    quantization_rescore_factor: int
+    quantization_recall_tolerance: float
+    quantization_recall_sample: int
+    dedup_enabled: bool
+    dedup_num_perm: int
+    dedup_bands: int
+    dedup_threshold: float
+    dedup_shingle_size: int
+    retrieval_mode: str
+    retrieval_rrf_k: int
+    retrieval_fusion_candidates: int
+    retrieval_question_fraction: float
+    retrieval_min_questions: int
+    sweep_max_parallel: int
+    sweep_limits: tuple
+    eval_k: int
+    eval_bootstrap_samples: int
+    eval_confidence: float
+    eval_seed: int
+    rerank_enabled: bool
+    rerank_model: str
+    rerank_candidates: int
+    rerank_concurrency: int
+    rerank_time_budget: float
+    batch_size: int
+    delay_between_requests: float
+    delay_between_batches: float
+    max_retries: int
+    question_initial_concurrency: int
+    question_min_concurrency: int
+    question_max_concurrency: int
+    question_target_latency: float
+    question_model: str
+    embedding_model: str
+    cache_dir: str
+    embedding_cache_enabled: bool
+    embedding_cache_max_entries: int
+    response_cache_enabled: bool
+    response_cache_max_entries: int
+    rerank_cache_enabled: bool
+    rerank_cache_max_entries: int
+    serve_host: str
+    serve_port: int
+    serve_max_batch: int
+    serve_max_wait_ms: float
+    serve_max_pending: int
+    serve_cache_entries: int
+    log_level: str
+    debug_sample_rate: float
 
-# Extract specific config values for backward compatibility
-# Resolve PDF path relative to project root
-pdf_file = config['dataset']['pdf_file']
-if not os.path.isabs(pdf_file):
-    # Get project root directory (parent of src directory)
+    def section(self, name):
+        return json.loads(self.config_json)[name]
+
+
+def load_settings(dataset="fy10"):
+    """Settings for a dataset, one of available_datasets()"""
+    config = load_json_config(dataset)
+    # Resolve PDF path relative to project root
     project_root = Path(__file__).parent.parent.parent
-    PDF_FILE_PATH = str(project_root / pdf_file)
-else:
-    PDF_FILE_PATH = pdf_file
-EXTRACT_OUTPUT = config['dataset']['extract_output']
-CHUNK_SIZES = config['chunking']['sizes']
-CHUNK_OVERLAPS = config['chunking']['overlaps']
-QUESTION_GENERATION_PROMPT = config['question_generation']['prompt']
-FILE_NAME = pdf_file.split('/')[-1].replace('.pdf', '').replace('_', '-').lower()
-OUTPUT_DIR = f"{config['output_dir']}/{FILE_NAME}"
-OPENAI_API_KEY = config['api_keys']['openai']
-PINECONE_API_KEY = config['api_keys']['pinecone']
-LOGFIRE_API_KEY = config['api_keys']['logfire']
-TOP_K_RESULTS = config['vector_search']['top_k_results']
-PINECONE_NAMESPACE = config['vector_search']['pinecone_namespace']
-BATCH_SIZE = config['rate_limiting']['batch_size']
-DELAY_BETWEEN_REQUESTS = config['rate_limiting']['delay_between_requests']
-DELAY_BETWEEN_BATCHES = config['rate_limiting']['delay_between_batches']
-MAX_RETRIES = config['rate_limiting']['max_retries']
-QUESTION_MODEL = config['models']['question_model']
-EMBEDDING_MODEL = config['models']['embedding_model']
\ No newline at end of file
+    if 'pdf_glob' in config['dataset']:
+        # corpus mode: every PDF matching the glob (or inside the directory) is one document
+        pdf_glob = config['dataset']['pdf_glob']
+        corpus_glob = pdf_glob if os.path.isabs(pdf_glob) else str(project_root / pdf_glob)
+        pdf_file_path = None
+        file_name = config['dataset']['name']
+    else:
+        corpus_glob = None
+        pdf_file = config['dataset']['pdf_file']
+        pdf_file_path = pdf_file if os.path.isabs(pdf_file) else str(project_root / pdf_file)
+        file_name = pdf_file.split('/')[-1].replace('.pdf', '').replace('_', '-').lower()
+
+    vector_search = config['vector_search']
+    caches = config['caches']
+    if config['rate_limiting']['max_retries'] < 1:
+        raise ValueError(f"rate_limiting.max_retries must be at least 1, got {config['rate_limiting']['max_retries']}")
+    return Settings(
+        dataset=dataset,
+        config_json=json.dumps(config),
+        corpus_glob=corpus_glob,
+        pdf_file_path=pdf_file_path,
+        file_name=file_name,
+        output_dir=f"{config['output_dir']}/{file_name}",
+        artifact_compression=config['artifacts']['compression'],
+        extraction_workers=config['extraction']['workers'],
+        extraction_pages_per_shard=config['extraction']['pages_per_shard'],
+        chunk_sizes=tuple(config['chunking']['sizes']),
+        chunk_overlaps=tuple(config['chunking']['overlaps']),
+        chunk_strategy=config['chunking']['strategy'],
+        chunk_tokenizer=config['chunking']['tokenizer'],
+        question_generation_prompt=config['question_generation']['prompt'],
+        openai_api_key=config['api_keys']['openai'],
+        pinecone_api_key=config['api_keys']['pinecone'],
+        logfire_api_key=config['api_keys']['logfire'],
+        top_k_results=vector_search['top_k_results'],
+        pinecone_query_concurrency=vector_search['query_concurrency'],
+        pinecone_namespace=vector_search['pinecone_namespace'],
+        pinecone_host=vector_search['pinecone_host'],
+        pinecone_index_ready_timeout=vector_search['index_ready_timeout'],
+        pinecone_upsert_batch_size=vector_search['upsert_batch_size'],
+        pinecone_upsert_max_bytes=vector_search['upsert_max_bytes'],
+        pinecone_upsert_concurrency=vector_search['upsert_concurrency'],
+        upsert_queue_batches=vector_search['upsert_queue_batches'],
+        vector_backend=vector_search['backend'],
+        vector_storage_dtype=vector_search['storage_dtype'],
+        ivf_nlist=vector_search['ivf']['nlist'],
+        ivf_nprobe=vector_search['ivf']['nprobe'],
+        ivf_kmeans_iterations=vector_search['ivf']['kmeans_iterations'],
+        ivf_recall_sample=vector_search['ivf']['recall_sample'],
+        quantization_method=vector_search['quantization']['method'],
+        pq_subspaces=vector_search['quantization']['pq_subspaces'],
+        quantization_rescore_factor=vector_search['quantization']['rescore_factor'],
+        quantization_recall_tolerance=vector_search['quantization']['recall_tolerance'],
+        quantization_recall_sample=vector_search['quantization']['recall_sample'],
+        dedup_enabled=config['dedup']['enabled'],
+        dedup_num_perm=config['dedup']['num_perm'],
+        dedup_bands=config['dedup']['bands'],
+        dedup_threshold=config['dedup']['threshold'],
+        dedup_shingle_size=config['dedup']['shingle_size'],
+        retrieval_mode=config['retrieval']['mode'],
+        retrieval_rrf_k=config['retrieval']['rrf_k'],
+        retrieval_fusion_candidates=config['retrieval']['fusion_candidates'],
+        retrieval_question_fraction=config['retrieval']['question_fraction'],
+        retrieval_min_questions=config['retrieval']['min_questions'],
+        sweep_max_parallel=config['sweep']['max_parallel_configs'],
+        sweep_limits=tuple(sorted(config['sweep']['limits'].items())),
+        eval_k=config['evaluation']['k'],
+        eval_bootstrap_samples=config['evaluation']['bootstrap_samples'],
+        eval_confidence=config['evaluation']['confidence'],
+        eval_seed=config['evaluation']['seed'],
+        rerank_enabled=config['rerank']['enabled'],
+        rerank_model=config['rerank']['model'],
+        rerank_candidates=config['rerank']['candidates'],
+        rerank_concurrency=config['rerank']['concurrency'],
+        rerank_time_budget=config['rerank']['time_budget'],
+        batch_size=config['rate_limiting']['batch_size'],
+        delay_between_requests=config['rate_limiting']['delay_between_requests'],
+        delay_between_batches=config['rate_limiting']['delay_between_batches'],
+        max_retries=config['rate_limiting']['max_retries'],
+        question_initial_concurrency=config['question_engine']['initial_concurrency'],
+        question_min_concurrency=config['question_engine']['min_concurrency'],
+        question_max_concurrency=config['question_engine']['max_concurrency'],
+        question_target_latency=config['question_engine']['target_latency'],
+        question_model=config['models']['question_model'],
+        embedding_model=config['models']['embedding_model'],
+        cache_dir=caches['dir'],
+        embedding_cache_enabled=caches['embeddings']['enabled'],
+        embedding_cache_max_entries=caches['embeddings']['max_entries'],
+        response_cache_enabled=caches['responses']['enabled'],
+        response_cache_max_entries=caches['responses']['max_entries'],
+        rerank_cache_enabled=caches['rerank_scores']['enabled'],
+        rerank_cache_max_entries=caches['rerank_scores']['max_entries'],
+        serve_host=config['serve']['host'],
+        serve_port=config['serve']['port'],
+        serve_max_batch=config['serve']['max_batch'],
+        serve_max_wait_ms=config['serve']['max_wait_ms'],
+        serve_max_pending=config['serve']['max_pending'],
+        serve_cache_entries=config['serve']['cache_entries'],
+        log_level=config['observability']['log_level'],
+        debug_sample_rate=config['observability']['debug_sample_rate'],
+    )
@@ -0,0 +1,147 @@
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logfire
+from .extracts import Extracts
+from .chunks import Chunks, tokenize_extract
+from .artifacts import artifact_exists, artifact_path, iter_records, migrate_legacy_json, write_records
+from .dag import file_hash, value_hash
+
+
+def ingest_document(settings, pdf_path, doc_id, doc_dir, chunk_configs, extract_needed):
+    """Extract (if needed) and chunk one document in a worker process, chunk ids are prefixed with doc_id"""
+    os.makedirs(doc_dir, exist_ok=True)
+    extract_generator = Extracts(settings)
+    compression = settings.artifact_compression
+    extract_file = artifact_path(doc_dir, "extract", compression)
+    if extract_needed:
+        extract = extract_generator.extract_text_from_pdf(pdf_path)
+        extract_generator.save_extract(extract, extract_file)
+    else:
+        extract = extract_generator.load_extract(extract_file)
+
+    tokenized = tokenize_extract(extract, settings.chunk_strategy, settings.chunk_tokenizer)
+    chunk_counts = {}
+    for size, overlap in chunk_configs:
+        chunks = Chunks(size, overlap, settings.chunk_strategy, settings.chunk_tokenizer).iter_chunks(tokenized)
+        chunk_counts[f"{size}-{overlap}"] = write_records(
+            artifact_path(doc_dir, f"chunks-{size}-{overlap}", compression),
+            ({**chunk, "id": f"{doc_id}:{chunk['id']}"} for chunk in chunks),
+        )
+    return {"pages": len(extract), "chunks": chunk_counts}
+
+
+class Corpus:
+    """Ingests every PDF matching the dataset pdf_glob into one shared set of per-config artifacts"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.corpus_glob = settings.corpus_glob
+        self.output_dir = settings.output_dir
+        self.compression = settings.artifact_compression
+        self.docs_dir = f"{self.output_dir}/docs"
+        self.manifest_path = f"{self.output_dir}/corpus-manifest.json"
+        # per-document chunk files are only reused when they were cut the same way
+        self.chunking = value_hash({"strategy": settings.chunk_strategy, "tokenizer": settings.chunk_tokenizer})
+
+    def discover(self):
+        pattern = self.corpus_glob
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.pdf")
+        return sorted(glob.glob(pattern, recursive=True))
+
+    def doc_id(self, pdf_path):
+        """Stable id from the path relative to the glob root, safe to use in chunk ids and file names"""
+        root = self.corpus_glob if os.path.isdir(self.corpus_glob) else os.path.dirname(self.corpus_glob.split('*')[0])
+        relative = os.path.relpath(pdf_path, root)
+        return re.sub(r'[^a-z0-9]+', '-', relative[:-len('.pdf')].lower()).strip('-')
+
+    def doc_chunks_path(self, doc_id, size, overlap):
+        return artifact_path(f"{self.docs_dir}/{doc_id}", f"chunks-{size}-{overlap}", self.compression)
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        with open(self.manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def ingest(self, chunk_sizes, chunk_overlaps):
+        """Extract and chunk new or changed documents in parallel, returns True if anything changed"""
+        os.makedirs(self.docs_dir, exist_ok=True)
+        chunk_configs = [(size, overlap) for size in chunk_sizes for overlap in chunk_overlaps]
+        manifest = self.load_manifest()
+        paths = {self.doc_id(path): path for path in self.discover()}
+        logfire.info("Found {len} documents matching {glob}", len=len(paths), glob=self.corpus_glob)
+
+        removed = [doc_id for doc_id in manifest if doc_id not in paths]
+        for doc_id in removed:
+            logfire.info("Document {doc_id} was removed from the corpus", doc_id=doc_id)
+            del manifest[doc_id]
+
+        jobs = {}
+        for doc_id, path in paths.items():
+            digest = file_hash(path)
+            entry = manifest.get(doc_id)
+            changed = entry is None or entry["hash"] != digest
+            chunked_with = {} if changed else entry.get("chunking", {})
+            missing_configs = [
+                (size, overlap) for size, overlap in chunk_configs
+                if chunked_with.get(f"{size}-{overlap}") != self.chunking
+                or not artifact_exists(self.doc_chunks_path(doc_id, size, overlap))
+            ]
+            if missing_configs:
+                jobs[doc_id] = (path, digest, missing_configs, changed)
+
+        logfire.info("{jobs} documents to (re)process, {skipped} unchanged",
+                     jobs=len(jobs), skipped=len(paths) - len(jobs))
+        with ProcessPoolExecutor(max_workers=self.settings.extraction_workers or os.cpu_count()) as executor:
+            futures = {
+                executor.submit(ingest_document, self.settings, path, doc_id, f"{self.docs_dir}/{doc_id}", configs, changed): doc_id
+                for doc_id, (path, digest, configs, changed) in jobs.items()
+            }
+            for future in as_completed(futures):
+                doc_id = futures[future]
+                path, digest, _, changed = jobs[doc_id]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logfire.error("Error ingesting {path}: {e}", path=path, e=e)
+                    continue
+                entry = (manifest.get(doc_id) if not changed else None) or {}
+                chunk_counts = {**entry.get("chunks", {}), **result["chunks"]}
+                chunking = {**entry.get("chunking", {}), **{key: self.chunking for key in result["chunks"]}}
+                manifest[doc_id] = {"path": path, "hash": digest, "pages": result["pages"], "chunks": chunk_counts,
+                                    "chunking": chunking}
+                logfire.info("Ingested {doc_id}: {pages} pages", doc_id=doc_id, pages=result["pages"])
+                # persist progress so an interrupted ingest resumes with the documents already done
+                self.save_manifest(manifest)
+
+        self.save_manifest(manifest)
+        changed = bool(jobs or removed)
+        for size, overlap in chunk_configs:
+            self.merge_chunks(manifest, size, overlap, changed)
+        return changed
+
+    def merge_chunks(self, manifest, size, overlap, changed):
+        """Write the corpus-wide chunks file, the DAG reruns the steps downstream of it"""
+        chunk_key = f"{size}-{overlap}"
+        chunks_file = artifact_path(self.output_dir, f"chunks-{chunk_key}", self.compression)
+        migrate_legacy_json(chunks_file)
+        if not changed and os.path.exists(chunks_file):
+            return
+
+        # doc ids sort the same way as the chunk ids they prefix, and each document file is
+        # already in page order, so the merge streams one document at a time
+        count = write_records(chunks_file, (
+            chunk
+            for doc_id in sorted(manifest)
+            for chunk in iter_records(self.doc_chunks_path(doc_id, size, overlap))
+        ))
+        logfire.info("Merged {len} chunks from {docs} documents into {chunks_file}",
+                     len=count, docs=len(manifest), chunks_file=chunks_file)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import logfire
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def value_hash(value):
+    """Stable hash of a JSON-serializable input such as a config section or a prompt"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def manifest_path(artifact):
+    return f"{artifact}.manifest.json"
+
+
+def load_manifest(artifact):
+    path = manifest_path(artifact)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def current_hash(artifact, manifest):
+    """Content hash of an artifact, taken from its manifest unless the file was rewritten since"""
+    stat = os.stat(artifact)
+    if manifest is not None and manifest["size"] == stat.st_size and manifest["mtime"] == stat.st_mtime_ns:
+        return manifest["output"]
+    return file_hash(artifact)
+
+
+def artifact_hash(artifact):
+    if not os.path.exists(artifact):
+        return None
+    return current_hash(artifact, load_manifest(artifact))
+
+
+# artifacts written before manifests existed have the format of the first release
+LEGACY_SCHEMA = 1
+
+
+class Step:
+    """One pipeline step that writes artifact from its inputs.
+
+    inputs maps names to values (config sections, model names, prompts, file hashes)
+    and upstream lists the steps whose artifacts it reads. run(changed) receives the
+    names of the inputs that changed since the artifact was last built, so a step can
+    reuse the parts that are still valid. schema is the version of the artifact format,
+    bumped when a step starts writing fields that older artifacts lack.
+    """
+
+    def __init__(self, name, artifact, run, inputs=None, upstream=(), schema=LEGACY_SCHEMA):
+        self.name = name
+        self.artifact = artifact
+        self.run = run
+        self.inputs = inputs or {}
+        self.upstream = list(upstream)
+        self.schema = schema
+
+
+class DAG:
+    """Runs steps in dependency order and skips the ones whose inputs are unchanged.
+
+    Every artifact gets an {artifact}.manifest.json with the hash of each input,
+    including the content hash of every upstream artifact, and the hash of the artifact
+    itself. A step reruns when its artifact is missing or any input hash differs, which
+    in turn changes its output hash and invalidates exactly the steps downstream of it.
+    Selected steps always rerun, and so does a step whose artifact has an older schema.
+    """
+
+    def __init__(self, steps):
+        self.steps = {step.name: step for step in steps}
+        self.order = self.topological_order()
+
+    def topological_order(self):
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline steps have a cycle through {name}")
+            visiting.add(name)
+            for upstream in self.steps[name].upstream:
+                visit(upstream)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+        return order
+
+    def input_hashes(self, step):
+        hashes = {name: value_hash(value) for name, value in step.inputs.items()}
+        for upstream in step.upstream:
+            hashes[upstream] = artifact_hash(self.steps[upstream].artifact)
+        return hashes
+
+    def changed_inputs(self, step, hashes):
+        """Input names that differ from the manifest, ["artifact"] when there is nothing to reuse
+        and ["manifest"] for an untracked artifact that cannot be adopted"""
+        if not os.path.exists(step.artifact):
+            return ["artifact"]
+        manifest = load_manifest(step.artifact)
+        if manifest is None:
+            return ["manifest"]
+        changed = [name for name, digest in hashes.items() if manifest["inputs"].get(name) != digest]
+        if manifest.get("schema", LEGACY_SCHEMA) < step.schema:
+            changed.append("schema")
+        if current_hash(step.artifact, manifest) != manifest["output"]:
+            # rewritten outside the pipeline, e.g. a corpus re-merge or a manual edit
+            changed.append("output")
+        return changed
+
+    def record(self, step, hashes):
+        stat = os.stat(step.artifact)
+        manifest = {
+            "step": step.name,
+            "schema": step.schema,
+            "inputs": hashes,
+            "output": file_hash(step.artifact),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+        with open(manifest_path(step.artifact), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def run(self, selected=None):
+        """Bring every step up to date, or only the selected ones, which always rerun.
+        Returns the names of the steps that ran"""
+        ran = []
+        for name in self.order:
+            step = self.steps[name]
+            hashes = self.input_hashes(step)
+            forced = bool(selected) and name in selected
+            if (os.path.exists(step.artifact) and load_manifest(step.artifact) is None
+                    and not forced and step.schema == LEGACY_SCHEMA):
+                # artifacts from before manifests existed are trusted once and tracked from now on
+                logfire.info("Adopting existing {artifact} for step {step}", artifact=step.artifact, step=name)
+                self.record(step, hashes)
+                continue
+
+            changed = self.changed_inputs(step, hashes)
+            if selected and not forced:
+                if changed:
+                    logfire.warn("Step {step} is out of date ({changed} changed) but was not selected",
+                                 step=name, changed=changed)
+                continue
+            if forced and not changed:
+                changed = ["selected"]
+            if not changed:
+                logfire.info("Step {step} is up to date, reusing {artifact}", step=name, artifact=step.artifact)
+                continue
+
+            logfire.info("Running step {step}: {changed} changed", step=name, changed=changed)
+            step.run(changed)
+            self.record(step, hashes)
+            ran.append(name)
+        return ran
@@ -0,0 +1,107 @@
+import json
+import os
+import re
+import zlib
+import numpy as np
+import logfire
+from .chunks import chunk_sort_key
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingle_hashes(text, size):
+    """crc32 of every distinct size-word shingle of the lowercased text"""
+    words = re.findall(r"\w+", text.lower())
+    grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))} if words else set()
+    return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+
+
+def load_aliases(path):
+    """{alias chunk id: canonical chunk id} saved by the dedup step, empty without one"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)["aliases"]
+
+
+def drop_aliases(chunks, aliases):
+    return [chunk for chunk in chunks if chunk["id"] not in aliases]
+
+
+class Dedup:
+    """Finds near-duplicate chunks with MinHash signatures and LSH banding.
+
+    Each chunk's word shingles are reduced to a num_perm MinHash signature, whose share of
+    equal positions estimates the Jaccard similarity of two chunks. Signatures are cut
+    into bands of num_perm / bands rows and chunks sharing any band become candidates, so
+    only similar chunks are ever compared and the cost stays close to linear. A candidate
+    whose estimated similarity with its group's first chunk in document order reaches
+    threshold becomes an alias of it; that first chunk is the one kept.
+    """
+
+    def __init__(self, settings):
+        self.enabled = settings.dedup_enabled
+        self.num_perm = settings.dedup_num_perm
+        self.bands = settings.dedup_bands
+        self.threshold = settings.dedup_threshold
+        self.shingle_size = settings.dedup_shingle_size
+        if self.num_perm % self.bands:
+            raise ValueError(f"dedup num_perm {self.num_perm} is not a multiple of bands {self.bands}")
+        self.rows = self.num_perm // self.bands
+        rng = np.random.default_rng(0)
+        self.a = rng.integers(1, MERSENNE_PRIME, self.num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, self.num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not len(hashes):
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint32)
+        # (a * x + b) mod p per permutation, the products wrap in uint64 like datasketch's
+        permuted = ((hashes[:, None] * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def find_aliases(self, chunks):
+        """{alias chunk id: canonical chunk id} for the near-duplicate chunks"""
+        ordered = sorted(chunks, key=lambda chunk: chunk_sort_key(chunk["id"]))
+        if len(ordered) < 2:
+            return {}
+        signatures = np.stack([self.signature(chunk["text"]) for chunk in ordered])
+
+        parent = list(range(len(ordered)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for band in range(self.bands):
+            block = np.ascontiguousarray(signatures[:, band * self.rows:(band + 1) * self.rows])
+            buckets = {}
+            for i, row in enumerate(block):
+                buckets.setdefault(row.tobytes(), []).append(i)
+            for members in buckets.values():
+                for other in members[1:]:
+                    first, root = find(members[0]), find(other)
+                    if first != root:
+                        # the earlier chunk stays the root, so every group is rooted at its canonical chunk
+                        parent[max(first, root)] = min(first, root)
+
+        aliases = {}
+        for i in range(len(ordered)):
+            canonical = find(i)
+            # chained candidates may drift apart, only chunks close to the canonical one are aliased
+            if canonical != i and np.mean(signatures[i] == signatures[canonical]) >= self.threshold:
+                aliases[ordered[i]["id"]] = ordered[canonical]["id"]
+        return aliases
+
+    def dedup_and_save(self, chunks, output_path):
+        """Save the alias map of the chunks to output_path, an empty one when dedup is disabled"""
+        aliases = self.find_aliases(chunks) if self.enabled else {}
+        logfire.info("Dedup: {aliases} of {chunks} chunks are near-duplicates, keeping {kept}",
+                     aliases=len(aliases), chunks=len(chunks), kept=len(chunks) - len(aliases))
+        with open(output_path, "w") as f:
+            json.dump({"enabled": self.enabled, "chunks": len(chunks), "kept": len(chunks) - len(aliases),
+                       "aliases": aliases}, f, indent=2)
+        return aliases
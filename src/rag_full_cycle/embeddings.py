@@ -1,19 +1,22 @@
-from openai import OpenAI
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from .config import *
-import requests
-import logfire  
+from tenacity import Retrying, stop_after_attempt, wait_exponential, retry_if_exception_type
+from .caches import EmbeddingCache
+from .metrics import metrics
+
+OLLAMA_EMBED_URL = "http://localhost:11434/api/embed"
 
 class Embeddings:
-    def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-
-    @retry(
-        stop=stop_after_attempt(MAX_RETRIES),
-        wait=wait_exponential(multiplier=1, min=1, max=60),
-        retry=retry_if_exception_type(Exception),
-        reraise=True
-    )
+    def __init__(self, settings):
+        import requests
+
+        self.settings = settings
+        # one pooled session so consecutive batches reuse the same connection
+        self.session = requests.Session()
+        # embedding requests sent, batches answered from the cache send none
+        self.requests = 0
+        self.cache = None
+        if settings.embedding_cache_enabled:
+            self.cache = EmbeddingCache(f"{settings.cache_dir}/embeddings.sqlite", settings.embedding_cache_max_entries)
+
    ## def create_embedding_openAI(self, text):
    ##     """Create embedding with automatic retry on rate limits"""
    ##     response = self.client.embeddings.create(
@@ -23,12 +26,56 @@ class Embeddings:
    ##     return response.data[0].embedding
 ##
     def create_embedding_ollama(self, text):
-        logfire.info("Creating embedding {text}", text=text)
-        response = requests.post(
-            "http://localhost:11434/api/embed",
-            json={
-                "model": EMBEDDING_MODEL,
-                "input": text
-            }
+        return self.embed_many([text])[0]
+
+    def log_cache_stats(self):
+        if self.cache is not None:
+            self.cache.log_stats()
+
+    def embed_many(self, texts):
+        """Embed a list of texts, vectors come back in input order"""
+        if not texts:
+            return []
+        texts = list(texts)
+        if self.cache is None:
+            return self.request_embeddings(texts)
+
+        embeddings = self.cache.get_embeddings(self.settings.embedding_model, texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            fresh = dict(zip(missing, self.request_embeddings(missing)))
+            self.cache.put_embeddings(self.settings.embedding_model, missing, [fresh[text] for text in missing])
+            embeddings = [fresh[text] if embedding is None else embedding
+                          for text, embedding in zip(texts, embeddings)]
+        return embeddings
+
+    def request_embeddings(self, texts):
+        """Send all texts as a single /api/embed request, retried with exponential backoff"""
+        self.requests += 1
+        retrying = Retrying(
+            stop=stop_after_attempt(self.settings.max_retries),
+            wait=wait_exponential(multiplier=1, min=1, max=60),
+            retry=retry_if_exception_type(Exception),
+            reraise=True
         )
-        return response.json()["embeddings"][0]
\ No newline at end of file
+        return retrying(self.post_embeddings, texts)
+
+    def post_embeddings(self, texts):
+        metrics.sample_debug("Creating {len} embeddings", len=len(texts))
+        with metrics.timer("embeddings.request"):
+            response = self.session.post(
+                OLLAMA_EMBED_URL,
+                json={
+                    "model": self.settings.embedding_model,
+                    "input": texts
+                }
+            )
+        metrics.count("embeddings.requests")
+        metrics.count("embeddings.request_bytes", len(response.request.body or b""))
+        metrics.count("embeddings.response_bytes", len(response.content))
+        response.raise_for_status()
+        embeddings = response.json()["embeddings"]
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+        metrics.count("embeddings.texts", len(texts))
+        return embeddings
@@ -1,78 +1,154 @@
 from typing import List, Dict, Any
+import numpy as np
 import logfire
 import json
 
 class Evals:
-    """Evaluate RAG retrieval results with Recall@K metrics"""
-    
-    def __init__(self, questions_results: List[Dict[str, Any]]):
+    """Evaluate RAG retrieval results with rank-based metrics.
+
+    The retriever output is converted once into a ranks array, the 1-based position of
+    the correct chunk in each question's results (0 when it was not retrieved). Every
+    metric is then a vectorized operation over that array. Each question has exactly one
+    relevant chunk, so recall@k is also the hit rate at k. With aliases, the dedup map
+    of near-duplicate chunks to the chunk kept for them, retrieving any alias of the
+    correct chunk counts as retrieving it.
+    """
+
+    def __init__(self, questions_results: List[Dict[str, Any]], bootstrap_samples=1000, confidence=0.95, seed=0,
+                 aliases=None):
         self.questions_results = questions_results
-    
-    def calculate_recall_at_k(self, k) -> float:
+        self.aliases = aliases or {}
+        self.bootstrap_samples = bootstrap_samples
+        self.confidence = confidence
+        self.seed = seed
+
+    def ranks(self, chunks_key='similar_chunks') -> np.ndarray:
+        ranks = np.zeros(len(self.questions_results), dtype=np.int32)
+        for i, result in enumerate(self.questions_results):
+            correct_chunk_id = self.aliases.get(result['question_data']['chunk_id'], result['question_data']['chunk_id'])
+            for rank, chunk in enumerate(result[chunks_key], start=1):
+                if self.aliases.get(chunk['id'], chunk['id']) == correct_chunk_id:
+                    ranks[i] = rank
+                    break
+        return ranks
+
+    def max_k(self, chunks_key='similar_chunks') -> int:
+        return max((len(result[chunks_key]) for result in self.questions_results), default=0)
+
+    @staticmethod
+    def hits(ranks, ks) -> np.ndarray:
+        """(..., len(ks)) booleans: the correct chunk is within the top k"""
+        ranks = ranks[..., None]
+        return (ranks > 0) & (ranks <= ks)
+
+    @staticmethod
+    def reciprocal_ranks(ranks) -> np.ndarray:
+        return np.where(ranks > 0, 1.0 / np.maximum(ranks, 1), 0.0)
+
+    @staticmethod
+    def gains(ranks, ks) -> np.ndarray:
+        """nDCG@k per question: with a single relevant chunk the ideal DCG is 1"""
+        discount = np.where(ranks > 0, 1.0 / np.log2(np.maximum(ranks, 1) + 1.0), 0.0)
+        return np.where(Evals.hits(ranks, ks), discount[..., None], 0.0)
+
+    def calculate_recall_at_k(self, k, chunks_key='similar_chunks') -> float:
         """
         Calculate Recall@K for the given results
         """
-        correct_retrievals = 0
-        total_queries = len(self.questions_results)
-        
-        for result in self.questions_results:
-            question_data = result['question_data']
-            similar_chunks = result['similar_chunks']
-            
-            correct_chunk_id = question_data['chunk_id']
-            
-            # Check if correct chunk is in top-K results
-            top_k_chunks = similar_chunks[:k]
-            chunk_ids = [chunk['id'] for chunk in top_k_chunks]
-            
-            if correct_chunk_id in chunk_ids:
-                correct_retrievals += 1
-        
-        recall_at_k = correct_retrievals / total_queries if total_queries > 0 else 0.0
-        return recall_at_k
-
-    def calculate_precision_at_k(self, k) -> float:
+        ranks = self.ranks(chunks_key)
+        return float(self.hits(ranks, np.array([k])).mean()) if len(ranks) else 0.0
+
+    def calculate_precision_at_k(self, k, chunks_key='similar_chunks') -> float:
         """
         Precision@K = (Number of relevant documents in top-K) / K
         """
-        total_precision = 0.0
-        total_queries = len(self.questions_results)
-        
-        for result in self.questions_results:
-            question_data = result['question_data']
-            similar_chunks = result['similar_chunks']
-            
-            correct_chunk_id = question_data['chunk_id']
-            
-            top_k_chunks = similar_chunks[:k]
-            chunk_ids = [chunk['id'] for chunk in top_k_chunks]
-            
-            # Count relevant documents in top-K (in this case, 1 if correct chunk is found)
-            relevant_in_top_k = 1 if correct_chunk_id in chunk_ids else 0
-            
-            # Precision for this query = relevant documents / K
-            precision_for_query = relevant_in_top_k / k
-            total_precision += precision_for_query
-        
-        avg_precision_at_k = total_precision / total_queries if total_queries > 0 else 0.0
-        return avg_precision_at_k
-
-    
+        return self.calculate_recall_at_k(k, chunks_key) / k
+
+    def metrics(self, chunks_key='similar_chunks', k=3) -> Dict[str, Any]:
+        """Metric curves for k = 1..max_k, MRR, and bootstrap confidence intervals"""
+        ranks = self.ranks(chunks_key)
+        ks = np.arange(1, max(self.max_k(chunks_key), k) + 1)
+        if not len(ranks):
+            return {"questions": 0, "recall": 0.0, "precision": 0.0, "mrr": 0.0, "ndcg": 0.0}
+
+        recall = self.hits(ranks, ks).mean(axis=0)
+        ndcg = self.gains(ranks, ks).mean(axis=0)
+        mrr = self.reciprocal_ranks(ranks).mean()
+        intervals = self.bootstrap(ranks, ks)
+        return {
+            "questions": int(len(ranks)),
+            "recall": float(recall[k - 1]),
+            "precision": float(recall[k - 1] / k),
+            "mrr": float(mrr),
+            "ndcg": float(ndcg[k - 1]),
+            "confidence_intervals": {
+                "level": self.confidence,
+                "recall": intervals["recall"][:, k - 1].tolist(),
+                "precision": (intervals["recall"][:, k - 1] / k).tolist(),
+                "mrr": intervals["mrr"].tolist(),
+                "ndcg": intervals["ndcg"][:, k - 1].tolist(),
+            },
+            "curves": {
+                "k": ks.tolist(),
+                "recall": recall.tolist(),
+                "precision": (recall / ks).tolist(),
+                "ndcg": ndcg.tolist(),
+                "recall_ci": intervals["recall"].T.tolist(),
+            },
+        }
+
+    def bootstrap(self, ranks, ks) -> Dict[str, np.ndarray]:
+        """Percentile intervals from resampling questions with replacement.
+
+        Every metric is a mean of a per-question value that depends only on the rank, so a
+        resample is fully described by its histogram of ranks, which is multinomial over
+        the observed rank frequencies. Drawing the (samples, ranks) histograms directly
+        gives the same bootstrap at a cost independent of the number of questions.
+        Returns [low, high] rows.
+        """
+        rng = np.random.default_rng(self.seed)
+        values = np.arange(max(ranks.max(), ks[-1]) + 1)
+        frequencies = np.bincount(ranks, minlength=len(values)) / len(ranks)
+        histograms = rng.multinomial(len(ranks), frequencies, size=self.bootstrap_samples) / len(ranks)
+        recall = histograms @ self.hits(values, ks)
+        ndcg = histograms @ self.gains(values, ks)
+        mrr = histograms @ self.reciprocal_ranks(values)
+        tail = (1 - self.confidence) / 2 * 100
+        percentiles = [tail, 100 - tail]
+        return {
+            "recall": np.percentile(recall, percentiles, axis=0),
+            "ndcg": np.percentile(ndcg, percentiles, axis=0),
+            "mrr": np.percentile(mrr, percentiles),
+        }
+
     def evaluate_and_save_results(self,k,evals_file):
         """
         Evaluate results and print metrics
         """
-        recall_result = self.calculate_recall_at_k(k)
-        logfire.info("\nRecall@{k}: {recall_result:.2%}\n", k=k, recall_result=recall_result)
-        precision_result = self.calculate_precision_at_k(k)
-        logfire.info("Precision@{k}: {precision_result:.2%}\n", k=k, precision_result=precision_result)
-        evals_data = {
-            "recall": recall_result,
-            "precision": precision_result
-        }
+        evals_data = {"k": k, **self.metrics('similar_chunks', k)}
+        self.log_metrics(evals_data, k)
+        # reranked results also carry the first-stage order, report it for comparison
+        if self.questions_results and 'first_stage_chunks' in self.questions_results[0]:
+            evals_data["first_stage"] = self.metrics('first_stage_chunks', k)
+            logfire.info("Without rerank:")
+            self.log_metrics(evals_data["first_stage"], k)
         self.save_evals(evals_data, evals_file)
-        
+        return evals_data
+
+    def log_metrics(self, metrics, k):
+        if not metrics["questions"]:
+            logfire.info("No questions to evaluate")
+            return
+        intervals = metrics["confidence_intervals"]
+        for name, label in (("recall", "Recall"), ("precision", "Precision"), ("ndcg", "nDCG")):
+            logfire.info("{name}@{k}: {value:.2%} ({level:.0%} CI {low:.2%} - {high:.2%})",
+                         name=label, k=k, value=metrics[name], level=intervals["level"],
+                         low=intervals[name][0], high=intervals[name][1])
+        logfire.info("MRR: {value:.3f} ({level:.0%} CI {low:.3f} - {high:.3f}) over {questions} questions",
+                     value=metrics["mrr"], level=intervals["level"], low=intervals["mrr"][0],
+                     high=intervals["mrr"][1], questions=metrics["questions"])
+
     def save_evals(self, evals_data, output_path):
         logfire.info("Saving evals to {output_path}", output_path=output_path)
         with open(output_path, "w") as f:
-            json.dump(evals_data, f, indent=2)
\ No newline at end of file
+            json.dump(evals_data, f, indent=2)
@@ -1,11 +1,27 @@
-import json
+import os
 import re
-import pdfplumber
+from concurrent.futures import ProcessPoolExecutor
 import logfire
+from .metrics import metrics
+from .artifacts import ArtifactWriter, artifact_exists, read_records, write_records
+
+
+def extract_page_range(pdf_path, first_page, last_page):
+    """Extract pages first_page..last_page (1-based, inclusive) in a worker process"""
+    import pdfplumber
+
+    records = []
+    with pdfplumber.open(pdf_path, pages=list(range(first_page, last_page + 1))) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text()
+            if text:
+                records.append({"page": page.page_number, "text": text})
+    return records
+
 
 class Extracts:
-    def __init__(self):
-        pass
+    def __init__(self, settings):
+        self.settings = settings
     
     def clean_text(self, text):
         """Clean extracted text by removing excessive whitespace and empty lines"""
@@ -28,6 +44,8 @@ class Extracts:
     
     def extract_text_from_pdf(self, pdf_path, max_pages=None):
         """Extract text from PDF file using pdfplumber"""
+        import pdfplumber
+
         logfire.info("Extracting text from PDF with pdfplumber...")
         
         extract = []
@@ -41,20 +59,79 @@ class Extracts:
                 
                 if cleaned_text:
                     extract.append({"page": num, "text": cleaned_text})
-                    logfire.info("Page {num}: {len} characters", num=num, len=len(cleaned_text))
+                    metrics.count("extract.pages")
+                    metrics.count("extract.text_bytes", len(cleaned_text.encode("utf-8")))
+                    metrics.sample_debug("Page {num}: {len} characters", num=num, len=len(cleaned_text))
         
         logfire.info("Extracted text from {len} pages", len=len(extract))
         return extract
     
+    def count_pages(self, pdf_path, max_pages=None):
+        import pdfplumber
+
+        with pdfplumber.open(pdf_path) as pdf:
+            total = len(pdf.pages)
+        # same cut-off as extract_text_from_pdf, which stops before page max_pages
+        return min(total, max_pages - 1) if max_pages else total
+
+    def stream_pages_parallel(self, pdf_path, max_pages=None):
+        """Yield page records in page order while shards are extracted across a process pool"""
+        total = self.count_pages(pdf_path, max_pages)
+        workers = self.settings.extraction_workers or os.cpu_count()
+        shards = [
+            (first, min(first + self.settings.extraction_pages_per_shard - 1, total))
+            for first in range(1, total + 1, self.settings.extraction_pages_per_shard)
+        ]
+        logfire.info("Extracting {total} pages in {shards} shards with {workers} workers",
+                     total=total, shards=len(shards), workers=workers)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # only a bounded window of shards is in flight, so memory does not grow with the page count
+            window = workers * 2
+            pending = {}
+            for shard_index, (first, last) in enumerate(shards[:window]):
+                pending[shard_index] = executor.submit(extract_page_range, pdf_path, first, last)
+            for shard_index in range(len(shards)):
+                # time the consumer waits on the pool, near zero when extraction keeps ahead
+                with metrics.timer("extract.shard_wait"):
+                    records = pending.pop(shard_index).result()
+                next_index = shard_index + window
+                if next_index < len(shards):
+                    pending[next_index] = executor.submit(extract_page_range, pdf_path, *shards[next_index])
+                metrics.count("extract.shards")
+                for record in records:
+                    metrics.count("extract.pages")
+                    metrics.count("extract.text_bytes", len(record["text"].encode("utf-8")))
+                    metrics.sample_debug("Page {num}: {len} characters", num=record["page"], len=len(record["text"]))
+                    yield record
+
+    def iter_pages(self, pdf_path, max_pages=None):
+        """Page records in page order, extracted across a process pool unless extraction.workers is 1"""
+        if self.settings.extraction_workers != 1:
+            return self.stream_pages_parallel(pdf_path, max_pages)
+        return iter(self.extract_text_from_pdf(pdf_path, max_pages))
+
+    def load_extract(self, extract_path):
+        """Load an NDJSON extract, falling back to a legacy extract.json written next to it"""
+        return read_records(extract_path)
+
+    def extract_exists(self, extract_path):
+        return artifact_exists(extract_path)
+
     def save_extract(self, extract_data, output_path):
-        """Save extracted text to file"""
+        """Save extracted text to an NDJSON file, one page per line"""
         logfire.info("Saving extracted text...")
-        with open(output_path, "w") as f:
-            json.dump(extract_data, f, indent=2)
+        write_records(output_path, extract_data)
         logfire.info("Saved extracted text to {output_path}", output_path=output_path)
     
-    def extract_and_save(self, pdf_path, output_path, max_pages=None):
-        """Extract text from PDF and save to file"""
-        extract_data = self.extract_text_from_pdf(pdf_path, max_pages)
-        self.save_extract(extract_data, output_path)
-        return extract_data
+    def extract_and_save(self, pdf_path, output_path, max_pages=None, on_page=None):
+        """Write page records to an NDJSON extract as they finish and pass each one to
+        on_page, so downstream steps work through the pages while extraction continues.
+        Returns the page count, the pages are not kept"""
+        with ArtifactWriter(output_path) as writer:
+            for record in self.iter_pages(pdf_path, max_pages):
+                writer.write(record)
+                if on_page is not None:
+                    on_page(record)
+        logfire.info("Extracted text from {len} pages to {output_path}", len=writer.count, output_path=output_path)
+        return writer.count
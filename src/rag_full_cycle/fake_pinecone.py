@@ -0,0 +1,238 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+
+# request limits of the Pinecone upsert API
+MAX_UPSERT_BYTES = 2 * 1024 * 1024
+MAX_UPSERT_VECTORS = 1000
+
+
+class FakeIndex:
+    """One serverless index: exact cosine search over the vectors of each namespace"""
+
+    def __init__(self, name, dimension, metric, ready_at):
+        self.name = name
+        self.dimension = dimension
+        self.metric = metric
+        self.ready_at = ready_at
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def ready(self):
+        return time.monotonic() >= self.ready_at
+
+    def model(self):
+        return {
+            "name": self.name,
+            "dimension": self.dimension,
+            "metric": self.metric,
+            "host": f"localhost:{self.server.server_address[1]}",
+            "spec": {"serverless": {"cloud": "aws", "region": "us-east-1"}},
+            "status": {"ready": self.ready(), "state": "Ready" if self.ready() else "Initializing"},
+            "deletion_protection": "disabled",
+            "vector_type": "dense",
+        }
+
+    def upsert(self, namespace, vectors):
+        with self.lock:
+            records = self.namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                if len(vector["values"]) != self.dimension:
+                    raise ValueError(f"Vector dimension {len(vector['values'])} does not match the dimension of the index {self.dimension}")
+                records[vector["id"]] = (np.asarray(vector["values"], dtype=np.float32), vector.get("metadata"))
+
+    def delete(self, namespace, ids, delete_all):
+        with self.lock:
+            records = self.namespaces.get(namespace, {})
+            if delete_all:
+                records.clear()
+            for record_id in ids:
+                records.pop(record_id, None)
+
+    def list_ids(self, namespace, start, limit):
+        with self.lock:
+            return sorted(self.namespaces.get(namespace, {}))[start:start + limit]
+
+    def query(self, namespace, vector, top_k, include_metadata):
+        with self.lock:
+            records = list(self.namespaces.get(namespace, {}).items())
+        if not records:
+            return []
+        matrix = np.stack([values for _, (values, _) in records])
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1) * np.linalg.norm(query), 1e-12)
+        order = np.argsort(-scores)[:top_k]
+        matches = []
+        for i in order:
+            record_id, (_, metadata) = records[i]
+            match = {"id": record_id, "score": float(scores[i]), "values": []}
+            if include_metadata and metadata:
+                match["metadata"] = metadata
+            matches.append(match)
+        return matches
+
+
+class FakePinecone:
+    """Local stand-in for the Pinecone control and data plane APIs, for running the
+    vector store writer offline: the control plane listens on port and every index gets
+    its own data plane port, like Pinecone Local. New indexes report ready after
+    ready_delay seconds and upserts over the API size limits are rejected.
+    """
+
+    def __init__(self, port=5080, ready_delay=1.0):
+        self.port = port
+        self.ready_delay = ready_delay
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.requests = {"upsert": 0, "query": 0, "delete": 0}
+        self.server = None
+
+    def start(self):
+        """Serve in background threads, returns the control plane URL"""
+        self.server = self.serve(ControlPlaneHandler, self.port)
+        return f"http://localhost:{self.server.server_address[1]}"
+
+    def stop(self):
+        for index in self.indexes.values():
+            index.server.shutdown()
+        self.server.shutdown()
+
+    def serve(self, handler, port):
+        server = ThreadingHTTPServer(("localhost", port), handler)
+        server.daemon_threads = True
+        server.fake = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def create_index(self, name, dimension, metric):
+        with self.lock:
+            if name in self.indexes:
+                return None
+            index = FakeIndex(name, dimension, metric, time.monotonic() + self.ready_delay)
+            index.server = self.serve(DataPlaneHandler, 0)
+            index.server.index = index
+            self.indexes[name] = index
+            return index
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body_bytes = length
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def error(self, status, code, message):
+        self.reply(status, {"error": {"code": code, "message": message}, "status": status})
+
+
+class ControlPlaneHandler(Handler):
+    def do_GET(self):
+        fake = self.server.fake
+        if self.path == "/indexes":
+            self.reply(200, {"indexes": [index.model() for index in fake.indexes.values()]})
+            return
+        match = re.fullmatch(r"/indexes/([^/?]+)", self.path)
+        index = fake.indexes.get(match.group(1)) if match else None
+        if index is None:
+            self.error(404, "NOT_FOUND", f"Resource {self.path} not found")
+            return
+        self.reply(200, index.model())
+
+    def do_POST(self):
+        if self.path != "/indexes":
+            self.error(404, "NOT_FOUND", f"Resource {self.path} not found")
+            return
+        body = self.read_json()
+        index = self.server.fake.create_index(body["name"], body["dimension"], body.get("metric", "cosine"))
+        if index is None:
+            self.error(409, "ALREADY_EXISTS", "Resource already exists")
+            return
+        self.reply(201, index.model())
+
+
+class DataPlaneHandler(Handler):
+    def do_GET(self):
+        index = self.server.index
+        url = urlparse(self.path)
+        if url.path != "/vectors/list":
+            self.error(404, "NOT_FOUND", f"Resource {self.path} not found")
+            return
+        query = parse_qs(url.query)
+        namespace = query.get("namespace", [""])[0]
+        # the pagination token is the offset of the next page in id order
+        start = int(query.get("paginationToken", ["0"])[0])
+        limit = int(query.get("limit", ["100"])[0])
+        ids = index.list_ids(namespace, start, limit)
+        body = {"vectors": [{"id": record_id} for record_id in ids], "namespace": namespace, "usage": {"readUnits": 1}}
+        if len(ids) == limit:
+            body["pagination"] = {"next": str(start + limit)}
+        self.reply(200, body)
+
+    def do_POST(self):
+        index = self.server.index
+        fake = self.server.fake
+        body = self.read_json()
+        if not index.ready():
+            self.error(503, "UNAVAILABLE", "Index is not ready")
+        elif self.path == "/vectors/upsert":
+            vectors = body.get("vectors", [])
+            if self.body_bytes > MAX_UPSERT_BYTES:
+                self.error(400, "OUT_OF_RANGE", f"Request size {self.body_bytes} bytes exceeds the limit of {MAX_UPSERT_BYTES} bytes")
+            elif len(vectors) > MAX_UPSERT_VECTORS:
+                self.error(400, "OUT_OF_RANGE", f"Batch size {len(vectors)} exceeds the limit of {MAX_UPSERT_VECTORS}")
+            else:
+                try:
+                    index.upsert(body.get("namespace", ""), vectors)
+                except ValueError as e:
+                    self.error(400, "INVALID_ARGUMENT", str(e))
+                    return
+                with fake.lock:
+                    fake.requests["upsert"] += 1
+                self.reply(200, {"upsertedCount": len(vectors)})
+        elif self.path == "/vectors/delete":
+            index.delete(body.get("namespace", ""), body.get("ids", []), body.get("deleteAll", False))
+            with fake.lock:
+                fake.requests["delete"] += 1
+            self.reply(200, {})
+        elif self.path == "/query":
+            matches = index.query(body.get("namespace", ""), body["vector"], body["topK"], body.get("includeMetadata", False))
+            with fake.lock:
+                fake.requests["query"] += 1
+            self.reply(200, {"matches": matches, "namespace": body.get("namespace", ""), "usage": {"readUnits": 1}})
+        else:
+            self.error(404, "NOT_FOUND", f"Resource {self.path} not found")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rag_full_cycle.fake_pinecone',
+                                     description='Local fake Pinecone server, set vector_search.pinecone_host to its URL')
+    parser.add_argument('--port', type=int, default=5080, help='Control plane port')
+    parser.add_argument('--ready-delay', type=float, default=1.0, help='Seconds before a new index is ready')
+    args = parser.parse_args(argv)
+    fake = FakePinecone(args.port, args.ready_delay)
+    print(f"Fake Pinecone listening on {fake.start()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from urllib.parse import quote, urlsplit
+import numpy as np
+from .config import available_datasets, load_settings
+from .artifacts import artifact_exists, artifact_path, read_records
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection issuing GET requests"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode("latin-1"))
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        body = await self.reader.readexactly(length)
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def load_queries(dataset, size, overlap):
+    """The generated questions of a chunk config, the text to search for"""
+    settings = load_settings(dataset)
+    size = settings.chunk_sizes[0] if size is None else size
+    overlap = settings.chunk_overlaps[0] if overlap is None else overlap
+    path = artifact_path(settings.output_dir, f"questions-{size}-{overlap}", settings.artifact_compression)
+    if not artifact_exists(path):
+        raise SystemExit(f"No questions at {path}, run the questions step or pass --queries-file")
+    return [question for entry in read_records(path) for question in entry["questions"]]
+
+
+async def run(url, queries, concurrency, duration, top_k, distinct, rate):
+    """concurrency clients send queries back to back (or at rate queries/s in total) for duration seconds"""
+    target = urlsplit(url)
+    latencies = []
+    statuses = {}
+    cached = 0
+    sent = 0
+    started = time.perf_counter()
+    stop_at = started + duration
+    interval = concurrency / rate if rate else 0.0
+
+    async def client(number):
+        nonlocal cached, sent
+        connection = Connection(target.hostname, target.port or 80)
+        rng = random.Random(number)
+        next_send = time.perf_counter() + (rng.random() * interval)
+        try:
+            while time.perf_counter() < stop_at:
+                if interval:
+                    await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+                    next_send += interval
+                query = rng.choice(queries)
+                if distinct:
+                    # a never seen query text, so every request misses the result cache
+                    query = f"{query} #{number}-{sent}"
+                sent += 1
+                request_started = time.perf_counter()
+                try:
+                    status, body = await connection.get(f"/search?k={top_k}&q={quote(query)}")
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    connection.close()
+                    status, body = 0, b""
+                latencies.append(time.perf_counter() - request_started)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200 and json.loads(body)["cached"]:
+                    cached += 1
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 2),
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2) if len(latencies_ms) else None,
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2) if len(latencies_ms) else None,
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2) if len(latencies_ms) else None,
+        "max_ms": round(float(latencies_ms.max()), 2) if len(latencies_ms) else None,
+        "cached_fraction": round(cached / len(latencies), 3) if latencies else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pipeline loadtest', description='Load test a running pipeline serve endpoint')
+    parser.add_argument('dataset', nargs='?', default='fy10', choices=available_datasets(),
+                        help='Dataset whose generated questions are the queries')
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='Base URL of the server')
+    parser.add_argument('--size', type=int, default=None, help='Chunk size of the questions to send')
+    parser.add_argument('--overlap', type=int, default=None, help='Chunk overlap of the questions to send')
+    parser.add_argument('--queries-file', default=None, help='Text file with one query per line, instead of the questions')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent keep-alive clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--rate', type=float, default=None, help='Total queries per second (default: as fast as answered)')
+    parser.add_argument('--top-k', type=int, default=5, help='Results per query')
+    parser.add_argument('--distinct', action='store_true', help='Make every query unique to measure uncached searches')
+    args = parser.parse_args(argv)
+
+    if args.queries_file:
+        with open(args.queries_file, 'r') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = load_queries(args.dataset, args.size, args.overlap)
+    result = asyncio.run(run(args.url, queries, args.concurrency, args.duration, args.top_k, args.distinct, args.rate))
+    print(json.dumps(result, indent=2))
+    return 0 if set(result["statuses"]) <= {"200"} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
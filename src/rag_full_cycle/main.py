@@ -1,147 +1,263 @@
 import json
 import os
+import sys
 import argparse
+import threading
+from functools import partial
 
-from .config import *
+from .config import available_datasets, load_settings
 from .extracts import Extracts
-from .chunks import Chunks
+from .chunks import Chunks, ChunkStream, tokenize_extract
 from .vectors import Vectors
 from .questions import Questions
 from .retrievers import Retrievers
 from .evals import Evals
+from .vector_files import ensure_vector_file
+from .artifacts import artifact_path, iter_records, migrate_legacy_json, read_records
+from .dag import DAG, Step, file_hash, artifact_hash
+from .corpus import Corpus
+from .dedup import Dedup, drop_aliases, load_aliases
+from .sweep import Sweep, ResourceLimits
+from .metrics import configure_logging, metrics
+from .profiling import StepProfiler
 import logfire
 
 
-def main():
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "bench":
+        from .bench import main as bench_main
+        sys.exit(bench_main(argv[1:]))
+    if argv and argv[0] == "serve":
+        from .serve import main as serve_main
+        sys.exit(serve_main(argv[1:]))
+    if argv and argv[0] == "loadtest":
+        from .loadtest import main as loadtest_main
+        sys.exit(loadtest_main(argv[1:]))
+
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='RAG Full Cycle Pipeline')
-    parser.add_argument('dataset', nargs='?', default='fy10', 
-                       choices=['fy10', 'baby'],
-                       help='Dataset to process (fy10 or baby)')
+    parser.add_argument('datasets', nargs='*', default=['fy10'],
+                       help='Datasets to process, any of configs/*.json (fy10, baby, corpus, ...)')
     parser.add_argument('--steps', nargs='+', 
-                       choices=['extract', 'chunk', 'vectorize', 'questions', 'retrievers', 'evaluate'],
-                       help='Specific steps to run (default: all)')
-    
-    args = parser.parse_args()
+                       choices=['extract', 'chunk', 'dedup', 'vectorize', 'questions', 'retrievers', 'evaluate'],
+                       help='Steps to rerun even when up to date, others are skipped (default: every out-of-date step)')
+    parser.add_argument('--log-level', choices=['trace', 'debug', 'info', 'notice', 'warn', 'error', 'fatal'],
+                       help='Lowest level logged (default: observability.log_level of the dataset)')
+    parser.add_argument('--profile', action='store_true',
+                       help='Profile every step with cProfile and tracemalloc, running configs one at a time')
     
-    logfire.configure(token=LOGFIRE_API_KEY)
-    logfire.info('Starting RAG Pipeline for dataset: {dataset}!', dataset=DATASET)
-    logfire.info('PDF file: {pdf_file}', pdf_file=PDF_FILE_PATH)
-    logfire.info('Chunk sizes: {sizes}, Overlaps: {overlaps}', sizes=CHUNK_SIZES, overlaps=CHUNK_OVERLAPS)
+    args = parser.parse_args(argv)
+    unknown = [dataset for dataset in args.datasets if dataset not in available_datasets()]
+    if unknown:
+        parser.error(f"unknown dataset {', '.join(unknown)}, choose from {', '.join(available_datasets())}")
+
+    all_settings = [load_settings(dataset) for dataset in args.datasets]
+    configure_logging(all_settings[0], args.log_level)
+    for settings in all_settings:
+        runPipelineForDataset(settings, args.steps, args.profile)
+
+def runPipelineForDataset(settings, steps=None, profile=False):
+    """Extract (or ingest the corpus) once, then run every size/overlap config of one dataset.
+    With profile, every step is profiled into {output_dir}/profiles"""
+    logfire.info('Starting RAG Pipeline for dataset: {dataset}!', dataset=settings.dataset)
+    logfire.info('PDF file: {pdf_file}', pdf_file=settings.pdf_file_path or settings.corpus_glob)
+    logfire.info('Chunk sizes: {sizes}, Overlaps: {overlaps}', sizes=settings.chunk_sizes, overlaps=settings.chunk_overlaps)
 
-    extract_file = f"{OUTPUT_DIR}/extract.json"
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(settings.output_dir, exist_ok=True)
+    metrics.reset()
+    profiler = StepProfiler(f"{settings.output_dir}/profiles") if profile else None
+    extract_file = artifact_path(settings.output_dir, "extract", settings.artifact_compression)
 
     # Extract step
-    if not args.steps or 'extract' in args.steps:
-        with logfire.span('extract PDF file'):
-            if not os.path.exists(extract_file):
-                extract_generator = Extracts()
-                extract = extract_generator.extract_and_save(
-                    PDF_FILE_PATH,
-                    extract_file,
-                    # max_pages=3
-                )
-            else:
-                with open(extract_file, 'r') as f:
-                    extract = json.load(f)
-                logfire.info("Loaded {len} pages from existing extract file", len=len(extract))
+    extract_generator = Extracts(settings)
+    # chunk files written while the extract streamed, their chunk steps have nothing left to do
+    streamed_chunks = set()
+    if settings.corpus_glob:
+        # corpus mode extracts and chunks each document itself and writes the merged chunk files
+        extract_file = None
+        if not steps or 'extract' in steps or 'chunk' in steps:
+            with logfire.span('ingest corpus') as span:
+                profiled(profiler, span, 'ingest',
+                         lambda changed: Corpus(settings).ingest(settings.chunk_sizes, settings.chunk_overlaps))(None)
     else:
-        # Load existing extract if not running extract step
-        with open(extract_file, 'r') as f:
-            extract = json.load(f)
-            logfire.info("Loaded {len} pages from existing extract file", len=len(extract))
-    # Run pipeline for each configuration
-    for size in CHUNK_SIZES:
-        for overlap in CHUNK_OVERLAPS:
-            logfire.info("Processing configuration: size={size}, overlap={overlap}", size=size, overlap=overlap)
-            runPipelineForConfig(extract, size, overlap, args.steps)
+        # a legacy extract.json is converted and then adopted
+        migrate_legacy_json(extract_file)
+
+        def extract(changed):
+            # a new extract invalidates every chunk file, so each page is chunked for all
+            # configs as soon as it is extracted instead of after the whole PDF
+            chunk_outputs = {}
+            if not steps or 'chunk' in steps:
+                chunk_outputs = {
+                    artifact_path(settings.output_dir, f"chunks-{size}-{overlap}", settings.artifact_compression):
+                        Chunks(size, overlap, settings.chunk_strategy, settings.chunk_tokenizer)
+                    for size in settings.chunk_sizes for overlap in settings.chunk_overlaps
+                }
+            with ChunkStream(chunk_outputs, settings.chunk_strategy, settings.chunk_tokenizer) as chunk_stream:
+                extract_generator.extract_and_save(settings.pdf_file_path, extract_file, on_page=chunk_stream.add)
+            streamed_chunks.update(chunk_outputs)
+
+        with logfire.span('extract PDF file') as span:
+            DAG([Step(
+                'extract', extract_file, profiled(profiler, span, 'extract', extract),
+                inputs={"pdf": file_hash(settings.pdf_file_path)},
+            )]).run(steps)
+
+    # Tokenize at most once, every size/overlap config that rechunks an existing extract
+    # slices the same token offsets
+    tokenize_lock = threading.Lock()
+    tokenized = []
+
+    def get_tokenized():
+        with tokenize_lock:
+            if not tokenized:
+                tokenized.append(tokenize_extract(iter_records(extract_file), settings.chunk_strategy, settings.chunk_tokenizer))
+        return tokenized[0]
 
+    # Run the pipeline for every configuration concurrently, one at a time when profiling
+    # so each step's memory peak is its own
+    Sweep(settings, max_parallel=1 if profiler else None).run(
+        partial(runPipelineForConfig, profiler=profiler, streamed_chunks=streamed_chunks), extract_file, steps, get_tokenized)
+
+    metrics.log_summary(f"{settings.output_dir}/metrics.json")
+    if profiler:
+        profiler.log_summary()
     logfire.info('RAG Pipeline completed successfully!')
 
-def runPipelineForConfig(extract, size, overlap, steps=None):
-    """Run pipeline for a specific configuration with optional step filtering"""
+def profiled(profiler, span, step, run, prefix=""):
+    """run, or with a profiler run profiled as {prefix}{step} with the summary set on span
+    as profile.{step}.* attributes"""
+    if profiler is None:
+        return run
+
+    def run_profiled(changed):
+        with profiler.profile(f"{prefix}{step}") as summary:
+            run(changed)
+        span.set_attributes({f"profile.{step}.{key}": value for key, value in summary.items() if key != "step"})
+
+    return run_profiled
+
+def runPipelineForConfig(settings, extract_file, size, overlap, steps=None, get_tokenized=None, resources=None, profiler=None,
+                         streamed_chunks=()):
+    """Run the pipeline DAG for one configuration, only rerunning the steps whose inputs
+    changed. Steps hold the external services they call through resources, returns the
+    evals data. A profiler profiles every step that runs. streamed_chunks are the chunk
+    files already written from the extract as it streamed.
+    """
     chunk_key = f"{size}-{overlap}"
+    resources = resources or ResourceLimits()
+    logfire.info("Processing configuration: size={size}, overlap={overlap}", size=size, overlap=overlap)
 
-    with logfire.span('processing {chunk_key}', chunk_key=chunk_key):
+    with logfire.span('processing {chunk_key}', chunk_key=chunk_key) as config_span:
         # Output files for this configuration
-        chunks_file = f"{OUTPUT_DIR}/chunks-{chunk_key}.json"
-        vectors_file = f"{OUTPUT_DIR}/vectors-{chunk_key}.json"
-        questions_file = f"{OUTPUT_DIR}/questions-{chunk_key}.json"
-        retrievers_file = f"{OUTPUT_DIR}/retrievers-{chunk_key}.json"
-        evals_file = f"{OUTPUT_DIR}/evals-{chunk_key}.json"
-
-        # Chunking
-        if not steps or 'chunk' in steps:
-            with logfire.span('Chunking'):
+        output_dir = settings.output_dir
+        compression = settings.artifact_compression
+        chunks_file = artifact_path(output_dir, f"chunks-{chunk_key}", compression)
+        # near-duplicate chunks mapped to the chunk kept for them
+        dedup_file = f"{output_dir}/dedup-{chunk_key}.json"
+        vectors_file = f"{output_dir}/vectors-{chunk_key}.npy"
+        questions_file = artifact_path(output_dir, f"questions-{chunk_key}", compression)
+        # dense keeps the original file names, other retrieval modes get their own results
+        mode_suffix = "" if settings.retrieval_mode == "dense" else f"-{settings.retrieval_mode}"
+        if settings.rerank_enabled:
+            mode_suffix += "-rerank"
+        retrievers_file = artifact_path(output_dir, f"retrievers-{chunk_key}{mode_suffix}", compression)
+        # evals are one summary document, not a record stream
+        evals_file = f"{output_dir}/evals-{chunk_key}{mode_suffix}.json"
+
+        def chunk(changed):
+            if extract_file is None:
+                # corpus mode: the ingest step already (re)wrote the merged chunks file
                 if not os.path.exists(chunks_file):
-                    chunk_generator = Chunks(size, overlap)
-                    chunks = chunk_generator.create_and_save_chunks(extract, chunks_file)
-                else:
-                    with open(chunks_file, 'r') as f:
-                        chunks = json.load(f)
-                    logfire.info('Found {chunks_file} chunk file', chunks_file=chunks_file)
-        else:
-            # Load existing chunks if not running chunk step
-            with open(chunks_file, 'r') as f:
-                chunks = json.load(f)
-            logfire.info('Loaded existing chunks from {chunks_file}', chunks_file=chunks_file)
-
-        # Early return if only running chunk step
-        if steps and len(steps) == 1 and 'chunk' in steps:
-            return
-
-        # vectors
-        if not steps or 'vectorize' in steps:
-            with logfire.span('Vector creation'):
-                if not os.path.exists(vectors_file):
-                    vector_generator = Vectors(size, overlap)
-                    success = vector_generator.process_chunks_to_vectors(chunks, vectors_file)
-                    if not success:
-                        logfire.info("Vector generation failed for")
-                        return
-                else:
-                    logfire.info("Found {vectors_file} vector file", vectors_file=vectors_file)
+                    raise FileNotFoundError(f"{chunks_file} is written by the corpus ingest step")
+                return
+            if chunks_file in streamed_chunks:
+                return
+            with logfire.span('Chunking'):
+                chunk_generator = Chunks(size, overlap, settings.chunk_strategy, settings.chunk_tokenizer)
+                chunk_generator.save_chunks(chunk_generator.iter_chunks(get_tokenized()), chunks_file)
 
-        # questions
-        if not steps or 'questions' in steps:
-            with logfire.span('Questions generation'):
-                if not os.path.exists(questions_file):
-                    question_generator = Questions(size, overlap)
-                    question_generator.generate_questions_from_chunks(chunks, questions_file)
-                else:
-                    logfire.info("Found {questions_file} questions file", questions_file=questions_file)
-
-        # retrievers
-        if not steps or 'retrievers' in steps:
-            with logfire.span('Retrievers'):
-                if not os.path.exists(retrievers_file):
-                    retriever = Retrievers(size, overlap)
-                    question_generator = Questions(size, overlap)
-                    questions_data = question_generator.load_questions_from_file(questions_file)
-                    
-                    # 30%
-                    total_questions = len(questions_data)
-                    num_questions = max(10, min(total_questions, int(total_questions * 0.3)))
-                    logfire.info("Using {num_questions} questions out of {total_questions} total (30% rule)", 
-                               num_questions=num_questions, total_questions=total_questions)
-                    
-                    retrievers = retriever.run_tests_for_chunk_size(questions_data, retrievers_file, num_questions=num_questions)
+        def dedup(changed):
+            with logfire.span('Dedup'):
+                Dedup(settings).dedup_and_save(read_records(chunks_file), dedup_file)
+
+        def canonical_chunks():
+            """The chunks without their near-duplicates, which are not embedded, stored or asked about"""
+            return drop_aliases(read_records(chunks_file), load_aliases(dedup_file))
+
+        def vectorize(changed):
+            # unchanged chunk texts come back from the embedding cache
+            with logfire.span('Vector creation'), resources.use("embeddings", "vector_store"):
+                vector_generator = Vectors(settings, size, overlap)
+                if not vector_generator.process_chunks_to_vectors(canonical_chunks(), vectors_file):
+                    raise RuntimeError(f"Vector generation failed for {chunk_key}")
+
+        def questions(changed):
+            with logfire.span('Questions generation'), resources.use("llm"):
+                question_generator = Questions(settings, size, overlap)
+                chunks = canonical_chunks()
+                if os.path.exists(questions_file) and set(changed) <= {"chunk", "dedup", "output"}:
+                    # same model and prompt: keep the questions of chunks whose text is unchanged,
+                    # drop the ones of chunks that became aliases
+                    question_generator.add_missing_questions(chunks, questions_file)
                 else:
-                    with open(retrievers_file, 'r') as f:
-                        retrievers = json.load(f)
-                    logfire.info("Found {retrievers_file} retriever file", retrievers_file=retrievers_file)
-        else:
-            # Load existing retrievers if not running retrievers step
-            with open(retrievers_file, 'r') as f:
-                retrievers = json.load(f)
-            logfire.info('Loaded existing retrievers from {retrievers_file}', retrievers_file=retrievers_file)
-
-        # eval
-        if not steps or 'evaluate' in steps:
+                    question_generator.generate_questions_from_chunks(chunks, questions_file)
+
+        def retrieve(changed):
+            rerank_resources = ("llm",) if settings.rerank_enabled else ()
+            with logfire.span('Retrievers'), resources.use("embeddings", "vector_store", *rerank_resources):
+                retriever = Retrievers(settings, size, overlap, canonical_chunks())
+                questions_data = Questions(settings, size, overlap).load_questions_from_file(questions_file)
+
+                total_questions = len(questions_data)
+                fraction = settings.retrieval_question_fraction
+                num_questions = max(settings.retrieval_min_questions, min(total_questions, int(total_questions * fraction)))
+                logfire.info("Using {num_questions} questions out of {total_questions} total ({fraction:.0%} sample)", 
+                           num_questions=num_questions, total_questions=total_questions, fraction=fraction)
+
+                retriever.run_tests_for_chunk_size(questions_data, retrievers_file, num_questions=num_questions)
+
+        def evaluate(changed):
             with logfire.span('Evals'):
-                evaluator = Evals(questions_results=retrievers)
-                evaluator.evaluate_and_save_results(k=3, evals_file=evals_file)
+                evaluator = Evals(questions_results=read_records(retrievers_file), bootstrap_samples=settings.eval_bootstrap_samples,
+                                  confidence=settings.eval_confidence, seed=settings.eval_seed,
+                                  aliases=load_aliases(dedup_file))
+                evaluator.evaluate_and_save_results(k=settings.eval_k, evals_file=evals_file)
+
+        chunking = {"size": size, "overlap": overlap, "strategy": settings.chunk_strategy, "tokenizer": settings.chunk_tokenizer}
+        # the extract is shared by all configs and kept up to date by main
+        extract_hash = artifact_hash(extract_file) if extract_file is not None else None
+        # artifacts from before NDJSON and the binary vector format are converted and then adopted
+        for record_file in (chunks_file, questions_file, retrievers_file):
+            migrate_legacy_json(record_file)
+        ensure_vector_file(vectors_file, settings.vector_storage_dtype)
+        def step(name, run):
+            return profiled(profiler, config_span, name, run, prefix=f"{chunk_key}-")
+
+        DAG([
+            Step('chunk', chunks_file, step('chunk', chunk), inputs={"chunking": chunking, "extract": extract_hash}),
+            Step('dedup', dedup_file, step('dedup', dedup), upstream=['chunk'],
+                 inputs={"dedup": settings.section('dedup')}),
+            # the alias map can stay the same while chunk texts change, so both are upstream
+            Step('vectorize', vectors_file, step('vectorize', vectorize), upstream=['chunk', 'dedup'],
+                 inputs={"embedding_model": settings.embedding_model, "backend": settings.vector_backend,
+                         "storage_dtype": settings.vector_storage_dtype}),
+            Step('questions', questions_file, step('questions', questions), upstream=['chunk', 'dedup'],
+                 inputs={"question_model": settings.question_model, "prompt": settings.question_generation_prompt}),
+            Step('retrievers', retrievers_file, step('retrievers', retrieve), upstream=['dedup', 'vectorize', 'questions'],
+                 inputs={"retrieval": settings.section('retrieval'),
+                         "rerank": settings.section('rerank') if settings.rerank_enabled else None,
+                         "vector_search": settings.section('vector_search'), "embedding_model": settings.embedding_model}),
+            # schema 2 added MRR, nDCG, curves and confidence intervals to {recall, precision}
+            Step('evaluate', evals_file, step('evaluate', evaluate), upstream=['retrievers', 'dedup'],
+                 inputs={"evaluation": settings.section('evaluation')}, schema=2),
+        ]).run(steps)
+
+        if os.path.exists(evals_file):
+            with open(evals_file, 'r') as f:
+                return json.load(f)
+        return None
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,130 @@
+import bisect
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+import logfire
+
+# upper bounds of the latency buckets in seconds: 0.1ms doubling up to ~105s, then overflow
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, constant time and memory per observation"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, capped at the largest observation"""
+        rank = max(1, q * self.count)
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else None,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics:
+    """Counters and latency histograms of the hot paths, named "{stage}.{what}" with byte
+    counts ending in "_bytes". Kept in process for the end of run summary and exported as
+    logfire metrics; recording is a lock and a bisect, cheap enough for every request.
+
+    Per-item details go through sample_debug instead of being logged on every item.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.instruments = {}
+        self.debug_sample_rate = 0.0
+
+    def instrument(self, name, create):
+        instrument = self.instruments.get(name)
+        if instrument is None:
+            instrument = self.instruments[name] = create(name)
+        return instrument
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            counter = self.instrument(name, logfire.metric_counter)
+        counter.add(value)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            exported = self.instrument(name, lambda name: logfire.metric_histogram(name, unit="s"))
+        exported.record(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def sample_debug(self, message, **attributes):
+        """logfire.debug for a debug_sample_rate fraction of the calls"""
+        if self.debug_sample_rate and random.random() < self.debug_sample_rate:
+            logfire.debug(message, **attributes)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "latency": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def log_summary(self, path=None):
+        """Log every latency histogram and the counters, and save them to path as JSON"""
+        snapshot = self.snapshot()
+        for name, summary in snapshot["latency"].items():
+            logfire.info("{name}: {count} calls, mean {mean_ms} ms, p50 {p50_ms} ms, p99 {p99_ms} ms, max {max_ms} ms",
+                         name=name, **summary)
+        if snapshot["counters"]:
+            logfire.info("Counters: {counters}", counters=snapshot["counters"])
+        if path:
+            with open(path, "w") as f:
+                json.dump(snapshot, f, indent=2)
+        return snapshot
+
+
+metrics = Metrics()
+
+
+def configure_logging(settings, log_level=None, console=None):
+    """Configure logfire at log_level, by default the dataset's observability.log_level"""
+    metrics.debug_sample_rate = settings.debug_sample_rate
+    logfire.configure(token=settings.logfire_api_key, console=console, min_level=log_level or settings.log_level)
@@ -0,0 +1,119 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import logfire
+
+
+# profiles of the threads started through profiled_thread while a step is profiled
+thread_profiles = None
+
+
+def profiled_thread(target):
+    """target wrapped so that, when a step is being profiled, the thread running it is
+    profiled too and its calls are added to the step's profile"""
+    profiles = thread_profiles
+    if profiles is None:
+        return target
+
+    def run(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler, and it already sees every thread
+            return target(*args, **kwargs)
+        try:
+            return target(*args, **kwargs)
+        finally:
+            profile.disable()
+            profiles.append(profile)
+
+    return run
+
+
+class StepProfiler:
+    """Profiles pipeline steps with cProfile and tracemalloc.
+
+    Every profiled step leaves {directory}/{name}.pstats (python -m pstats, snakeviz) and
+    {name}.tracemalloc (tracemalloc.Snapshot.load) and a summary: wall and CPU seconds,
+    traced memory peak and growth, and the functions and lines that cost the most.
+    cProfile follows the thread that runs the step plus the threads it starts through
+    profiled_thread, such as the upsert thread of the vectorize step; other threads are
+    not profiled. tracemalloc traces the whole process, so profiled configs should run
+    one at a time.
+    """
+
+    def __init__(self, directory, top=10):
+        self.directory = directory
+        self.top = top
+        self.lock = threading.Lock()
+        self.summaries = []
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the body, yields the summary dict which is filled in when the body exits"""
+        global thread_profiles
+        os.makedirs(self.directory, exist_ok=True)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        memory_before, _ = tracemalloc.get_traced_memory()
+        profiler = cProfile.Profile()
+        summary = {"step": name}
+        thread_profiles = step_threads = []
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        profiler.enable()
+        try:
+            yield summary
+        finally:
+            profiler.disable()
+            thread_profiles = None
+            summary["seconds"] = round(time.perf_counter() - wall_started, 3)
+            summary["cpu_seconds"] = round(time.process_time() - cpu_started, 3)
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            summary["peak_mb"] = round((memory_peak - memory_before) / 2 ** 20, 2)
+            summary["growth_mb"] = round((memory_after - memory_before) / 2 ** 20, 2)
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+            stats = pstats.Stats(profiler)
+            for profile in step_threads:
+                stats.add(profile)
+            stats.dump_stats(f"{self.directory}/{name}.pstats")
+            snapshot.dump(f"{self.directory}/{name}.tracemalloc")
+            summary["top_functions"] = self.top_functions(stats, cumulative=True)
+            summary["hot_functions"] = self.top_functions(stats, cumulative=False)
+            summary["top_allocations"] = [str(stat) for stat in snapshot.statistics("lineno")[:self.top]]
+            with self.lock:
+                self.summaries.append(summary)
+
+    def top_functions(self, stats, cumulative):
+        """The functions with the most cumulative (callees included) or own time, as
+        "file:line(function) seconds" """
+        column = 3 if cumulative else 2
+        entries = sorted(stats.stats.items(), key=lambda item: -item[1][column])[:self.top]
+        return [f"{os.path.basename(file)}:{line}({function}) {timings[column]:.3f}s"
+                for (file, line, function), timings in entries]
+
+    def log_summary(self):
+        """Log one line per profiled step and save all summaries to summary.json"""
+        with self.lock:
+            summaries = sorted(self.summaries, key=lambda summary: -summary["seconds"])
+        if not summaries:
+            return summaries
+        for summary in summaries:
+            logfire.info("Profile {step}: {seconds}s wall, {cpu_seconds}s CPU, peak +{peak_mb} MB, growth {growth_mb} MB",
+                         **summary)
+        path = f"{self.directory}/summary.json"
+        with open(path, "w") as f:
+            json.dump(summaries, f, indent=2)
+        logfire.info("Saved profiles of {len} steps to {directory}", len=len(summaries), directory=self.directory)
+        return summaries
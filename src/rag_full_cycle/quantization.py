@@ -0,0 +1,141 @@
+import numpy as np
+from .ann import exact_top_k, kmeans, nearest_centroids, normalize, select_top_k
+
+
+class ScalarQuantizer:
+    """Per-dimension int8 codes, 4x smaller than float32"""
+
+    method = "int8"
+
+    def __init__(self, minimum=None, scale=None):
+        self.minimum = minimum
+        self.scale = scale
+
+    def train(self, matrix):
+        self.minimum = matrix.min(axis=0)
+        self.scale = (matrix.max(axis=0) - self.minimum) / 255.0
+        self.scale[self.scale == 0] = 1.0
+
+    def encode(self, matrix):
+        codes = np.rint((matrix - self.minimum) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def scores(self, queries, codes, block_size=65536):
+        """Approximate inner products, shape (len(queries), len(codes))"""
+        # q.x = q.min + (q*scale).(code + 128), decoded block by block to bound memory
+        offsets = queries @ self.minimum
+        weights = (queries * self.scale).astype(np.float32).T
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block = codes[start:start + block_size].astype(np.float32) + 128.0
+            scores[:, start:start + block_size] = (block @ weights).T
+        return scores + offsets[:, None]
+
+    def state(self):
+        return {"minimum": self.minimum, "scale": self.scale}
+
+
+class ProductQuantizer:
+    """Splits vectors into subspaces and stores one byte (a k-means centroid id) per subspace"""
+
+    method = "pq"
+
+    def __init__(self, subspaces=16, codebooks=None, iterations=20):
+        self.subspaces = subspaces
+        self.codebooks = codebooks
+        self.iterations = iterations
+
+    def split(self, matrix):
+        return [np.ascontiguousarray(part) for part in np.split(matrix, self.subspaces, axis=1)]
+
+    def train(self, matrix):
+        if matrix.shape[1] % self.subspaces:
+            raise ValueError(f"Dimension {matrix.shape[1]} is not divisible by {self.subspaces} subspaces")
+        self.codebooks = np.stack([
+            kmeans(part, 256, self.iterations, spherical=False) if len(part) >= 256
+            else np.pad(part, ((0, 256 - len(part)), (0, 0)))
+            for part in self.split(matrix)
+        ])
+
+    def encode(self, matrix):
+        return np.stack([
+            nearest_centroids(part, codebook, spherical=False)
+            for part, codebook in zip(self.split(matrix), self.codebooks)
+        ], axis=1).astype(np.uint8)
+
+    def scores(self, queries, codes):
+        """Asymmetric distance computation: sum of per-subspace lookup-table entries"""
+        tables = np.einsum('qmd,mkd->qmk', np.stack(self.split(queries), axis=1), self.codebooks)
+        subspace = np.arange(self.subspaces)
+        return np.stack([table[subspace, codes].sum(axis=1) for table in tables])
+
+    def state(self):
+        return {"codebooks": self.codebooks}
+
+
+class QuantizedIndex:
+    """Searches compressed codes, then rescores the best candidates against full-precision vectors"""
+
+    def __init__(self, quantizer, rescore_factor=4):
+        self.quantizer = quantizer
+        self.rescore_factor = rescore_factor
+        self.codes = None
+
+    def build(self, matrix):
+        matrix = normalize(matrix)
+        self.quantizer.train(matrix)
+        self.codes = self.quantizer.encode(matrix)
+
+    def search(self, queries, top_k, full_matrix, inverse_norms, rescore_factor=None, query_block_size=64):
+        """Return (rows, scores) of shape (len(queries), top_k) after exact rescoring"""
+        queries = normalize(queries)
+        candidates_count = min(len(self.codes), top_k * (rescore_factor or self.rescore_factor))
+        rows = []
+        scores = []
+        for start in range(0, len(queries), query_block_size):
+            group = queries[start:start + query_block_size]
+            candidates_per_query = select_top_k(self.quantizer.scores(group, self.codes), candidates_count)[0]
+            for query, candidates in zip(group, candidates_per_query):
+                # sorted rows keep memory-mapped reads sequential
+                candidates = np.sort(candidates)
+                exact = (np.asarray(full_matrix[candidates], dtype=np.float32) @ query) * inverse_norms[candidates]
+                top, top_scores = select_top_k(exact[None, :], top_k)
+                rows.append(candidates[top[0]])
+                scores.append(top_scores[0])
+        return rows, scores
+
+    def tune_rescore_factor(self, sample, top_k, full_matrix, inverse_norms, tolerance, max_factor=64):
+        """Double the rescore factor until recall@k against exact search is within tolerance"""
+        sample = normalize(sample)
+        exact = exact_top_k(sample, full_matrix, inverse_norms, top_k)[0]
+        while True:
+            rows, _ = self.search(sample, top_k, full_matrix, inverse_norms)
+            found = sum(len(np.intersect1d(a, e)) for a, e in zip(rows, exact))
+            recall = found / exact.size if exact.size else 1.0
+            if recall >= 1.0 - tolerance or self.rescore_factor >= max_factor:
+                return recall
+            self.rescore_factor *= 2
+
+    def save(self, path):
+        np.savez(path, codes=self.codes, method=np.array(self.quantizer.method),
+                 rescore_factor=np.array(self.rescore_factor), **self.quantizer.state())
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        method = str(data["method"])
+        if method == "int8":
+            quantizer = ScalarQuantizer(data["minimum"], data["scale"])
+        else:
+            quantizer = ProductQuantizer(data["codebooks"].shape[0], data["codebooks"])
+        index = cls(quantizer, int(data["rescore_factor"]))
+        index.codes = data["codes"]
+        return index
+
+
+def create_quantizer(method, subspaces):
+    if method == "int8":
+        return ScalarQuantizer()
+    if method == "pq":
+        return ProductQuantizer(subspaces)
+    raise ValueError(f"Unknown quantization method: {method}")
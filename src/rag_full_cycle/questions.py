@@ -1,101 +1,264 @@
+import asyncio
 import json
+import os
+import random
 import re
-from pinecone import Pinecone
+import time
 import logfire
-from .config import *
-from ollama import chat
-from ollama import ChatResponse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from .chunks import chunk_sort_key
+from .concurrency import AdaptiveLimiter
+from .metrics import metrics
+from .caches import ResponseCache, text_hash
+from .artifacts import RecordWriter, partial_path, read_records, write_records
 
 class Questions:
-    def __init__(self, size, overlap):
+    def __init__(self, settings, size, overlap):
         #self.client = OpenAI(
         #    base_url="https://openrouter.ai/api/v1",
         #    api_key=OPENROUTER_API_KEY,
         #)
         #self.client = instructor.patch(self.client)
-        self.pc = Pinecone(api_key=PINECONE_API_KEY)
-        self.pinecone_index_name = f"{size}-{overlap}-{pdf_file}"
+        self.settings = settings
+        self.size = size
+        self.overlap = overlap
+        self.cache = None
+        if settings.response_cache_enabled:
+            self.cache = ResponseCache(f"{settings.cache_dir}/responses.sqlite", settings.response_cache_max_entries)
 
     def load_questions_from_file(self, questions_file):
-        with open(questions_file, 'r') as f:
-             questions = json.load(f)
-        return questions
+        return read_records(questions_file)
 
     def generate_questions_for_chunk(self, chunk_text):
         """Generate questions for a single chunk of text using Instructor"""
         try:
-            logfire.info("Generation questions for: {chunk_text}", chunk_text=chunk_text)
-            prompt = QUESTION_GENERATION_PROMPT.format(chunk=chunk_text)
+            metrics.sample_debug("Generating questions for a {len} character chunk", len=len(chunk_text))
+            cached = self.cached_response(chunk_text)
+            if cached is not None:
+                metrics.count("questions.cached")
+                return self.parse_questions(cached)
+            prompt = self.settings.question_generation_prompt.format(chunk=chunk_text)
             # too much 429 
             #response = self.client.chat.completions.create(
             #    model=OPEN_ROUTER_MODEL,
             #    messages=[{"role": "user", "content": prompt}]
             #)
             #content = response.choices[0].message.content
-            response: ChatResponse = chat(model=QUESTION_MODEL, 
-                messages=[{"role": "user", "content": prompt}]
-            )
-            content = response['message']['content'];
-            questions = [q.strip() for q in content.split('\n') if q.strip()]
-            # in case the questions are numbered
-            clean_questions = [re.sub(r'^\s*\d+\.\s*', '', q) for q in questions]
-
-            return clean_questions
+            from ollama import chat
+
+            with metrics.timer("questions.chat"):
+                response = chat(model=self.settings.question_model, 
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            content = response['message']['content']
+            self.count_chat(prompt, content)
+            self.cache_response(chunk_text, content)
+            return self.parse_questions(content)
         except Exception as e:
             logfire.error("Error generating questions for chunk: {e}", e=e)
             raise e
     
-    def process_chunks(self, chunks):
-        logfire.info("Processing {len} chunks...", len=len(chunks))
+    def count_chat(self, prompt, content):
+        metrics.count("questions.requests")
+        metrics.count("questions.prompt_bytes", len(prompt.encode("utf-8")))
+        metrics.count("questions.response_bytes", len(content.encode("utf-8")))
 
-        questions_data = []
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_chunk = {}
-            for chunk in chunks:
-                future = executor.submit(self.process_single_chunk, chunk)
-                future_to_chunk[future] = chunk
-            
-            for future in as_completed(future_to_chunk):
-                chunk = future_to_chunk[future]
+    def cached_response(self, chunk_text):
+        if self.cache is None:
+            return None
+        return self.cache.get_response(self.settings.question_model, self.settings.question_generation_prompt, chunk_text)
+
+    def cache_response(self, chunk_text, content):
+        if self.cache is not None:
+            self.cache.put_response(self.settings.question_model, self.settings.question_generation_prompt, chunk_text, content)
+
+    def log_cache_stats(self):
+        if self.cache is not None:
+            self.cache.log_stats()
+
+    def parse_questions(self, content):
+        questions = [q.strip() for q in content.split('\n') if q.strip()]
+        # in case the questions are numbered
+        return [re.sub(r'^\s*\d+\.\s*', '', q) for q in questions]
+
+    def progress_path(self, output_path):
+        return partial_path(output_path)
+
+    def progress_header(self):
+        """First line of a progress file: results from another model or prompt are not resumed"""
+        return {"model": self.settings.question_model, "prompt": text_hash(self.settings.question_generation_prompt)}
+
+    def load_progress(self, progress_path):
+        """Results already streamed to the progress file by an earlier, interrupted run with
+        the same model and prompt. A progress file from another model or prompt is removed"""
+        if not os.path.exists(progress_path):
+            return []
+        done = []
+        valid_bytes = 0
+        with open(progress_path, 'rb') as f:
+            for line in f:
                 try:
-                    result = future.result()
-                    questions_data.append(result)
-                    logfire.info("Completed processing chunk {id}", id=chunk['id'])
-                except Exception as e:
-                    logfire.error("Error processing chunk {id}: {e}", id=chunk['id'], e=e)
-        
-        questions_data.sort(key=lambda x: [int(part) for part in x['chunk_id'].split('-')])
+                    done.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                valid_bytes += len(line)
+        if not done or done[0] != self.progress_header():
+            logfire.info("Discarding {progress_path}, it was not written with the current model and prompt",
+                         progress_path=progress_path)
+            os.remove(progress_path)
+            return []
+        # the last line may be cut short by a crash, drop it so new results append cleanly
+        with open(progress_path, 'r+b') as f:
+            f.truncate(valid_bytes)
+        return done[1:]
+
+    def process_chunks(self, chunks, progress_path=None):
+        logfire.info("Processing {len} chunks...", len=len(chunks))
+        questions_data = asyncio.run(self.process_chunks_async(chunks, progress_path))
+        self.log_cache_stats()
+        questions_data.sort(key=lambda x: chunk_sort_key(x['chunk_id']))
         return questions_data
-    
-    def process_single_chunk(self, chunk):
-        chunk_text = chunk['text']
-        logfire.info("Generation questions for chunk {id}...", id=chunk['id'])
-        
-        questions = self.generate_questions_for_chunk(chunk_text)
-        return {
-            "chunk_id": chunk['id'],
-            "text": chunk_text,
-            "questions": questions
-        }
 
-    
+    async def process_chunks_async(self, chunks, progress_path=None, client=None):
+        """Generate questions with an adaptive number of concurrent requests, streaming each
+        result to progress_path so a rerun after a crash only processes the remaining chunks.
+        Raises RuntimeError when chunks still fail after max_retries, leaving progress_path
+        in place. client defaults to an Ollama AsyncClient, anything with the same async
+        chat() works"""
+        chunk_texts = {chunk['id']: chunk['text'] for chunk in chunks}
+        # like add_missing_questions, only results for the current text of a chunk are kept
+        done = [entry for entry in (self.load_progress(progress_path) if progress_path else [])
+                if chunk_texts.get(entry['chunk_id']) == entry['text']]
+        done_ids = {entry['chunk_id'] for entry in done}
+        pending = [chunk for chunk in chunks if chunk['id'] not in done_ids]
+        if done:
+            logfire.info("Resuming: {done} chunks already done, {pending} to go", done=len(done), pending=len(pending))
+
+        if client is None:
+            from ollama import AsyncClient
+            client = AsyncClient()
+        settings = self.settings
+        limiter = AdaptiveLimiter(settings.question_initial_concurrency, settings.question_min_concurrency,
+                                  settings.question_max_concurrency, settings.question_target_latency)
+        results = list(done)
+        failed = []
+        progress = None
+        if progress_path:
+            progress = RecordWriter(progress_path, append=True).open()
+            if progress.file.tell() == 0:
+                progress.write(self.progress_header())
+
+        async def run(chunk):
+            try:
+                result = await self.process_single_chunk_async(client, limiter, chunk)
+            except Exception as e:
+                logfire.error("Error processing chunk {id}: {e}", id=chunk['id'], e=e)
+                failed.append(chunk['id'])
+                return
+            results.append(result)
+            if progress:
+                progress.write(result)
+                progress.flush()
+            metrics.sample_debug("Completed processing chunk {id}", id=chunk['id'])
+
+        try:
+            tasks = set()
+            for chunk in pending:
+                # backpressure: never more tasks waiting than the current limit allows
+                while len(tasks) >= limiter.limit:
+                    _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                tasks.add(asyncio.create_task(run(chunk)))
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            if progress:
+                progress.close()
+
+        if failed:
+            # the progress file keeps every finished chunk, so the rerun only retries the failed ones
+            logfire.error("Question generation failed for {len} chunks after retries: {ids}", len=len(failed), ids=failed)
+            raise RuntimeError(f"Question generation failed for {len(failed)} of {len(chunks)} chunks, "
+                               f"rerun to retry them: {sorted(failed, key=chunk_sort_key)}")
+        return results
+
+    async def process_single_chunk_async(self, client, limiter, chunk):
+        """Generate questions for one chunk, retrying with exponential backoff and full jitter"""
+        cached = self.cached_response(chunk['text'])
+        if cached is not None:
+            metrics.count("questions.cached")
+            return {
+                "chunk_id": chunk['id'],
+                "text": chunk['text'],
+                "questions": self.parse_questions(cached)
+            }
+        prompt = self.settings.question_generation_prompt.format(chunk=chunk['text'])
+        for attempt in range(self.settings.max_retries):
+            await limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = await client.chat(model=self.settings.question_model,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            except Exception as e:
+                await limiter.release(time.monotonic() - started, ok=False)
+                metrics.count("questions.errors")
+                if attempt == self.settings.max_retries - 1:
+                    raise
+                delay = random.uniform(0, min(60, 2 ** attempt))
+                logfire.warn("Retrying chunk {id} in {delay:.1f}s: {e}", id=chunk['id'], delay=delay, e=e)
+                await asyncio.sleep(delay)
+                continue
+            latency = time.monotonic() - started
+            await limiter.release(latency, ok=True)
+            metrics.observe("questions.chat", latency)
+            content = response['message']['content']
+            self.count_chat(prompt, content)
+            self.cache_response(chunk['text'], content)
+            return {
+                "chunk_id": chunk['id'],
+                "text": chunk['text'],
+                "questions": self.parse_questions(content)
+            }
+
     def generate_questions_from_chunks(self, chunks, output_path):
         """Generate questions from chunks"""
         logfire.info("Generating questions from chunks...")
         
         try:
-            questions_data = self.process_chunks(chunks)
+            progress_path = self.progress_path(output_path)
+            questions_data = self.process_chunks(chunks, progress_path)
             self.save_questions(questions_data, output_path)
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
             return questions_data
             
         except Exception as e:
             logfire.error("Error generating questions: {e}", e=e)
             raise e
     
+    def add_missing_questions(self, chunks, questions_file):
+        """Keep questions for chunks that still exist with the same text and generate them only
+        for new or changed chunks"""
+        existing = self.load_questions_from_file(questions_file)
+        chunk_texts = {chunk['id']: chunk['text'] for chunk in chunks}
+        kept = [entry for entry in existing if chunk_texts.get(entry['chunk_id']) == entry['text']]
+        answered = {entry['chunk_id'] for entry in kept}
+        missing = [chunk for chunk in chunks if chunk['id'] not in answered]
+        if not missing and len(kept) == len(existing):
+            logfire.info("Found {questions_file} questions file", questions_file=questions_file)
+            return existing
+
+        logfire.info("Generating questions for {missing} new or changed chunks, dropping {dropped} stale ones",
+                     missing=len(missing), dropped=len(existing) - len(kept))
+        progress_path = self.progress_path(questions_file)
+        questions_data = kept + self.process_chunks(missing, progress_path)
+        questions_data.sort(key=lambda x: chunk_sort_key(x['chunk_id']))
+        self.save_questions(questions_data, questions_file)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        return questions_data
+
     def save_questions(self, questions_data, output_path):
         """Save questions data to file"""
         logfire.info("Saving questions to {output_path}", output_path=output_path)
-        with open(output_path, "w") as f:
-            json.dump(questions_data, f, indent=2)
+        write_records(output_path, questions_data)
         logfire.info("Saved {len} question sets to {output_path}", len=len(questions_data), output_path=output_path)
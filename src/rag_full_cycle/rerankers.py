@@ -0,0 +1,119 @@
+import asyncio
+import re
+import time
+import logfire
+from .caches import ScoreCache
+from .metrics import metrics
+
+RERANK_PROMPT = """Rate how well the passage answers the question, from 0 (unrelated) to 10 (answers it directly).
+Reply with the number only.
+
+Question: {question}
+
+Passage: {passage}"""
+
+SCORE_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def parse_score(content):
+    """First number in the judge reply clamped to 0-10, None if the reply has no number"""
+    match = SCORE_PATTERN.search(content)
+    if match is None:
+        return None
+    return min(10.0, max(0.0, float(match.group())))
+
+
+class LLMJudgeReranker:
+    """Second-stage reranker: an Ollama model judges each (question, candidate chunk) pair.
+
+    The pairs of one question are scored concurrently, at most concurrency at a time. If
+    they are not all scored within time_budget seconds the question keeps its first-stage
+    order. Scores are cached per pair, so the pairs that did finish are not asked again.
+    """
+
+    def __init__(self, settings, model=None, concurrency=None, time_budget=None):
+        self.model = model or settings.rerank_model
+        self.concurrency = concurrency or settings.rerank_concurrency
+        self.time_budget = time_budget or settings.rerank_time_budget
+        self.fallbacks = 0
+        self.cache = None
+        if settings.rerank_cache_enabled:
+            self.cache = ScoreCache(f"{settings.cache_dir}/rerank-scores.sqlite", settings.rerank_cache_max_entries)
+
+    def rerank_batch(self, questions, candidates, chunk_texts, top_k):
+        """Rerank the first-stage candidate lists of several questions, returns top_k
+        [{"id", "score", "first_stage_score"}] per question in input order"""
+        self.fallbacks = 0
+        reranked = asyncio.run(self.rerank_all(questions, candidates, chunk_texts, top_k))
+        if self.fallbacks:
+            logfire.warn("Reranking fell back to first-stage order for {fallbacks} of {len} questions",
+                         fallbacks=self.fallbacks, len=len(questions))
+        if self.cache is not None:
+            self.cache.log_stats()
+        return reranked
+
+    async def rerank_all(self, questions, candidates, chunk_texts, top_k):
+        from ollama import AsyncClient
+
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # questions run one after another so each gets the whole time budget
+        return [
+            await self.rerank_query(client, semaphore, question, matches, chunk_texts, top_k)
+            for question, matches in zip(questions, candidates)
+        ]
+
+    async def rerank_query(self, client, semaphore, question, matches, chunk_texts, top_k):
+        matches = [match for match in matches if match['id'] in chunk_texts]
+        texts = [chunk_texts[match['id']] for match in matches]
+        scores = self.cached_scores(question, texts)
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            tasks = {
+                asyncio.create_task(self.judge(client, semaphore, question, texts[i])): i
+                for i in missing
+            }
+            done, pending = await asyncio.wait(tasks, timeout=self.time_budget)
+            for task in pending:
+                task.cancel()
+            fresh = [(tasks[task], task.result()) for task in done
+                     if task.exception() is None and task.result() is not None]
+            for i, score in fresh:
+                scores[i] = score
+            if self.cache is not None and fresh:
+                self.cache.put_scores(self.model, RERANK_PROMPT, question,
+                                      [texts[i] for i, _ in fresh], [score for _, score in fresh])
+
+        if any(score is None for score in scores):
+            self.fallbacks += 1
+            metrics.count("rerank.fallbacks")
+            return matches[:top_k]
+
+        # ties keep the first-stage order
+        order = sorted(range(len(matches)), key=lambda i: -scores[i])
+        return [
+            {'id': matches[i]['id'], 'score': scores[i], 'first_stage_score': matches[i]['score']}
+            for i in order[:top_k]
+        ]
+
+    async def judge(self, client, semaphore, question, passage):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.chat(
+                    model=self.model,
+                    messages=[{"role": "user", "content": RERANK_PROMPT.format(question=question, passage=passage)}],
+                    options={"temperature": 0}
+                )
+            except Exception as e:
+                metrics.count("rerank.errors")
+                logfire.error("Error reranking passage: {e}", e=e)
+                return None
+            metrics.observe("rerank.judge", time.perf_counter() - started)
+        return parse_score(response['message']['content'])
+
+    def cached_scores(self, question, texts):
+        if self.cache is None:
+            return [None] * len(texts)
+        return self.cache.get_scores(self.model, RERANK_PROMPT, question, texts)
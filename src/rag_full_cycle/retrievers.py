@@ -1,18 +1,54 @@
-import json
 import random
 import logfire
 from .embeddings import Embeddings
 from .vectors import Vectors
+from .bm25 import BM25Index, reciprocal_rank_fusion
+from .rerankers import LLMJudgeReranker
+from .metrics import metrics
+from .artifacts import artifact_path, read_records, write_records
+
+RETRIEVAL_MODES = ("dense", "bm25", "hybrid")
 
 
 class Retrievers:
-    """Handles random question selection and testing for RAG pipeline"""
+    """Handles random question selection and testing for RAG pipeline.
+
+    mode selects dense vector search, BM25 over the chunk text, or hybrid: both lists
+    fused with reciprocal-rank fusion. With rerank, a deeper first-stage candidate pool is
+    rescored by an LLM judge and both the reranked and first-stage top-k are kept.
+    """
     
-    def __init__(self, size, overlap):
+    def __init__(self, settings, size, overlap, chunks=None, mode=None, rerank=None):
+        mode = mode or settings.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        if rerank is None:
+            rerank = settings.rerank_enabled
+        self.settings = settings
         self.size = size
         self.overlap = overlap
-        self.embedding_generator = Embeddings()
-        self.vector_generator = Vectors(size, overlap)
+        self.mode = mode
+        self.chunks = chunks
+        self.lexical_index = None
+        self.embedding_generator = Embeddings(settings)
+        self.vector_generator = Vectors(settings, size, overlap)
+        self.reranker = LLMJudgeReranker(settings) if rerank else None
+
+    def get_chunks(self):
+        if self.chunks is None:
+            self.chunks = read_records(artifact_path(self.settings.output_dir, f"chunks-{self.size}-{self.overlap}",
+                                                       self.settings.artifact_compression))
+        return self.chunks
+
+    def get_lexical_index(self):
+        """BM25 index over the chunks of this config, built in memory on first use"""
+        if self.lexical_index is None:
+            chunks = self.get_chunks()
+            self.lexical_index = BM25Index().build(chunks)
+            logfire.info("Built BM25 index: {docs} chunks, {terms} terms, {postings} postings",
+                         docs=len(chunks), terms=len(self.lexical_index.vocabulary),
+                         postings=len(self.lexical_index.doc_ids))
+        return self.lexical_index
 
     def extract_all_questions(self, questions_data):
         all_questions = []
@@ -40,12 +76,28 @@ class Retrievers:
         logfire.info("Selected {len} questions for testing", len=len(selected_questions))
         return selected_questions
     
-    def test_question_retrieval(self, question_data):
-        logfire.info("Test question: {question_data}", question_data=question_data)
+    def embed_questions(self, selected_questions):
+        """Embed questions with one multi-input request per batch, None for failed batches"""
+        embeddings = []
+        for batch_start in range(0, len(selected_questions), self.settings.batch_size):
+            batch = selected_questions[batch_start:batch_start + self.settings.batch_size]
+            try:
+                embeddings.extend(self.embedding_generator.embed_many([q['question'] for q in batch]))
+            except Exception as e:
+                logfire.error("Error embedding questions batch {batch_start}: {e}", batch_start=batch_start, e=e)
+                embeddings.extend([None] * len(batch))
+        self.embedding_generator.log_cache_stats()
+        return embeddings
+
+    def test_question_retrieval(self, question_data, embedding=None):
+        metrics.sample_debug("Test question for chunk {chunk_id}", chunk_id=question_data['chunk_id'])
         
         try:
-            embedding = self.embedding_generator.create_embedding_ollama(question_data['question'])
-            similar_chunks = self.vector_generator.find_similar_chunks(embedding)
+            if embedding is None:
+                embedding = self.embedding_generator.create_embedding_ollama(question_data['question'])
+            similar_chunks = self.vector_generator.find_similar_chunks(embedding, self.first_stage_depth())
+            if self.reranker is not None:
+                similar_chunks = self.rerank([question_data], [similar_chunks])[0]
             return similar_chunks
             
         except Exception as e:
@@ -58,14 +110,65 @@ class Retrievers:
         all_questions = self.extract_all_questions(questions_data)
         selected_questions = self.select_random_questions(all_questions, num_questions)
         
-        results = []
-        for question_data in selected_questions:
-            similar_chunks = self.test_question_retrieval(question_data)
-            results.append({
-                'question_data': question_data,
-                'similar_chunks': similar_chunks
-            })
-        
+        similar_chunks = self.retrieve(selected_questions, self.first_stage_depth())
+        if self.reranker is None:
+            return [
+                {'question_data': question_data, 'similar_chunks': chunks}
+                for question_data, chunks in zip(selected_questions, similar_chunks)
+            ]
+
+        reranked = self.rerank(selected_questions, similar_chunks)
+        return [
+            {'question_data': question_data, 'similar_chunks': chunks, 'first_stage_chunks': candidates[:self.settings.top_k_results]}
+            for question_data, chunks, candidates in zip(selected_questions, reranked, similar_chunks)
+        ]
+
+    def first_stage_depth(self):
+        """Candidates fetched per question: the final top-k, or the rerank pool"""
+        top_k = self.settings.top_k_results
+        return top_k if self.reranker is None else max(top_k, self.settings.rerank_candidates)
+
+    def rerank(self, selected_questions, candidates):
+        chunk_texts = {chunk['id']: chunk['text'] for chunk in self.get_chunks()}
+        with logfire.span('Rerank {len} questions', len=len(selected_questions)), metrics.timer("retrieval.rerank"):
+            return self.reranker.rerank_batch([q['question'] for q in selected_questions],
+                                              candidates, chunk_texts, self.settings.top_k_results)
+
+    def retrieve(self, selected_questions, top_k=None):
+        """Top-k chunks for every question with the configured retrieval mode, in input order"""
+        top_k = top_k or self.settings.top_k_results
+        metrics.count("retrieval.queries", len(selected_questions))
+        with metrics.timer(f"retrieval.{self.mode}"):
+            return self.retrieve_mode(selected_questions, top_k)
+
+    def retrieve_mode(self, selected_questions, top_k):
+        if self.mode == "bm25":
+            return self.get_lexical_index().search_batch([q['question'] for q in selected_questions], top_k)
+
+        embeddings = self.embed_questions(selected_questions)
+        if self.mode == "dense":
+            return self.retrieve_batch(embeddings, top_k)
+
+        # hybrid: fuse deeper candidate lists from both retrievers, then cut to top_k
+        candidates = max(top_k, self.settings.retrieval_fusion_candidates)
+        dense = self.retrieve_batch(embeddings, candidates)
+        lexical = self.get_lexical_index().search_batch([q['question'] for q in selected_questions], candidates)
+        return [
+            reciprocal_rank_fusion([dense_matches, lexical_matches], top_k, self.settings.retrieval_rrf_k)
+            for dense_matches, lexical_matches in zip(dense, lexical)
+        ]
+
+    def retrieve_batch(self, embeddings, top_k=None):
+        """Query the store once for every embedded question, [] for questions that failed to embed"""
+        top_k = top_k or self.settings.top_k_results
+        embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        results = [[] for _ in embeddings]
+        if embedded:
+            with metrics.timer("vector_store.query"):
+                matches = self.vector_generator.find_similar_chunks_batch([embeddings[i] for i in embedded], top_k)
+            for i, chunks in zip(embedded, matches):
+                results[i] = chunks
+        logfire.info("Retrieved top {top_k} chunks for {len} questions", top_k=top_k, len=len(embedded))
         return results
     
     def run_tests_for_chunk_size(self, questions_file, output_path, num_questions=10):
@@ -75,6 +178,5 @@ class Retrievers:
     
     def save_questions(self, questions_data, output_path):
         logfire.info("Saving questions to {output_path}", output_path=output_path)
-        with open(output_path, "w") as f:
-            json.dump(questions_data, f, indent=2)
+        write_records(output_path, questions_data)
         logfire.info("Saved {len} questions to {output_path}", len=len(questions_data), output_path=output_path)
\ No newline at end of file
@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import re
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import logfire
+from .config import available_datasets, load_settings
+from .artifacts import artifact_path, read_records
+from .embeddings import Embeddings
+from .metrics import configure_logging, metrics
+from .vectors import Vectors
+
+MAX_BODY_BYTES = 1 << 20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def normalize_query(text):
+    """Cache key form of a query: NFKC, case-folded, whitespace collapsed"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+
+class ResultCache:
+    """LRU cache of search results keyed on (normalized query, top_k)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        matches = self.entries.get(key)
+        if matches is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return matches
+
+    def put(self, key, matches):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = matches
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+class QueryService:
+    """Top-k retrieval over the built index of one chunk config, for live queries.
+
+    Concurrent queries are micro-batched: the first waiting query opens a batch, which
+    takes every query that arrives within max_wait_ms, up to max_batch, and is answered
+    with one embedding call and one matrix search in a worker thread. While a batch runs
+    the next one fills up, so batches grow with the load instead of the queue. Results go
+    through an LRU cache, identical queries waiting at the same time share one search,
+    and past max_pending waiting queries new ones are refused rather than queued.
+    """
+
+    def __init__(self, settings, size, overlap, embeddings=None, store=None):
+        self.settings = settings
+        self.embeddings = embeddings or Embeddings(settings)
+        self.vectors = Vectors(settings, size, overlap, store=store)
+        chunks_file = artifact_path(settings.output_dir, f"chunks-{size}-{overlap}", settings.artifact_compression)
+        self.chunk_texts = {chunk["id"]: chunk["text"] for chunk in read_records(chunks_file)}
+        self.cache = ResultCache(settings.serve_cache_entries)
+        self.max_batch = settings.serve_max_batch
+        self.max_wait = settings.serve_max_wait_ms / 1000
+        self.max_pending = settings.serve_max_pending
+        # one worker: batches run one at a time, in order, over the same session and index
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.queue = None
+        self.in_flight = {}
+        self.batcher = None
+
+    def warm_up(self):
+        """Load the index and page it into memory with one full search before serving"""
+        started = time.perf_counter()
+        embedding = self.embeddings.embed_many(["warm up"])[0]
+        self.vectors.find_similar_chunks_batch([embedding], self.settings.top_k_results)
+        logfire.info("Index warm with {chunks} chunks in {seconds:.2f}s",
+                     chunks=len(self.chunk_texts), seconds=time.perf_counter() - started)
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.run_batches())
+
+    async def search(self, query, top_k):
+        """[{"id", "score", "text"}] for one query and whether it came from the cache"""
+        key = (normalize_query(query), top_k)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.count("serve.cache_hits")
+            return cached, True
+        future = self.in_flight.get(key)
+        if future is None:
+            if self.queue.qsize() >= self.max_pending:
+                metrics.count("serve.rejected")
+                raise OverflowError("Too many queries waiting")
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            self.queue.put_nowait((key, query, top_k, future))
+        else:
+            metrics.count("serve.coalesced")
+        return await asyncio.shield(future), False
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if self.queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self.queue.get_nowait())
+
+            queries = [query for _, query, _, _ in batch]
+            top_k = max(k for _, _, k, _ in batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.search_batch, queries, top_k)
+            except Exception as e:
+                logfire.error("Search batch of {len} queries failed: {e}", len=len(batch), e=e)
+                results = [e] * len(batch)
+            for (key, _, k, future), result in zip(batch, results):
+                self.in_flight.pop(key, None)
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    matches = result[:k]
+                    # an empty result is more likely a store hiccup than an answer worth keeping
+                    if matches:
+                        self.cache.put(key, matches)
+                    future.set_result(matches)
+
+    def search_batch(self, queries, top_k):
+        """One embedding request and one index search for a whole batch, in the worker thread"""
+        with metrics.timer("serve.batch"):
+            embeddings = self.embeddings.embed_many(queries)
+            # the store itself, not Vectors.find_similar_chunks_batch, which turns errors into
+            # empty results: a failed search must fail the request, not answer it
+            matches = self.vectors.store.query_batch(embeddings, top_k)
+        metrics.count("serve.batches")
+        metrics.count("serve.batched_queries", len(queries))
+        return [
+            [{"id": match["id"], "score": match["score"], "text": self.chunk_texts.get(match["id"])}
+             for match in query_matches]
+            for query_matches in matches
+        ]
+
+    def stats(self):
+        return {"chunks": len(self.chunk_texts), "waiting": self.queue.qsize() if self.queue else 0,
+                "cache": self.cache.stats(), **metrics.snapshot()}
+
+
+class HTTPServer:
+    """Minimal asyncio HTTP/1.1 server with keep-alive for the query service:
+
+    GET  /search?q=...&k=5         top-k chunks for q
+    POST /search {"query", "top_k"}
+    GET  /health, GET /stats
+    """
+
+    def __init__(self, service, host, port):
+        self.service = service
+        self.host = host
+        self.port = port
+
+    async def serve(self, ready=None):
+        self.service.start()
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        logfire.info("Serving top-k retrieval on http://{host}:{port}", host=self.host, port=self.port)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "Request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                started = time.perf_counter()
+                status, payload = await self.route(method, target, body)
+                metrics.observe("serve.request", time.perf_counter() - started)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path == "/stats":
+            return 200, self.service.stats()
+        if url.path != "/search":
+            return 404, {"error": f"Unknown path {url.path}"}
+
+        if method == "GET":
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            query, top_k = params.get("q"), params.get("k")
+        elif method == "POST":
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                # JSONDecodeError, or UnicodeDecodeError for a body that is not UTF-8
+                return 400, {"error": "Body is not JSON"}
+            if not isinstance(request, dict):
+                return 400, {"error": "Body must be a JSON object"}
+            query, top_k = request.get("query"), request.get("top_k")
+        else:
+            return 405, {"error": f"Method {method} not allowed"}
+
+        if not query or not isinstance(query, str):
+            return 400, {"error": "Missing query"}
+        try:
+            top_k = int(top_k) if top_k is not None else self.service.settings.top_k_results
+        except (TypeError, ValueError):
+            return 400, {"error": "top_k must be an integer"}
+        if not 1 <= top_k <= 100:
+            return 400, {"error": "top_k must be between 1 and 100"}
+
+        try:
+            matches, cached = await self.service.search(query, top_k)
+        except OverflowError as e:
+            return 503, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+        return 200, {"query": query, "top_k": top_k, "cached": cached, "matches": matches}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pipeline serve', description='Serve top-k retrieval over a built index')
+    parser.add_argument('dataset', nargs='?', default='fy10', choices=available_datasets(),
+                        help='Dataset whose index is served')
+    parser.add_argument('--size', type=int, default=None, help='Chunk size of the config to serve (default: the first of the dataset)')
+    parser.add_argument('--overlap', type=int, default=None, help='Chunk overlap of the config to serve (default: the first of the dataset)')
+    parser.add_argument('--backend', choices=['pinecone', 'local', 'ivf', 'quantized'], default=None,
+                        help='Vector store to search (default: vector_search.backend of the dataset)')
+    parser.add_argument('--host', default=None, help='Address to listen on (default: serve.host)')
+    parser.add_argument('--port', type=int, default=None, help='Port to listen on (default: serve.port)')
+    parser.add_argument('--fake-embeddings', action='store_true',
+                        help="Embed queries with the bench's hashed embedder instead of Ollama, to load test the server alone")
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.dataset)
+    if args.backend:
+        settings = dataclasses.replace(settings, vector_backend=args.backend)
+    size = settings.chunk_sizes[0] if args.size is None else args.size
+    overlap = settings.chunk_overlaps[0] if args.overlap is None else args.overlap
+    configure_logging(settings)
+
+    embeddings = None
+    if args.fake_embeddings:
+        from .bench import FakeEmbeddings
+        embeddings = FakeEmbeddings(settings)
+    service = QueryService(settings, size, overlap, embeddings=embeddings)
+    service.warm_up()
+    server = HTTPServer(service, args.host or settings.serve_host, args.port or settings.serve_port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
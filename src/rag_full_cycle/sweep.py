@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import logfire
+
+
+class ResourceLimits:
+    """Global caps on how many configs use each external service (embeddings, llm,
+    vector_store) at the same time; services without a limit are not gated"""
+
+    def __init__(self, limits=None):
+        self.semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in (limits or {}).items()}
+
+    @contextmanager
+    def use(self, *resources):
+        # acquire in a fixed order so two steps holding one service each never deadlock
+        acquired = []
+        try:
+            for name in sorted(set(resources)):
+                semaphore = self.semaphores.get(name)
+                if semaphore is not None:
+                    semaphore.acquire()
+                    acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+
+class Sweep:
+    """Runs the pipeline for every (size, overlap) config concurrently.
+
+    Configs spend most of their time waiting on Ollama and the vector store, so they run
+    in threads: up to max_parallel configs at once, with each step holding the services
+    it calls through the shared ResourceLimits. The extract and tokenization are computed
+    once by the caller and shared read-only by all configs.
+    """
+
+    def __init__(self, settings, sizes=None, overlaps=None, max_parallel=None):
+        self.settings = settings
+        sizes = sizes or settings.chunk_sizes
+        overlaps = overlaps or settings.chunk_overlaps
+        self.configs = [(size, overlap) for size in sizes for overlap in overlaps]
+        self.max_parallel = max_parallel or settings.sweep_max_parallel
+        self.resources = ResourceLimits(dict(settings.sweep_limits))
+        self.leaderboard_path = f"{settings.output_dir}/leaderboard.json"
+
+    def run(self, run_config, extract, steps=None, tokenized=None):
+        """Call run_config(settings, extract, size, overlap, steps, tokenized, resources) for
+        every config and return the leaderboard; a failing config is reported, not fatal"""
+        outcomes = {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, self.max_parallel)) as executor:
+            futures = {
+                executor.submit(self.timed, run_config, extract, size, overlap, steps, tokenized): (size, overlap)
+                for size, overlap in self.configs
+            }
+            for future in as_completed(futures):
+                size, overlap = futures[future]
+                try:
+                    evals_data, seconds = future.result()
+                    outcomes[(size, overlap)] = {"status": "ok", "seconds": seconds, "evals": evals_data}
+                    logfire.info("Config {size}-{overlap} finished in {seconds:.1f}s", size=size, overlap=overlap, seconds=seconds)
+                except Exception as e:
+                    logfire.error("Config {size}-{overlap} failed: {e}", size=size, overlap=overlap, e=e)
+                    outcomes[(size, overlap)] = {"status": "failed", "error": str(e)}
+
+        logfire.info("Sweep of {len} configs finished in {seconds:.1f}s",
+                     len=len(self.configs), seconds=time.monotonic() - started)
+        return self.write_leaderboard(outcomes)
+
+    def timed(self, run_config, extract, size, overlap, steps, tokenized):
+        started = time.monotonic()
+        evals_data = run_config(self.settings, extract, size, overlap, steps, tokenized, self.resources)
+        return evals_data, time.monotonic() - started
+
+    def write_leaderboard(self, outcomes):
+        """Rank the evaluated configs by recall, then MRR, and save them to leaderboard.json"""
+        rows = []
+        for (size, overlap), outcome in outcomes.items():
+            row = {"size": size, "overlap": overlap, "status": outcome["status"]}
+            evals_data = outcome.get("evals")
+            if evals_data:
+                # evals written before MRR/nDCG only have recall and precision
+                row.update({key: evals_data[key] for key in ("k", "questions", "recall", "precision", "mrr", "ndcg")
+                            if key in evals_data})
+                row["recall_ci"] = evals_data.get("confidence_intervals", {}).get("recall")
+            if "seconds" in outcome:
+                row["seconds"] = round(outcome["seconds"], 1)
+            if "error" in outcome:
+                row["error"] = outcome["error"]
+            rows.append(row)
+
+        if not any("recall" in row for row in rows):
+            return rows
+        rows.sort(key=lambda row: (-row.get("recall", -1), -row.get("mrr", -1), row["size"], row["overlap"]))
+        leaderboard = {"retrieval_mode": self.settings.retrieval_mode, "rerank": self.settings.rerank_enabled, "configs": rows}
+        with open(self.leaderboard_path, "w") as f:
+            json.dump(leaderboard, f, indent=2)
+        for rank, row in enumerate(rows, start=1):
+            if "recall" in row:
+                logfire.info("#{rank} {size}-{overlap}: Recall {recall:.2%}, MRR {mrr}, nDCG {ndcg}",
+                             rank=rank, **{"mrr": None, "ndcg": None, **row})
+        logfire.info("Saved leaderboard to {path}", path=self.leaderboard_path)
+        return rows
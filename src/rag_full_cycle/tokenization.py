@@ -0,0 +1,85 @@
+import os
+import re
+from functools import lru_cache
+import numpy as np
+import logfire
+
+
+class HuggingFaceTokenizer:
+    """Exact model tokens from a tokenizer.json, e.g. the all-MiniLM-L6-v2 WordPiece vocabulary"""
+
+    def __init__(self, name_or_path):
+        # optional dependency, only needed for the model-token chunking strategies
+        from tokenizers import Tokenizer
+        if not os.path.exists(name_or_path):
+            # a model name is only looked up in the local Hugging Face cache, chunking never downloads
+            from huggingface_hub import hf_hub_download
+            name_or_path = hf_hub_download(name_or_path, "tokenizer.json", local_files_only=True)
+        self.tokenizer = Tokenizer.from_file(name_or_path)
+
+    def spans(self, text):
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        return np.array(encoding.offsets, dtype=np.int32).reshape(-1, 2)
+
+
+class ApproximateTokenizer:
+    """WordPiece-like estimate used when the tokenizers package or vocabulary is unavailable:
+    punctuation is one token and words are split into pieces of at most max_piece characters"""
+
+    pattern = re.compile(r"\w+|[^\w\s]")
+
+    def __init__(self, max_piece=6):
+        self.max_piece = max_piece
+
+    def spans(self, text):
+        spans = []
+        for match in self.pattern.finditer(text):
+            start, end = match.span()
+            for piece_start in range(start, end, self.max_piece):
+                spans.append((piece_start, min(piece_start + self.max_piece, end)))
+        return np.array(spans, dtype=np.int32).reshape(-1, 2)
+
+
+class WordTokenizer:
+    """NLTK words counted like word_tokenize: punkt sentences, then Treebank words per sentence.
+
+    punkt is read from installed NLTK data (python -m nltk.downloader punkt_tab) and never
+    downloaded. Without it whole pages go through the Treebank tokenizer, which leaves
+    sentence-final periods attached to their word, so pages count a few words less and
+    chunk ids can differ from word_tokenize chunking.
+    """
+
+    def __init__(self, language="english"):
+        from nltk.tokenize import NLTKWordTokenizer
+        from nltk.tokenize.punkt import PunktTokenizer
+
+        self.words = NLTKWordTokenizer()
+        try:
+            self.sentences = PunktTokenizer(language)
+        except LookupError:
+            logfire.warn("NLTK punkt_tab data is not installed, counting words per page instead of per sentence; "
+                         "chunk ids can differ from word_tokenize chunking")
+            self.sentences = None
+
+    def spans(self, text):
+        sentences = self.sentences.span_tokenize(text) if self.sentences else [(0, len(text))]
+        spans = [(start + word_start, start + word_end)
+                 for start, end in sentences
+                 for word_start, word_end in self.words.span_tokenize(text[start:end])]
+        return np.array(spans, dtype=np.int32).reshape(-1, 2)
+
+
+@lru_cache(maxsize=None)
+def load_word_tokenizer(language="english"):
+    return WordTokenizer(language)
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(name_or_path):
+    """Model tokenizer for counting chunk sizes in embedding-model tokens, loaded once per process"""
+    try:
+        return HuggingFaceTokenizer(name_or_path)
+    except Exception as e:
+        logfire.warn("Tokenizer {name} unavailable ({e}), using approximate token counts",
+                     name=name_or_path, e=e)
+        return ApproximateTokenizer()
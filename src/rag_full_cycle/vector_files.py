@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import numpy as np
+import logfire
+
+
+def ids_path_for(vectors_path):
+    return os.path.splitext(vectors_path)[0] + '.ids.npy'
+
+
+def save_vector_file(vectors_path, ids, matrix, dtype="float32"):
+    """Write vectors as a raw .npy matrix plus a fixed-width .ids.npy id table"""
+    matrix = np.asarray(matrix, dtype=dtype)
+    np.save(vectors_path, matrix)
+    np.save(ids_path_for(vectors_path), np.array(ids))
+    logfire.info("Saved {len} x {dimension} {dtype} vectors to {vectors_path}",
+                 len=matrix.shape[0], dimension=matrix.shape[1], dtype=dtype, vectors_path=vectors_path)
+
+
+def open_vector_file(vectors_path):
+    """Memory-map a vector file, returns (ids, matrix) without parsing or copying the matrix"""
+    matrix = np.load(vectors_path, mmap_mode='r')
+    ids = np.load(ids_path_for(vectors_path), mmap_mode='r').tolist()
+    return ids, matrix
+
+
+def convert_json_vectors(json_path, dtype="float32"):
+    """Convert a legacy vectors-*.json file into the binary format next to it"""
+    with open(json_path, 'r') as f:
+        vectors = json.load(f)
+    vectors_path = json_path[:-len('.json')] + '.npy'
+    save_vector_file(
+        vectors_path,
+        [vector["id"] for vector in vectors],
+        [vector["values"] for vector in vectors],
+        dtype
+    )
+    return vectors_path
+
+
+def ensure_vector_file(vectors_path, dtype="float32"):
+    """True if the binary vector file exists, converting a legacy JSON file first when there is one"""
+    if os.path.exists(vectors_path):
+        return True
+    json_path = vectors_path[:-len('.npy')] + '.json'
+    if os.path.exists(json_path):
+        logfire.info("Converting legacy vectors file {json_path}", json_path=json_path)
+        convert_json_vectors(json_path, dtype)
+        return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert vectors-*.json outputs to the binary vector format')
+    parser.add_argument('paths', nargs='+', help='vectors-*.json files to convert')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16'])
+    args = parser.parse_args()
+
+    for json_path in args.paths:
+        vectors_path = convert_json_vectors(json_path, args.dtype)
+        json_size = os.path.getsize(json_path)
+        binary_size = os.path.getsize(vectors_path) + os.path.getsize(ids_path_for(vectors_path))
+        print(f"{json_path} -> {vectors_path} ({json_size} -> {binary_size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
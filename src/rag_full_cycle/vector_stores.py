@@ -0,0 +1,370 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import logfire
+from .ann import IVFIndex, inverse_row_norms, normalize, select_top_k
+from .quantization import QuantizedIndex, create_quantizer
+from .vector_files import save_vector_file, open_vector_file, ensure_vector_file
+from .metrics import metrics
+
+# ids per delete request of the Pinecone API
+PINECONE_MAX_DELETE_IDS = 1000
+
+
+class VectorStore:
+    """Interface shared by the vector store backends selected with vector_search.backend"""
+
+    def upsert(self, vectors, dimension):
+        """Store a list of {"id", "values"} vectors, with optional "metadata" """
+        raise NotImplementedError
+
+    def upsert_batches(self, batches):
+        """Store vectors arriving as an iterable of lists while they are still being produced,
+        returns how many were stored. Stores that write one file collect them all first."""
+        vectors = [vector for batch in batches for vector in batch]
+        if vectors:
+            self.upsert(vectors, len(vectors[0]["values"]))
+        return len(vectors)
+
+    def query(self, query_embedding, top_k):
+        """Return the top_k [{"id", "score"}] matches for one embedding"""
+        return self.query_batch([query_embedding], top_k)[0]
+
+    def query_batch(self, query_embeddings, top_k):
+        """Return one list of matches per query embedding"""
+        return [self.query(query_embedding, top_k) for query_embedding in query_embeddings]
+
+
+def upsert_request_bytes(vector):
+    """Upper bound of the JSON size of one vector in an upsert request"""
+    size = len(vector["id"]) + 24 * len(vector["values"]) + 64
+    if vector.get("metadata"):
+        size += len(json.dumps(vector["metadata"]))
+    return size
+
+
+def split_upsert_requests(vectors, max_vectors, max_bytes):
+    """Split vectors into consecutive requests of at most max_vectors and max_bytes each"""
+    request = []
+    request_bytes = 0
+    for vector in vectors:
+        size = upsert_request_bytes(vector)
+        if request and (len(request) >= max_vectors or request_bytes + size > max_bytes):
+            yield request
+            request = []
+            request_bytes = 0
+        request.append(vector)
+        request_bytes += size
+    if request:
+        yield request
+
+
+class PineconeStore(VectorStore):
+    """Serverless Pinecone index, reused when it exists.
+
+    Upserts are split into requests under the API size limits and sent concurrently
+    through the client's connection pool. vector_search.pinecone_host points the client
+    at another control plane, such as Pinecone Local or python -m rag_full_cycle.fake_pinecone.
+    """
+
+    def __init__(self, settings, index_name):
+        from pinecone import Pinecone
+
+        self.settings = settings
+        self.pc = Pinecone(api_key=settings.pinecone_api_key, host=settings.pinecone_host)
+        self.index_name = index_name
+        self.handle = None
+
+    def create_and_manage_index(self, dimension):
+        """Create the Pinecone index unless it exists, wait until it is ready and return it"""
+        from pinecone import ServerlessSpec
+        from pinecone.exceptions import PineconeApiException
+
+        if self.pc.has_index(self.index_name):
+            logfire.info("Reusing index {pinecone_index_name}", pinecone_index_name=self.index_name)
+        else:
+            logfire.info("Index {pinecone_index_name} creating one...", pinecone_index_name=self.index_name)
+            try:
+                self.pc.create_index(
+                    name=self.index_name,
+                    dimension=dimension,
+                    metric="cosine",
+                    spec=ServerlessSpec(
+                        cloud="aws",
+                        region="us-east-1"
+                    ),
+                    timeout=-1
+                )
+            except PineconeApiException as e:
+                # another config or run created it since has_index
+                if e.status != 409:
+                    raise
+
+        description = self.wait_until_ready()
+        if description.dimension != dimension:
+            raise ValueError(f"Index {self.index_name} has dimension {description.dimension}, vectors have {dimension}")
+        self.handle = self.open_index(description.host)
+        return self.handle
+
+    def wait_until_ready(self):
+        """Poll the index description with backoff until it reports ready"""
+        deadline = time.monotonic() + self.settings.pinecone_index_ready_timeout
+        delay = 0.5
+        while True:
+            description = self.pc.describe_index(self.index_name)
+            if description.status["ready"]:
+                return description
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Index {self.index_name} not ready after {self.settings.pinecone_index_ready_timeout}s")
+            logfire.info("Waiting for index {pinecone_index_name} ({state})",
+                         pinecone_index_name=self.index_name, state=description.status["state"])
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    def open_index(self, host):
+        """Data plane client with one pooled connection per concurrent request"""
+        # index hosts come without a scheme, a local control plane serves them over http too
+        if "://" not in host and (self.settings.pinecone_host or "").startswith("http://"):
+            host = f"http://{host}"
+        concurrency = max(self.settings.pinecone_upsert_concurrency, self.settings.pinecone_query_concurrency)
+        return self.pc.Index(host=host, pool_threads=concurrency, connection_pool_maxsize=concurrency)
+
+    def index(self):
+        if self.handle is None:
+            self.handle = self.open_index(self.pc.describe_index(self.index_name).host)
+        return self.handle
+
+    def upsert(self, vectors, dimension):
+        self.upsert_batches([vectors])
+
+    def upsert_batches(self, batches):
+        """Upsert the full vector set of a build, then delete the ids left in the reused
+        index by earlier builds, such as chunks dropped by a rechunk or merged by dedup"""
+        index = None
+        concurrency = self.settings.pinecone_upsert_concurrency
+        in_flight = deque()
+        upserted = 0
+        ids = set()
+        for vectors in batches:
+            if not vectors:
+                continue
+            if index is None:
+                index = self.create_and_manage_index(len(vectors[0]["values"]))
+            ids.update(vector["id"] for vector in vectors)
+            for request in split_upsert_requests(vectors, self.settings.pinecone_upsert_batch_size,
+                                                 self.settings.pinecone_upsert_max_bytes):
+                if len(in_flight) >= concurrency:
+                    upserted += in_flight.popleft().get().upserted_count
+                in_flight.append(index.upsert(vectors=request, namespace=self.settings.pinecone_namespace,
+                                              async_req=True, show_progress=False))
+                metrics.count("vector_store.upsert_requests")
+        while in_flight:
+            upserted += in_flight.popleft().get().upserted_count
+        if index is not None:
+            self.delete_stale(index, ids)
+        return upserted
+
+    def delete_stale(self, index, ids):
+        namespace = self.settings.pinecone_namespace
+        stale = [stored for page in index.list(namespace=namespace) for stored in page if stored not in ids]
+        for start in range(0, len(stale), PINECONE_MAX_DELETE_IDS):
+            index.delete(ids=stale[start:start + PINECONE_MAX_DELETE_IDS], namespace=namespace)
+        if stale:
+            metrics.count("vector_store.deleted", len(stale))
+            logfire.info("Deleted {count} stale vectors from {pinecone_index_name}",
+                         count=len(stale), pinecone_index_name=self.index_name)
+
+    def query_index(self, index, query_embedding, top_k):
+        results = index.query(
+            namespace=self.settings.pinecone_namespace,
+            vector=query_embedding,
+            top_k=top_k,
+            include_metadata=True
+        )
+        return [{'id': match.id, 'score': match.score} for match in results.matches]
+
+    def query(self, query_embedding, top_k):
+        return self.query_index(self.index(), query_embedding, top_k)
+
+    def query_batch(self, query_embeddings, top_k):
+        """Pinecone has no multi-vector query, so issue the queries concurrently over one index handle"""
+        index = self.index()
+        with ThreadPoolExecutor(max_workers=self.settings.pinecone_query_concurrency) as executor:
+            return list(executor.map(lambda embedding: self.query_index(index, embedding, top_k), query_embeddings))
+
+
+class LocalStore(VectorStore):
+    """In-process cosine search over the memory-mapped vector file written by Vectors.save_vectors"""
+
+    def __init__(self, settings, vectors_path):
+        self.settings = settings
+        self.vectors_path = vectors_path
+        self.matrix = None
+        self.inverse_norms = None
+        self.ids = None
+
+    def upsert(self, vectors, dimension):
+        save_vector_file(
+            self.vectors_path,
+            [vector["id"] for vector in vectors],
+            [vector["values"] for vector in vectors],
+            self.settings.vector_storage_dtype
+        )
+        self.reload()
+
+    def upsert_batches(self, batches):
+        """Vectors.process_chunks_to_vectors saves the vector file while the batches stream in.
+        When that file holds the streamed ids it is read as it is instead of written twice"""
+        started = time.time()
+        vectors = [vector for batch in batches for vector in batch]
+        if not vectors:
+            return 0
+        if self.saved_since(started, [vector["id"] for vector in vectors]):
+            self.reload()
+        else:
+            self.upsert(vectors, len(vectors[0]["values"]))
+        return len(vectors)
+
+    def saved_since(self, started, ids):
+        if not os.path.exists(self.vectors_path) or os.path.getmtime(self.vectors_path) < started:
+            return False
+        return open_vector_file(self.vectors_path)[0] == ids
+
+    def reload(self):
+        """Forget the loaded matrix, the next query maps the new vector file"""
+        self.matrix = None
+
+    def load(self):
+        if self.matrix is not None:
+            return
+        if not ensure_vector_file(self.vectors_path, self.settings.vector_storage_dtype):
+            raise FileNotFoundError(self.vectors_path)
+        self.ids, self.matrix = open_vector_file(self.vectors_path)
+        # scale scores by 1/|v| instead of normalizing, so the mapped matrix is never copied
+        self.inverse_norms = inverse_row_norms(self.matrix)
+
+    def query_batch(self, query_embeddings, top_k):
+        self.load()
+        queries = normalize(query_embeddings)
+        scores = (queries @ self.matrix.T) * self.inverse_norms
+        top, top_scores = select_top_k(scores, top_k)
+        return [
+            [{'id': self.ids[i], 'score': float(score)} for i, score in zip(row, row_scores)]
+            for row, row_scores in zip(top, top_scores)
+        ]
+
+
+class IVFStore(VectorStore):
+    """Approximate search through an IVF index persisted as .ivf.npz, updated incrementally on upsert"""
+
+    def __init__(self, settings, index_path):
+        self.settings = settings
+        self.index_path = index_path
+        self.index = None
+
+    def load(self, from_vector_file=True):
+        if self.index is not None:
+            return
+        if os.path.exists(self.index_path):
+            self.index = IVFIndex.load(self.index_path)
+            self.index.nprobe = self.settings.ivf_nprobe
+        else:
+            self.index = IVFIndex(self.settings.ivf_nlist, self.settings.ivf_nprobe, self.settings.ivf_kmeans_iterations)
+            vectors_path = self.index_path[:-len('.ivf.npz')] + '.npy'
+            if from_vector_file and ensure_vector_file(vectors_path, self.settings.vector_storage_dtype):
+                ids, matrix = open_vector_file(vectors_path)
+                self.index.add(ids, matrix)
+                self.index.save(self.index_path)
+
+    def upsert(self, vectors, dimension):
+        """Make the index hold exactly these vectors: new ones are inserted, changed ones
+        replaced and ids missing from vectors (rechunked away or deduplicated) removed"""
+        self.load(from_vector_file=False)
+        ids = [vector["id"] for vector in vectors]
+        stale = set(self.index.ids) - set(ids)
+        if stale:
+            self.index.remove(stale)
+            logfire.info("Removed {len} stale vectors from the IVF index", len=len(stale))
+        self.index.add(ids, [vector["values"] for vector in vectors])
+        self.index.save(self.index_path)
+        self.report_recall()
+
+    def report_recall(self, top_k=None):
+        """Log recall@k of the IVF search against exact search, using stored vectors as sample queries"""
+        top_k = top_k or self.settings.top_k_results
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(self.index), min(self.settings.ivf_recall_sample, len(self.index)), replace=False)
+        recall = self.index.measure_recall(self.index.matrix[sample], top_k)
+        logfire.info("IVF recall@{top_k} vs exact search: {recall:.2%} (nlist={nlist}, nprobe={nprobe}, {len} vectors)",
+                     top_k=top_k, recall=recall, nlist=len(self.index.centroids), nprobe=self.index.nprobe, len=len(self.index))
+        return recall
+
+    def query_batch(self, query_embeddings, top_k):
+        self.load()
+        rows, scores = self.index.search(query_embeddings, top_k)
+        return [
+            [{'id': self.index.ids[i], 'score': float(score)} for i, score in zip(row, row_scores) if i >= 0]
+            for row, row_scores in zip(rows, scores)
+        ]
+
+
+class QuantizedStore(LocalStore):
+    """int8 or product-quantized codes kept in memory, rescored against the memory-mapped vector file"""
+
+    def __init__(self, settings, vectors_path):
+        super().__init__(settings, vectors_path)
+        self.codes_path = f"{os.path.splitext(vectors_path)[0]}.{self.settings.quantization_method}.npz"
+        self.index = None
+
+    def reload(self):
+        """Rebuild the codes from the new vector file right away, so a build reports their recall"""
+        super().reload()
+        self.index = None
+        self.load()
+
+    def load(self):
+        super().load()
+        if self.index is not None:
+            return
+        if os.path.exists(self.codes_path) and os.path.getmtime(self.codes_path) >= os.path.getmtime(self.vectors_path):
+            self.index = QuantizedIndex.load(self.codes_path)
+            return
+        settings = self.settings
+        self.index = QuantizedIndex(create_quantizer(settings.quantization_method, settings.pq_subspaces),
+                                    settings.quantization_rescore_factor)
+        self.index.build(self.matrix)
+        rng = np.random.default_rng(0)
+        sample = self.matrix[np.sort(rng.choice(len(self.ids), min(settings.quantization_recall_sample, len(self.ids)), replace=False))]
+        recall = self.index.tune_rescore_factor(sample, settings.top_k_results, self.matrix, self.inverse_norms,
+                                                settings.quantization_recall_tolerance)
+        self.index.save(self.codes_path)
+        logfire.info("Quantized {len} vectors with {method}: {code_bytes} code bytes vs {float_bytes} float32 bytes, "
+                     "recall@{top_k} {recall:.2%} with rescore factor {rescore_factor}",
+                     len=len(self.ids), method=self.settings.quantization_method, code_bytes=self.index.codes.nbytes,
+                     float_bytes=self.matrix.shape[0] * self.matrix.shape[1] * 4, top_k=self.settings.top_k_results,
+                     recall=recall, rescore_factor=self.index.rescore_factor)
+
+    def query_batch(self, query_embeddings, top_k):
+        self.load()
+        rows, scores = self.index.search(query_embeddings, top_k, self.matrix, self.inverse_norms)
+        return [
+            [{'id': self.ids[i], 'score': float(score)} for i, score in zip(row, row_scores)]
+            for row, row_scores in zip(rows, scores)
+        ]
+
+
+def create_vector_store(settings, size, overlap):
+    """Create the vector store configured in vector_search.backend for a chunk configuration"""
+    backend = settings.vector_backend
+    if backend == "pinecone":
+        return PineconeStore(settings, f"{size}-{overlap}-{settings.file_name}")
+    if backend == "local":
+        return LocalStore(settings, f"{settings.output_dir}/vectors-{size}-{overlap}.npy")
+    if backend == "quantized":
+        return QuantizedStore(settings, f"{settings.output_dir}/vectors-{size}-{overlap}.npy")
+    if backend == "ivf":
+        return IVFStore(settings, f"{settings.output_dir}/vectors-{size}-{overlap}.ivf.npz")
+    raise ValueError(f"Unknown vector backend: {backend}")
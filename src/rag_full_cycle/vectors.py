@@ -1,138 +1,179 @@
-import json
+import queue
+import threading
 import time
-from openai import OpenAI
 import logfire
-from pinecone import Pinecone, ServerlessSpec
-from .config import *
 from .embeddings import Embeddings
+from .vector_stores import create_vector_store
+from .vector_files import save_vector_file
+from .metrics import metrics
+from .profiling import profiled_thread
+
+# put on the upsert queue ahead of the end of stream when embedding failed
+EMBEDDING_FAILED = object()
+
 
 class Vectors:
-    def __init__(self, size, overlap):
-        self.pc = Pinecone(api_key=PINECONE_API_KEY)
+    def __init__(self, settings, size, overlap, store=None):
+        self.settings = settings
         self.size = size
         self.overlap = overlap
-        self.pinecone_index_name = f"{size}-{overlap}-{FILE_NAME}"
+        self.store = store or create_vector_store(settings, size, overlap)
     
-    def generate_embeddings_for_chunks(self, chunks):
-        """Generate embeddings for a list of chunks"""
+    def generate_embeddings_for_chunks(self, chunks, on_batch=None):
+        """Generate embeddings for a list of chunks, on_batch receives each embedded batch
+        of vectors as soon as it is ready. Raises RuntimeError after the last batch when
+        any batch failed, the embedded ones are cached for the rerun"""
         logfire.info("Generating embeddings for {len} chunks...", len=len(chunks))
-        logfire.info("Using batch size: {BATCH_SIZE}, delay: {DELAY_BETWEEN_REQUESTS}s", BATCH_SIZE=BATCH_SIZE, DELAY_BETWEEN_REQUESTS=DELAY_BETWEEN_REQUESTS)
+        batch_size = self.settings.batch_size
+        delay_between_batches = self.settings.delay_between_batches
+        logfire.info("Using batch size: {BATCH_SIZE}, delay between batches: {DELAY_BETWEEN_BATCHES}s", BATCH_SIZE=batch_size, DELAY_BETWEEN_BATCHES=delay_between_batches)
         
-        embedding_generator = Embeddings()
+        embedding_generator = Embeddings(self.settings)
         vectors_to_upsert = []
+        failed_batches = []
         
-        # Process chunks in batches to improve performance
-        for batch_start in range(0, len(chunks), BATCH_SIZE):
-            batch_end = min(batch_start + BATCH_SIZE, len(chunks))
+        # Each batch is embedded with a single multi-input request
+        for batch_start in range(0, len(chunks), batch_size):
+            batch_end = min(batch_start + batch_size, len(chunks))
             batch = chunks[batch_start:batch_end]
             
-            logfire.info("Processing batch {batch_start}: chunks {batch_end}-{BATCH_SIZE}", batch_start=batch_start, batch_end=batch_end, BATCH_SIZE=BATCH_SIZE)
+            metrics.sample_debug("Processing batch {batch_start}: chunks {batch_end}-{BATCH_SIZE}", batch_start=batch_start, batch_end=batch_end, BATCH_SIZE=batch_size)
+            requests_sent = embedding_generator.requests
             
-            for i, chunk in enumerate(batch):
-                try:
-                    chunk_index = batch_start + i
-                    logfire.info("Processing chunk {chunk_index}: {chunk_id}", chunk_index=chunk_index,  chunk_id=chunk['id'])
-                    
-                    # Create embedding
-                    embedding = embedding_generator.create_embedding_ollama(chunk["text"])
-                    vectors_to_upsert.append({
-                        "id": chunk["id"], 
-                        "values": embedding
-                    })
-                    
-                    time.sleep(DELAY_BETWEEN_REQUESTS)
-                    
-                except Exception as e:
-                    logfire.error("Error processing chunk {chunk_id}: {e}", chunk_id=chunk['id'], e=e)
-                    continue
+            try:
+                with metrics.timer("vectorize.batch"):
+                    embeddings = embedding_generator.embed_many([chunk["text"] for chunk in batch])
+                batch_vectors = [
+                    {"id": chunk["id"], "values": embedding, "metadata": self.chunk_metadata(chunk)}
+                    for chunk, embedding in zip(batch, embeddings)
+                ]
+                vectors_to_upsert.extend(batch_vectors)
+            except Exception as e:
+                logfire.error("Error processing batch {batch_start}: {e}", batch_start=batch_start, e=e)
+                failed_batches.append(batch_start)
+            else:
+                if on_batch is not None:
+                    on_batch(batch_vectors)
             
-            if batch_end < len(chunks):
-                logfire.info("Waiting {DELAY_BETWEEN_BATCHES}s before next batch...", DELAY_BETWEEN_BATCHES=DELAY_BETWEEN_BATCHES)
-                time.sleep(DELAY_BETWEEN_BATCHES)
+            # the delay paces the embedding server, a batch answered from the cache did not call it
+            if batch_end < len(chunks) and embedding_generator.requests > requests_sent:
+                metrics.sample_debug("Waiting {DELAY_BETWEEN_BATCHES}s before next batch...", DELAY_BETWEEN_BATCHES=delay_between_batches)
+                time.sleep(delay_between_batches)
         
+        embedding_generator.log_cache_stats()
+        if failed_batches:
+            # an index without these chunks must not be recorded as up to date
+            raise RuntimeError(f"Embedding failed for {len(failed_batches)} batches of {batch_size} chunks, "
+                               f"starting at chunks {failed_batches}")
         return vectors_to_upsert
     
+    def chunk_metadata(self, chunk):
+        """Metadata stored with a chunk's vector: its text, page and document (corpus ids are doc:page-n)"""
+        doc_id, _, local_id = chunk["id"].rpartition(":")
+        page = local_id.rpartition("-")[0]
+        metadata = {"text": chunk["text"], "page": int(page) if page.isdigit() else page,
+                    "size": self.size, "overlap": self.overlap}
+        if doc_id:
+            metadata["doc_id"] = doc_id
+        return metadata
+
     def save_vectors(self, vectors, output_path):
-        """Save vectors to file"""
+        """Save vectors to a binary .npy matrix with an id table next to it"""
         logfire.info("Saving {len} vectors to {output_path}", len=len(vectors), output_path=output_path)
-        with open(output_path, "w") as f:
-            json.dump(vectors, f, indent=2)
-        logfire.info("Saved vectors to {output_path}", output_path=output_path)
-    
-    def create_and_manage_index(self, vectors, dimension):
-        """Create Pinecone index if needed and return index object"""
-        logfire.info("Index {pinecone_index_name} creating one...", pinecone_index_name=self.pinecone_index_name)
-        self.pc.create_index(
-            name=self.pinecone_index_name,
-            dimension=dimension,
-            metric="cosine",
-            spec=ServerlessSpec(
-                cloud="aws",
-                region="us-east-1"
-            )
+        save_vector_file(
+            output_path,
+            [vector["id"] for vector in vectors],
+            [vector["values"] for vector in vectors],
+            self.settings.vector_storage_dtype
         )
-
-        time.sleep(10)
-        # Get the index object
-        index = self.pc.Index(self.pinecone_index_name)
-        return index
+        logfire.info("Saved vectors to {output_path}", output_path=output_path)
     
-    def upsert_vectors_to_pinecone(self, vectors, dimension):
-        """Upsert vectors to Pinecone"""
+    def upsert_vectors(self, vectors, dimension):
+        """Upsert vectors to the configured vector store"""
         try:
-            logfire.info("Upserting {len} vectors to Pinecone, dimension: {dimension}...", len=len(vectors), dimension=dimension)
-            
-            index = self.create_and_manage_index(vectors, dimension)
-            index.upsert(
-                namespace=PINECONE_NAMESPACE,
-                vectors=vectors
-            )
-            logfire.info("Successfully upserted {len} vectors to Pinecone", len=len(vectors))
+            logfire.info("Upserting {len} vectors to {backend}, dimension: {dimension}...", len=len(vectors), backend=self.settings.vector_backend, dimension=dimension)
+            with metrics.timer("vector_store.upsert"):
+                self.store.upsert(vectors, dimension)
+            metrics.count("vector_store.upserted", len(vectors))
+            logfire.info("Successfully upserted {len} vectors to {backend}", len=len(vectors), backend=self.settings.vector_backend)
             return True
             
         except Exception as e:
-            logfire.error("Error upserting to Pinecone: {e}", e=e)
+            logfire.error("Error upserting to {backend}: {e}", backend=self.settings.vector_backend, e=e)
             return False
     
     def process_chunks_to_vectors(self, chunks, vectors_output_path):
-        """Complete pipeline: generate embeddings, save vectors, and upsert to Pinecone"""
-        vectors = self.generate_embeddings_for_chunks(chunks)
-        
-        if vectors:
-            self.save_vectors(vectors, vectors_output_path)
-            dimension = len(vectors[0]["values"])
-            success = self.upsert_vectors_to_pinecone(vectors, dimension)
-            
-            if not success:
-                return False
-        else:
+        """Complete pipeline: generate embeddings, save vectors, and upsert to the vector store.
+
+        Embedding produces batches into a bounded queue that an upsert thread consumes, so
+        the upload overlaps the embedding and ends right after the last batch.
+        """
+        batches = queue.Queue(maxsize=self.settings.upsert_queue_batches)
+        upserted = []
+        upsert_errors = []
+
+        ended = []
+
+        def received():
+            while (batch := batches.get()) is not None:
+                if batch is EMBEDDING_FAILED:
+                    # stop the store before it completes the upload, e.g. deletes the ids of the failed batches
+                    raise RuntimeError("Embedding failed, the upload was not completed")
+                yield batch
+            ended.append(True)
+
+        def consume():
+            try:
+                with metrics.timer("vector_store.upsert"):
+                    upserted.append(self.store.upsert_batches(received()))
+            except Exception as e:
+                upsert_errors.append(e)
+            # keep taking batches after a failure so the producer never blocks on a full queue
+            if not ended:
+                while batches.get() is not None:
+                    pass
+
+        logfire.info("Upserting to {backend} while embedding", backend=self.settings.vector_backend)
+        consumer = threading.Thread(target=profiled_thread(consume), name=f"upsert-{self.size}-{self.overlap}", daemon=True)
+        consumer.start()
+        try:
+            vectors = self.generate_embeddings_for_chunks(chunks, on_batch=batches.put)
+            if vectors:
+                # before the end of stream, so file-backed stores write after the vector file
+                self.save_vectors(vectors, vectors_output_path)
+        except BaseException:
+            batches.put(EMBEDDING_FAILED)
+            raise
+        finally:
+            batches.put(None)
+            consumer.join()
+
+        if not vectors:
             logfire.error("No vectors generated")
             return False
-        
+        if upsert_errors:
+            logfire.error("Error upserting to {backend}: {e}", backend=self.settings.vector_backend, e=upsert_errors[0])
+            return False
+        metrics.count("vector_store.upserted", upserted[0])
+        logfire.info("Upserted {count} vectors to {backend}", count=upserted[0], backend=self.settings.vector_backend)
         logfire.info("All {len} chunks processed successfully!", len=len(chunks))
         
         return True
     
-    def find_similar_chunks(self, query_embedding, top_k=5):
-        """Find similar chunks using Pinecone vector search"""
+    def find_similar_chunks(self, query_embedding, top_k=None):
+        """Find similar chunks using vector search"""
         try:
-            index = self.pc.Index(self.pinecone_index_name)
-            results = index.query(
-                namespace=PINECONE_NAMESPACE,
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
-            similar_chunks = []
-            for match in results.matches:
-                similar_chunks.append({
-                    'id': match.id,
-                    'score': match.score,
-                })
-            
-            return similar_chunks
+            return self.store.query(query_embedding, top_k or self.settings.top_k_results)
             
         except Exception as e:
             logfire.error("Error finding similar chunks: {e}", e=e)
             return []
-    
+
+    def find_similar_chunks_batch(self, query_embeddings, top_k=None):
+        """Find similar chunks for many query embeddings at once"""
+        try:
+            return self.store.query_batch(query_embeddings, top_k or self.settings.top_k_results)
+            
+        except Exception as e:
+            logfire.error("Error finding similar chunks: {e}", e=e)
+            return [[] for _ in query_embeddings]
@@ -0,0 +1,4 @@
+import os
+
+# the steps log through logfire, which tests leave unconfigured
+os.environ.setdefault("LOGFIRE_IGNORE_NO_CONFIG", "1")
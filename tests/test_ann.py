@@ -0,0 +1,38 @@
+import dataclasses
+import numpy as np
+from rag_full_cycle.ann import IVFIndex
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.vector_stores import IVFStore
+
+
+def clustered(n, dimension=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    return (centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dimension))).astype(np.float32)
+
+
+def test_ivf_recall_against_exact_search():
+    matrix = clustered(2000)
+    index = IVFIndex(nlist=32, nprobe=8)
+    index.build([f"{i}-0" for i in range(len(matrix))], matrix)
+    queries = matrix[:100] + 0.05
+    assert index.measure_recall(queries, 10) >= 0.9
+    assert index.measure_recall(queries, 10, nprobe=32) == 1.0
+
+
+def test_ivf_upsert_replaces_the_stored_set(tmp_path):
+    settings = dataclasses.replace(load_settings("fy10"), ivf_nlist=8, ivf_nprobe=8, ivf_recall_sample=10)
+    matrix = clustered(200)
+    vectors = [{"id": f"{i}-0", "values": row.tolist()} for i, row in enumerate(matrix)]
+    IVFStore(settings, f"{tmp_path}/vectors.ivf.npz").upsert(vectors, 32)
+
+    # a rechunk drops the first half and changes one vector
+    kept = vectors[100:]
+    kept[0] = {"id": kept[0]["id"], "values": (-matrix[100]).tolist()}
+    IVFStore(settings, f"{tmp_path}/vectors.ivf.npz").upsert(kept, 32)
+
+    store = IVFStore(settings, f"{tmp_path}/vectors.ivf.npz")
+    store.load()
+    assert sorted(store.index.ids) == sorted(vector["id"] for vector in kept)
+    assert store.query(matrix[5], 5)[0]["id"] not in {vector["id"] for vector in vectors[:100]}
+    assert store.query(-matrix[100], 1)[0]["id"] == "100-0"
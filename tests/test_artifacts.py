@@ -0,0 +1,39 @@
+import json
+import pytest
+from rag_full_cycle.artifacts import ArtifactWriter, artifact_path, iter_records, migrate_legacy_json, read_records, write_records
+
+
+def test_legacy_json_is_converted_next_to_the_original(tmp_path):
+    records = [{"id": "1-0", "text": "first"}, {"id": "2-0", "text": "second"}]
+    legacy = tmp_path / "chunks-512-64.json"
+    legacy.write_text(json.dumps(records, indent=2))
+    path = artifact_path(str(tmp_path), "chunks-512-64")
+
+    # the compatibility reader serves the legacy file before any conversion
+    assert read_records(path) == records
+    assert migrate_legacy_json(path)
+    assert legacy.exists()
+    assert read_records(path) == records
+    assert not migrate_legacy_json(path)
+
+
+def test_records_stream_back_in_order(tmp_path):
+    path = f"{tmp_path}/records.ndjson"
+    assert write_records(path, ({"n": n} for n in range(1000))) == 1000
+    assert [record["n"] for record in iter_records(path)] == list(range(1000))
+
+
+def test_failed_write_keeps_the_previous_artifact(tmp_path):
+    path = f"{tmp_path}/records.ndjson"
+    write_records(path, [{"n": 1}])
+
+    def failing():
+        yield {"n": 2}
+        raise ValueError("producer failed")
+    with pytest.raises(ValueError):
+        write_records(path, failing())
+    assert read_records(path) == [{"n": 1}]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["records.ndjson"]
+    with ArtifactWriter(path) as writer:
+        writer.write({"n": 3})
+    assert read_records(path) == [{"n": 3}]
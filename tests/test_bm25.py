@@ -0,0 +1,57 @@
+from pathlib import Path
+import numpy as np
+from rag_full_cycle.artifacts import read_records
+from rag_full_cycle.bm25 import BM25Index, reciprocal_rank_fusion
+
+OUTPUT = Path(__file__).parent.parent / "src/rag_full_cycle/output/fy10syb"
+
+
+def assert_same_top_k(pruned, exact):
+    """Same scores rank by rank; ids may only differ among documents tied with the k-th score"""
+    assert len(pruned) == len(exact)
+    pruned_scores = np.array([match["score"] for match in pruned])
+    exact_scores = np.array([match["score"] for match in exact])
+    np.testing.assert_allclose(pruned_scores, exact_scores, rtol=1e-5)
+    if exact:
+        above = exact_scores[-1] + 1e-4
+        assert ([m["id"] for m in pruned if m["score"] > above] ==
+                [m["id"] for m in exact if m["score"] > above])
+
+
+def test_pruned_search_matches_exact_search():
+    chunks = read_records(str(OUTPUT / "chunks-512-64.json"))
+    queries = [question for entry in read_records(str(OUTPUT / "questions-512-64.json"))
+               for question in entry["questions"]]
+    # small blocks so the block-max bounds prune inside the posting lists
+    for block_size in (4, 64):
+        index = BM25Index(block_size=block_size).build(chunks)
+        for query in queries[:200]:
+            for top_k in (1, 5, 20):
+                assert_same_top_k(index.search(query, top_k), index.exact_search(query, top_k))
+
+
+def test_pruned_search_on_skewed_random_text():
+    rng = np.random.default_rng(0)
+    vocabulary = [f"w{i}" for i in range(300)]
+    # Zipf-like frequencies give long and short posting lists
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+    chunks = [{"id": f"{i}-0", "text": " ".join(rng.choice(vocabulary, size=rng.integers(5, 80), p=weights))}
+              for i in range(1000)]
+    index = BM25Index(block_size=8).build(chunks)
+    for _ in range(100):
+        query = " ".join(rng.choice(vocabulary, size=rng.integers(1, 8)))
+        assert_same_top_k(index.search(query, 10), index.exact_search(query, 10))
+
+
+def test_exact_terms_and_fusion():
+    index = BM25Index().build([
+        {"id": "1-0", "text": "Filings rose in section 3.2.1 of the report"},
+        {"id": "2-0", "text": "Filings fell by 1,250 cases"},
+        {"id": "3-0", "text": "Nothing relevant here"},
+    ])
+    assert [match["id"] for match in index.search("section 3.2.1", 3)] == ["1-0"]
+    assert [match["id"] for match in index.search("1,250", 3)] == ["2-0"]
+    assert index.search("unknown", 3) == []
+    fused = reciprocal_rank_fusion([[{"id": "a"}, {"id": "b"}], [{"id": "b"}, {"id": "c"}]], 2)
+    assert [match["id"] for match in fused] == ["b", "a"]
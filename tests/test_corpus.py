@@ -0,0 +1,54 @@
+import dataclasses
+import shutil
+from pathlib import Path
+from rag_full_cycle.artifacts import read_records
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.corpus import Corpus
+
+PDF = Path(__file__).parent.parent / "The-Three-Little-Pigs-original.pdf"
+
+
+def corpus_settings(tmp_path):
+    return dataclasses.replace(load_settings("corpus"), corpus_glob=str(tmp_path / "pdfs"),
+                               output_dir=str(tmp_path / "output"), extraction_workers=1)
+
+
+def test_corpus_paths_follow_output_dir(tmp_path):
+    corpus = Corpus(corpus_settings(tmp_path))
+    assert corpus.docs_dir == f"{tmp_path}/output/docs"
+    assert corpus.manifest_path == f"{tmp_path}/output/corpus-manifest.json"
+
+
+def test_ingest_chunks_every_document_once(tmp_path):
+    (tmp_path / "pdfs" / "tales").mkdir(parents=True)
+    shutil.copy(PDF, tmp_path / "pdfs" / "tales" / "Three Pigs.pdf")
+    (tmp_path / "output").mkdir()
+    corpus = Corpus(corpus_settings(tmp_path))
+
+    assert corpus.ingest([512], [64])
+    manifest = corpus.load_manifest()
+    assert list(manifest) == ["tales-three-pigs"]
+    chunks = read_records(f"{tmp_path}/output/chunks-512-64.ndjson")
+    assert chunks and all(chunk["id"].startswith("tales-three-pigs:") for chunk in chunks)
+
+    # an unchanged corpus is not reprocessed
+    assert not corpus.ingest([512], [64])
+
+
+def test_changed_chunking_strategy_rechunks_unchanged_documents(tmp_path):
+    (tmp_path / "pdfs").mkdir()
+    shutil.copy(PDF, tmp_path / "pdfs" / "pigs.pdf")
+    (tmp_path / "output").mkdir()
+    settings = corpus_settings(tmp_path)
+    Corpus(settings).ingest([100], [10])
+    words = read_records(f"{tmp_path}/output/chunks-100-10.ndjson")
+    # outputs of another config whose key starts the same are left alone
+    (tmp_path / "output" / "evals-100-100.json").write_text("{}")
+
+    corpus = Corpus(dataclasses.replace(settings, chunk_strategy="sentences"))
+    assert corpus.ingest([100], [10])
+    sentences = read_records(f"{tmp_path}/output/chunks-100-10.ndjson")
+    assert sentences != words
+    assert corpus.load_manifest()["pigs"]["chunking"] == {"100-10": corpus.chunking}
+    assert not corpus.ingest([100], [10])
+    assert (tmp_path / "output" / "evals-100-100.json").exists()
@@ -0,0 +1,66 @@
+import json
+import os
+from rag_full_cycle.dag import DAG, Step, load_manifest
+
+
+def writer(path, content, calls):
+    def run(changed):
+        calls.append(changed)
+        with open(path, "w") as f:
+            f.write(content())
+    return run
+
+
+def pipeline(tmp_path, calls, setting="a", schema=1):
+    source, derived = f"{tmp_path}/source.txt", f"{tmp_path}/derived.txt"
+    return DAG([
+        Step("derived", derived, writer(derived, lambda: open(source).read().upper(), calls["derived"]),
+             upstream=["source"], schema=schema),
+        Step("source", source, writer(source, lambda: setting, calls["source"]), inputs={"setting": setting}),
+    ])
+
+
+def test_steps_run_in_dependency_order_then_are_skipped(tmp_path):
+    calls = {"source": [], "derived": []}
+    assert pipeline(tmp_path, calls).run() == ["source", "derived"]
+    assert calls == {"source": [["artifact"]], "derived": [["artifact"]]}
+    assert pipeline(tmp_path, calls).run() == []
+    assert load_manifest(f"{tmp_path}/derived.txt")["schema"] == 1
+
+
+def test_changed_input_reruns_downstream(tmp_path):
+    calls = {"source": [], "derived": []}
+    pipeline(tmp_path, calls).run()
+    assert pipeline(tmp_path, calls, setting="b").run() == ["source", "derived"]
+    assert calls["source"][-1] == ["setting"]
+    assert calls["derived"][-1] == ["source"]
+    assert open(f"{tmp_path}/derived.txt").read() == "B"
+
+
+def test_selected_steps_always_rerun(tmp_path):
+    calls = {"source": [], "derived": []}
+    pipeline(tmp_path, calls).run()
+    assert pipeline(tmp_path, calls).run(["derived"]) == ["derived"]
+    assert calls["derived"][-1] == ["selected"]
+    # an out-of-date step that was not selected is left alone
+    assert pipeline(tmp_path, calls, setting="b").run(["derived"]) == ["derived"]
+    assert open(f"{tmp_path}/source.txt").read() == "a"
+
+
+def test_untracked_artifacts_are_adopted_unless_selected_or_older(tmp_path):
+    for name, content in (("source", "a"), ("derived", "old")):
+        with open(f"{tmp_path}/{name}.txt", "w") as f:
+            f.write(content)
+    calls = {"source": [], "derived": []}
+    assert pipeline(tmp_path, calls).run() == []
+    assert open(f"{tmp_path}/derived.txt").read() == "old"
+
+    os.remove(f"{tmp_path}/derived.txt.manifest.json")
+    assert pipeline(tmp_path, calls).run(["derived"]) == ["derived"]
+    assert calls["derived"][-1] == ["manifest"]
+
+    # a newer artifact format rebuilds the artifact written by the old one
+    assert pipeline(tmp_path, calls, schema=2).run() == ["derived"]
+    assert calls["derived"][-1] == ["schema"]
+    with open(f"{tmp_path}/derived.txt.manifest.json") as f:
+        assert json.load(f)["schema"] == 2
@@ -0,0 +1,20 @@
+import dataclasses
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.dedup import Dedup, drop_aliases
+
+HEADER = ("Federal judicial caseload statistics for the twelve month period ending September 30 "
+          "covering appeals, civil and criminal filings, bankruptcy petitions and probation")
+
+
+def test_near_duplicates_alias_the_first_chunk():
+    settings = dataclasses.replace(load_settings("fy10"), dedup_enabled=True)
+    chunks = [
+        {"id": "4-0", "text": HEADER},
+        {"id": "1-0", "text": HEADER},
+        {"id": "2-0", "text": "Appeals filings rose four percent while criminal filings fell in most districts"},
+        {"id": "3-0", "text": HEADER.replace("probation", "pretrial services")},
+        {"id": "10-0", "text": "Bankruptcy petitions declined for the first time since the recession began"},
+    ]
+    aliases = Dedup(settings).find_aliases(chunks)
+    assert aliases == {"3-0": "1-0", "4-0": "1-0"}
+    assert [chunk["id"] for chunk in drop_aliases(chunks, aliases)] == ["1-0", "2-0", "10-0"]
@@ -0,0 +1,47 @@
+import numpy as np
+from rag_full_cycle.evals import Evals
+
+
+def results(ranks):
+    """One question per rank, its chunk retrieved at that rank of five (0: not retrieved)"""
+    questions = []
+    for i, rank in enumerate(ranks):
+        retrieved = [{"id": f"{i}-{n}"} for n in range(1, 6)]
+        if rank:
+            retrieved[rank - 1] = {"id": f"{i}-0"}
+        questions.append({"question_data": {"chunk_id": f"{i}-0"}, "similar_chunks": retrieved})
+    return questions
+
+
+def test_metrics_from_ranks():
+    metrics = Evals(results([1, 2, 0, 3])).metrics(k=2)
+    assert metrics["questions"] == 4
+    assert metrics["recall"] == 0.5
+    assert metrics["precision"] == 0.25
+    assert np.isclose(metrics["mrr"], (1 + 1 / 2 + 1 / 3) / 4)
+    assert np.isclose(metrics["ndcg"], (1 + 1 / np.log2(3)) / 4)
+    assert metrics["curves"]["recall"] == [0.25, 0.5, 0.75, 0.75, 0.75]
+
+
+def test_bootstrap_intervals_cover_the_estimate_and_narrow_with_more_questions():
+    rng = np.random.default_rng(1)
+    small = Evals(results(rng.integers(0, 6, size=50)), bootstrap_samples=2000).metrics(k=3)
+    large = Evals(results(rng.integers(0, 6, size=2000)), bootstrap_samples=2000).metrics(k=3)
+    for metrics in (small, large):
+        intervals = metrics["confidence_intervals"]
+        assert intervals["level"] == 0.95
+        for name in ("recall", "precision", "mrr", "ndcg"):
+            low, high = intervals[name]
+            assert low <= metrics[name] <= high
+    width = lambda metrics: np.subtract(*metrics["confidence_intervals"]["recall"][::-1])
+    assert width(large) < width(small) / 3
+    # seeded, so reruns report the same intervals
+    assert Evals(results([1, 2, 0, 3]), seed=7).metrics()["confidence_intervals"] == \
+        Evals(results([1, 2, 0, 3]), seed=7).metrics()["confidence_intervals"]
+
+
+def test_retrieved_alias_counts_as_the_correct_chunk():
+    questions = results([0])
+    questions[0]["similar_chunks"][1] = {"id": "9-0"}
+    assert Evals(questions).calculate_recall_at_k(2) == 0.0
+    assert Evals(questions, aliases={"9-0": "0-0"}).calculate_recall_at_k(2) == 1.0
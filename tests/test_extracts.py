@@ -0,0 +1,62 @@
+import dataclasses
+import os
+from pathlib import Path
+import pytest
+from rag_full_cycle.artifacts import ArtifactWriter, RecordWriter, read_records
+from rag_full_cycle.chunks import Chunks, ChunkStream, tokenize_extract
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.extracts import Extracts
+
+PDF = str(Path(__file__).parent.parent / "fy10syb.pdf")
+
+
+def test_pages_are_chunked_while_the_extract_streams(tmp_path):
+    settings = dataclasses.replace(load_settings("fy10"), extraction_workers=2, extraction_pages_per_shard=4)
+    extracts = Extracts(settings)
+    seen = []
+    outputs = {f"{tmp_path}/chunks-{size}.ndjson": Chunks(size, size // 8) for size in (64, 512)}
+    with ChunkStream(outputs) as chunk_stream:
+        def on_page(page):
+            # the extract file is written page by page, not at the end
+            seen.append(page["page"])
+            chunk_stream.add(page)
+        pages = extracts.extract_and_save(PDF, f"{tmp_path}/extract.ndjson", max_pages=21, on_page=on_page)
+
+    extract = read_records(f"{tmp_path}/extract.ndjson")
+    assert pages == len(extract) == len(seen)
+    assert seen == sorted(seen) == [page["page"] for page in extract]
+    tokenized = tokenize_extract(extract)
+    for path, chunker in outputs.items():
+        assert read_records(path) == list(chunker.iter_chunks(tokenized))
+
+
+def test_failed_stream_leaves_no_partial_artifacts(tmp_path):
+    path = f"{tmp_path}/chunks.ndjson"
+    with pytest.raises(RuntimeError):
+        with ChunkStream({path: Chunks(64, 8)}) as chunk_stream:
+            chunk_stream.add({"page": 1, "text": "Some words on the first page."})
+            raise RuntimeError("extraction failed")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_every_chunk_file_is_closed_when_one_fails_to_close(tmp_path, monkeypatch):
+    paths = [f"{tmp_path}/chunks-{size}.ndjson" for size in (64, 128, 256)]
+    close = RecordWriter.close
+
+    def failing_close(self):
+        close(self)
+        if "chunks-128" in self.path:
+            raise OSError("disk full")
+
+    monkeypatch.setattr(RecordWriter, "close", failing_close)
+    with pytest.raises(OSError):
+        with ChunkStream({path: Chunks(64, 8) for path in paths}) as chunk_stream:
+            chunk_stream.add({"page": 1, "text": "Some words on the first page."})
+    assert all(writer.file.closed for writer in chunk_stream.writers.values())
+    # the files closed after the failure are discarded, none is left half written
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+    assert not os.path.exists(paths[0]) and not os.path.exists(paths[1])
+
+
+def test_discard_before_open(tmp_path):
+    ArtifactWriter(f"{tmp_path}/chunks.ndjson").discard()
@@ -0,0 +1,60 @@
+import dataclasses
+import socket
+import numpy as np
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.fake_pinecone import FakePinecone
+from rag_full_cycle.vector_stores import PineconeStore
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def test_upsert_and_query_round_trip():
+    fake = FakePinecone(free_port(), ready_delay=0.2)
+    url = fake.start()
+    try:
+        # small requests so one upsert is split and sent concurrently
+        settings = dataclasses.replace(load_settings("fy10"), pinecone_host=url, pinecone_api_key="local",
+                                       pinecone_upsert_batch_size=16, pinecone_upsert_concurrency=4)
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(100, 8))
+        vectors = [{"id": f"{i}-0", "values": row.tolist(), "metadata": {"page": i}} for i, row in enumerate(matrix)]
+
+        assert PineconeStore(settings, "test-index").upsert_batches([vectors[:60], [], vectors[60:]]) == 100
+        assert fake.requests["upsert"] == 7
+
+        # a second store reuses the index
+        store = PineconeStore(settings, "test-index")
+        assert store.query(matrix[3].tolist(), 3)[0]["id"] == "3-0"
+        results = store.query_batch([matrix[i].tolist() for i in (10, 42, 99)], 5)
+        assert [matches[0]["id"] for matches in results] == ["10-0", "42-0", "99-0"]
+        assert all(len(matches) == 5 for matches in results)
+        assert results[0][0]["score"] >= results[0][1]["score"]
+    finally:
+        fake.stop()
+
+
+def test_rebuild_deletes_dropped_ids():
+    fake = FakePinecone(free_port(), ready_delay=0.2)
+    url = fake.start()
+    try:
+        settings = dataclasses.replace(load_settings("fy10"), pinecone_host=url, pinecone_api_key="local")
+        rng = np.random.default_rng(0)
+        matrix = rng.normal(size=(250, 8))
+        vectors = [{"id": f"{i}-0", "values": row.tolist()} for i, row in enumerate(matrix)]
+        PineconeStore(settings, "test-index").upsert(vectors, 8)
+
+        # a rechunk keeps fewer chunks, more than one page of the id listing is dropped
+        kept = vectors[200:]
+        PineconeStore(settings, "test-index").upsert(kept, 8)
+
+        store = PineconeStore(settings, "test-index")
+        assert sorted(fake.indexes["test-index"].namespaces[settings.pinecone_namespace]) == sorted(v["id"] for v in kept)
+        for i in (0, 150, 199):
+            assert store.query(matrix[i].tolist(), 1)[0]["id"] in {vector["id"] for vector in kept}
+        assert store.query(matrix[220].tolist(), 1)[0]["id"] == "220-0"
+    finally:
+        fake.stop()
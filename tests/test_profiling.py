@@ -0,0 +1,20 @@
+import pstats
+import threading
+from rag_full_cycle.profiling import StepProfiler, profiled_thread
+
+
+def upload():
+    return sum(i * i for i in range(10000))
+
+
+def test_threads_started_by_a_step_are_in_its_profile(tmp_path):
+    profiler = StepProfiler(str(tmp_path))
+    with profiler.profile("vectorize"):
+        thread = threading.Thread(target=profiled_thread(upload))
+        thread.start()
+        thread.join()
+
+    functions = {function for _, _, function in pstats.Stats(f"{tmp_path}/vectorize.pstats").stats}
+    assert "upload" in functions
+    # outside a profiled step threads run as they are
+    assert profiled_thread(upload) is upload
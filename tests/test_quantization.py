@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from rag_full_cycle.ann import exact_top_k, inverse_row_norms, normalize, select_top_k
+from rag_full_cycle.quantization import QuantizedIndex, create_quantizer
+
+
+def recall(rows, exact):
+    return sum(len(np.intersect1d(found, expected)) for found, expected in zip(rows, exact)) / exact.size
+
+
+@pytest.mark.parametrize("method, minimum_recall", [("int8", 0.99), ("pq", 0.8)])
+def test_quantized_search_recall(method, minimum_recall, tmp_path):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 64))
+    matrix = (centers[rng.integers(20, size=3000)] + 0.5 * rng.normal(size=(3000, 64))).astype(np.float32)
+    queries = matrix[:50] + 0.1 * rng.normal(size=(50, 64)).astype(np.float32)
+    inverse_norms = inverse_row_norms(matrix)
+    exact = select_top_k(normalize(queries) @ normalize(matrix).T, 10)[0]
+
+    index = QuantizedIndex(create_quantizer(method, 16), rescore_factor=4)
+    index.build(matrix)
+    rows, scores = index.search(queries, 10, matrix, inverse_norms)
+    assert recall(rows, exact) >= minimum_recall
+    assert recall(index.search(queries, 10, matrix, inverse_norms, rescore_factor=1)[0], exact) <= recall(rows, exact)
+    # rescored against the full vectors, so the scores are exact cosines in order
+    assert np.all(np.diff(scores[0]) <= 0)
+    np.testing.assert_allclose(scores[0][0], normalize(queries[0]) @ normalize(matrix[rows[0][0]]), rtol=1e-5)
+
+    assert index.tune_rescore_factor(queries, 10, matrix, inverse_norms, tolerance=0.0) == 1.0
+    index.save(f"{tmp_path}/index.npz")
+    loaded = QuantizedIndex.load(f"{tmp_path}/index.npz")
+    assert loaded.rescore_factor == index.rescore_factor
+    reloaded_rows = loaded.search(queries, 10, matrix, inverse_norms)[0]
+    assert [row.tolist() for row in reloaded_rows] == [row.tolist() for row in index.search(queries, 10, matrix, inverse_norms)[0]]
+
+
+def test_exact_top_k_in_row_blocks_matches_full_search(tmp_path):
+    rng = np.random.default_rng(1)
+    np.save(f"{tmp_path}/vectors.npy", rng.normal(size=(500, 16)).astype(np.float16))
+    matrix = np.load(f"{tmp_path}/vectors.npy", mmap_mode="r")
+    queries = normalize(rng.normal(size=(20, 16)))
+    inverse_norms = inverse_row_norms(matrix)
+
+    rows, scores = exact_top_k(queries, matrix, inverse_norms, 10, block_size=7)
+    expected_rows, expected_scores = select_top_k((queries @ np.asarray(matrix, dtype=np.float32).T) * inverse_norms, 10)
+    assert rows.tolist() == expected_rows.tolist()
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
@@ -0,0 +1,90 @@
+import dataclasses
+import pytest
+from rag_full_cycle import config
+from rag_full_cycle.artifacts import read_records
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.questions import Questions
+
+
+class FakeChat:
+    """Async chat client that answers every chunk except the ones in failing"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.prompts = []
+
+    async def chat(self, model, messages):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        if any(text in prompt for text in self.failing):
+            raise ConnectionError("model unavailable")
+        return {"message": {"content": "1. First question?\n2. Second question?"}}
+
+
+def make_questions():
+    settings = dataclasses.replace(load_settings("baby"), max_retries=1, response_cache_enabled=False,
+                                   question_generation_prompt="Ask about: {chunk}")
+    return Questions(settings, 100, 10)
+
+
+def test_failed_chunks_fail_the_step_and_are_retried_on_rerun(tmp_path, monkeypatch):
+    chunks = [{"id": f"{page}-0", "text": f"text of page {page}"} for page in range(1, 6)]
+    output = f"{tmp_path}/questions.ndjson"
+    questions = make_questions()
+
+    first = FakeChat(failing=["text of page 3"])
+    monkeypatch.setattr("ollama.AsyncClient", lambda: first)
+    with pytest.raises(RuntimeError, match=r"1 of 5 chunks.*'3-0'"):
+        questions.generate_questions_from_chunks(chunks, output)
+    # the model and prompt header, then the finished chunks
+    assert len(read_records(questions.progress_path(output))) == 1 + 4
+
+    second = FakeChat()
+    monkeypatch.setattr("ollama.AsyncClient", lambda: second)
+    saved = questions.generate_questions_from_chunks(chunks, output)
+    assert second.prompts == ["Ask about: text of page 3"]
+    assert [entry["chunk_id"] for entry in saved] == ["1-0", "2-0", "3-0", "4-0", "5-0"]
+    assert saved[0]["questions"] == ["First question?", "Second question?"]
+    assert read_records(output) == saved
+
+
+def interrupted_run(questions, chunks, output, monkeypatch):
+    monkeypatch.setattr("ollama.AsyncClient", lambda: FakeChat(failing=["text of page 2"]))
+    with pytest.raises(RuntimeError):
+        questions.generate_questions_from_chunks(chunks, output)
+
+
+def test_resume_skips_results_for_changed_text_prompt_or_model(tmp_path, monkeypatch):
+    chunks = [{"id": f"{page}-0", "text": f"text of page {page}"} for page in range(1, 4)]
+    output = f"{tmp_path}/questions.ndjson"
+    interrupted_run(make_questions(), chunks, output, monkeypatch)
+
+    # edited text of one chunk: only that chunk and the failed one are asked again
+    edited = [chunks[0], chunks[1], {"id": "3-0", "text": "new text of page 3"}]
+    chat = FakeChat()
+    monkeypatch.setattr("ollama.AsyncClient", lambda: chat)
+    saved = make_questions().generate_questions_from_chunks(edited, output)
+    assert sorted(chat.prompts) == ["Ask about: new text of page 3", "Ask about: text of page 2"]
+    assert [entry["text"] for entry in saved] == [chunk["text"] for chunk in edited]
+
+    for change in ({"question_generation_prompt": "Quiz me on: {chunk}"}, {"question_model": "other-model"}):
+        interrupted_run(make_questions(), chunks, output, monkeypatch)
+        questions = make_questions()
+        questions.settings = dataclasses.replace(questions.settings, **change)
+        chat = FakeChat()
+        monkeypatch.setattr("ollama.AsyncClient", lambda: chat)
+        questions.generate_questions_from_chunks(chunks, output)
+        assert len(chat.prompts) == 3
+
+
+def test_max_retries_must_allow_one_attempt(monkeypatch):
+    load_json_config = config.load_json_config
+
+    def without_retries(dataset):
+        loaded = load_json_config(dataset)
+        loaded["rate_limiting"]["max_retries"] = 0
+        return loaded
+
+    monkeypatch.setattr(config, "load_json_config", without_retries)
+    with pytest.raises(ValueError, match="max_retries"):
+        load_settings("baby")
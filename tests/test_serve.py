@@ -0,0 +1,58 @@
+import asyncio
+import dataclasses
+import json
+from rag_full_cycle.artifacts import write_records
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.serve import HTTPServer, QueryService
+from rag_full_cycle.vector_stores import VectorStore
+
+
+class OneHotEmbeddings:
+    def embed_many(self, texts):
+        return [[1.0, 0.0] if "first" in text else [0.0, 1.0] for text in texts]
+
+
+class FlakyStore(VectorStore):
+    """Answers from two fixed vectors after failing the first `failures` searches"""
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def query_batch(self, query_embeddings, top_k):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("vector store unavailable")
+        return [[{"id": "1-0" if embedding[0] else "2-0", "score": 1.0}] for embedding in query_embeddings]
+
+
+def make_server(tmp_path, failures=0):
+    settings = dataclasses.replace(load_settings("fy10"), output_dir=str(tmp_path), artifact_compression="none",
+                                   vector_backend="local", serve_max_wait_ms=1)
+    write_records(f"{tmp_path}/chunks-512-64.ndjson", [{"id": "1-0", "text": "one"}, {"id": "2-0", "text": "two"}])
+    service = QueryService(settings, 512, 64, embeddings=OneHotEmbeddings(), store=FlakyStore(failures))
+    return HTTPServer(service, "127.0.0.1", 0)
+
+
+def routes(server, requests):
+    async def run():
+        server.service.start()
+        return [await server.route(*request) for request in requests]
+    return asyncio.run(run())
+
+
+def test_store_errors_are_5xx_and_not_cached(tmp_path):
+    server = make_server(tmp_path, failures=1)
+    failed, answered, cached = routes(server, [("GET", "/search?q=first", b"")] * 3)
+    assert failed[0] == 500 and "unavailable" in failed[1]["error"]
+    assert answered[0] == 200 and not answered[1]["cached"]
+    assert answered[1]["matches"] == [{"id": "1-0", "score": 1.0, "text": "one"}]
+    assert cached[0] == 200 and cached[1]["cached"]
+
+
+def test_post_bodies_must_be_json_objects(tmp_path):
+    server = make_server(tmp_path)
+    responses = routes(server, [
+        ("POST", "/search", body) for body in (b"[]", b'"x"', b"\xff", json.dumps({"query": "second", "top_k": 1}).encode())
+    ])
+    assert [status for status, _ in responses] == [400, 400, 400, 200]
+    assert responses[-1][1]["matches"][0]["id"] == "2-0"
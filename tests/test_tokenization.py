@@ -0,0 +1,36 @@
+from pathlib import Path
+import nltk.tokenize
+import nltk.tokenize.punkt
+from nltk.tokenize import NLTKWordTokenizer, word_tokenize
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+from rag_full_cycle.artifacts import read_records
+from rag_full_cycle.tokenization import ApproximateTokenizer, WordTokenizer, load_tokenizer
+
+EXTRACT = Path(__file__).parent.parent / "src/rag_full_cycle/output/fy10syb/extract.json"
+
+
+def test_words_match_word_tokenize(monkeypatch):
+    # an untrained punkt model stands in for the punkt_tab data, for both sides
+    monkeypatch.setattr(nltk.tokenize, "_get_punkt_tokenizer", lambda language: PunktSentenceTokenizer())
+    monkeypatch.setattr(nltk.tokenize.punkt, "PunktTokenizer", lambda language: PunktSentenceTokenizer())
+    tokenizer = WordTokenizer()
+    for page in read_records(str(EXTRACT))[:40]:
+        text = page["text"]
+        assert [text[start:end] for start, end in tokenizer.spans(text)] == [
+            word.replace("``", '"').replace("''", '"') for word in word_tokenize(text)
+        ]
+
+
+def test_words_without_punkt_data_count_per_page(monkeypatch):
+    def missing(language):
+        raise LookupError("punkt_tab")
+    monkeypatch.setattr(nltk.tokenize.punkt, "PunktTokenizer", missing)
+    tokenizer = WordTokenizer()
+    text = "The court ruled. Appeals rose by 5 percent."
+    assert tokenizer.spans(text).tolist() == [list(span) for span in NLTKWordTokenizer().span_tokenize(text)]
+
+
+def test_unknown_tokenizer_falls_back_without_downloading():
+    tokenizer = load_tokenizer("no-such-org/no-such-model")
+    assert isinstance(tokenizer, ApproximateTokenizer)
+    assert load_tokenizer("no-such-org/no-such-model") is tokenizer
@@ -0,0 +1,81 @@
+import dataclasses
+import os
+import pytest
+from rag_full_cycle import vector_stores
+from rag_full_cycle.config import load_settings
+from rag_full_cycle.embeddings import Embeddings
+from rag_full_cycle.vector_stores import VectorStore
+from rag_full_cycle.vectors import Vectors
+
+
+def test_batches_answered_from_the_cache_do_not_wait(tmp_path, monkeypatch):
+    settings = dataclasses.replace(load_settings("fy10"), cache_dir=str(tmp_path), batch_size=2,
+                                   delay_between_batches=1.0, vector_backend="local", output_dir=str(tmp_path))
+    posted = []
+    sleeps = []
+    monkeypatch.setattr(Embeddings, "post_embeddings", lambda self, texts: posted.append(texts) or [[float(len(t)), 1.0] for t in texts])
+    monkeypatch.setattr("time.sleep", sleeps.append)
+    chunks = [{"id": f"{page}-0", "text": "x" * page} for page in range(1, 6)]
+    vectors = Vectors(settings, 512, 64)
+
+    assert len(vectors.generate_embeddings_for_chunks(chunks)) == 5
+    assert len(posted) == 3 and sleeps == [1.0, 1.0]
+
+    # the first four chunks are cached now, only the batch with a new text calls the server
+    chunks[4] = {"id": "5-0", "text": "new text"}
+    posted.clear()
+    sleeps.clear()
+    vectors.generate_embeddings_for_chunks(chunks)
+    assert posted == [["new text"]] and sleeps == []
+
+
+class RecordingStore(VectorStore):
+    def __init__(self):
+        self.completed = []
+
+    def upsert_batches(self, batches):
+        vectors = [vector for batch in batches for vector in batch]
+        self.completed.append(vectors)
+        return len(vectors)
+
+
+def test_failed_batch_fails_the_step_without_completing_the_upload(tmp_path, monkeypatch):
+    settings = dataclasses.replace(load_settings("fy10"), cache_dir=str(tmp_path), batch_size=2,
+                                   delay_between_batches=0.0, max_retries=1, output_dir=str(tmp_path))
+    posted = []
+
+    def post(self, texts):
+        posted.append(texts)
+        if "bad" in texts:
+            raise ConnectionError("embedding server unavailable")
+        return [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setattr(Embeddings, "post_embeddings", post)
+    chunks = [{"id": f"{page}-0", "text": text} for page, text in enumerate(["a", "bb", "bad", "cccc", "ddddd"], 1)]
+    store = RecordingStore()
+
+    with pytest.raises(RuntimeError, match=r"1 batches of 2 chunks, starting at chunks \[2\]"):
+        Vectors(settings, 512, 64, store=store).process_chunks_to_vectors(chunks, f"{tmp_path}/vectors.npy")
+    # every batch was still tried, and the store never saw the end of an incomplete upload
+    assert len(posted) == 3 and store.completed == []
+
+    monkeypatch.setattr(Embeddings, "post_embeddings", lambda self, texts: posted.append(texts) or [[1.0, 1.0] for t in texts])
+    posted.clear()
+    assert Vectors(settings, 512, 64, store=store).process_chunks_to_vectors(chunks, f"{tmp_path}/vectors.npy")
+    assert posted == [["bad", "cccc"]] and len(store.completed[0]) == 5
+
+
+def test_local_backend_reads_the_saved_vector_file_instead_of_writing_it_again(tmp_path, monkeypatch):
+    settings = dataclasses.replace(load_settings("fy10"), cache_dir=str(tmp_path), batch_size=2, delay_between_batches=0.0,
+                                   vector_backend="local", output_dir=str(tmp_path / "run.npy.d"))
+    (tmp_path / "run.npy.d").mkdir()
+    monkeypatch.setattr(Embeddings, "post_embeddings", lambda self, texts: [[float(len(t)), 1.0] for t in texts])
+    saved = []
+    monkeypatch.setattr(vector_stores, "save_vector_file", lambda *args: saved.append(args[0]))
+    chunks = [{"id": f"{page}-0", "text": "x" * page} for page in range(1, 6)]
+    vectors = Vectors(settings, 512, 64)
+
+    assert vectors.process_chunks_to_vectors(chunks, vectors.store.vectors_path)
+    assert saved == []
+    assert os.path.exists(f"{tmp_path}/run.npy.d/vectors-512-64.ids.npy")
+    assert vectors.store.query([1.0, 0.0], 1)[0]["id"] == "5-0"